@@ -0,0 +1,170 @@
+"""ASGI entry point. Serves the webhooks that arrive in volume (Gravity Forms workout and delete requests, and the
+Approve, Refresh and Mark Complete buttons) on one event loop with AsyncMapApprovalHandler, so hundreds of approvals can
+wait on Gravity Forms, Google and Slack at once without a thread each. Other Slack interactions are handed to main.py's
+dispatcher, under its per job type limits. Every other route is the Flask app in main.py, run through asgiref.
+
+    uvicorn asgi:app --port 8080
+
+Jobs accepted here are written to the same job store as main.py's, so a failed one is retried by the dispatcher
+(on a worker thread, with the sync handler) and one interrupted by a restart is replayed on the next start.
+"""
+import os
+import asyncio
+import logging
+import json
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+import main
+from handlers.async_map_approval import AsyncMapApprovalHandler
+from services.dispatcher import Dispatcher, Job_Type
+from services.job_store import JobStore
+from services.dedup import Deduplicator
+from services.async_http import AsyncHttpSession
+from services.metrics import Metrics
+from services.tracing import Tracing
+
+MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '500'))
+DRAIN_TIMEOUT_SECONDS = float(os.getenv('DISPATCHER_DRAIN_TIMEOUT_SECONDS', '8'))
+
+map_approval = AsyncMapApprovalHandler(main.map_approval)
+flask_app = WsgiToAsgi(main.app)
+in_flight = set()
+
+main.metrics.add_gauge('async_in_flight', 'Jobs running on the event loop.', lambda: len(in_flight))
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def respond(send, status: int, text: str = '') -> None:
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+async def run(job_type: Job_Type, kwargs: dict, jobId: int, target) -> None:
+    """Same bookkeeping as Dispatcher._run, for a job running on the event loop. Job store writes go to a worker thread."""
+
+    await asyncio.to_thread(main.job_store.mark_running, jobId)
+    with JobStore.track_writes(main.job_store, jobId) as writes:
+        try:
+            with Tracing.trace(job_type.name, trace_id='job-' + str(jobId)), Metrics.get_shared().timed('handler', job_type.name):
+                await target(**kwargs)
+        except Exception as error:
+            logging.exception('Unhandled error while running ' + job_type.name + ' job.')
+            await asyncio.to_thread(Dispatcher.fail_job, main.job_store, jobId, error, writes)
+            return
+
+    await asyncio.to_thread(main.job_store.mark_done, jobId)
+
+
+async def dispatch(job_type: Job_Type, kwargs: dict, target, dedup_keys: list, coalesce_key: str|None = None) -> tuple:
+    """Starts the job on the event loop and returns the (status, text) to respond with, like main.dispatch.
+    With no target, the job is submitted to main.dispatcher instead, to run with the sync handler.
+    A job held to coalesce resubmissions is left to the dispatcher's poll, which also runs it with the sync handler.
+    """
+
+    if not main.deduplicator.claim(dedup_keys):
+        return (200, '')
+
+    if target is None:
+        if not await asyncio.to_thread(main.dispatcher.submit, job_type, kwargs):
+            main.deduplicator.release(dedup_keys)
+            return (503, 'Too many requests are being processed. Try again shortly.')
+        return (200, '')
+
+    if len(in_flight) >= MAX_IN_FLIGHT:
+        main.deduplicator.release(dedup_keys)
+        logging.warning('Event loop is running ' + str(len(in_flight)) + ' jobs. Rejected ' + job_type.name + ' job.')
+        return (503, 'Too many requests are being processed. Try again shortly.')
+
+    if coalesce_key is not None and main.EDIT_DEBOUNCE_SECONDS > 0:
+        (jobId, run_now) = await asyncio.to_thread(main.job_store.add_debounced, job_type.name, kwargs, coalesce_key, main.EDIT_DEBOUNCE_SECONDS, max(main.EDIT_DEBOUNCE_SECONDS, main.EDIT_DEBOUNCE_MAX_SECONDS))
+        if not run_now:
+            logging.info('Holding ' + job_type.name + ' job ' + str(jobId) + ' for ' + coalesce_key + ' to coalesce rapid resubmissions.')
+            return (200, '')
+    else:
+        jobId = await asyncio.to_thread(main.job_store.add, job_type.name, kwargs)
+
+    task = asyncio.ensure_future(run(job_type, kwargs, jobId, target))
+    in_flight.add(task)
+    task.add_done_callback(in_flight.discard)
+    return (200, '')
+
+
+async def capture(path: str, payload, form: bool = False) -> None:
+    if main.capture.enabled:
+        await asyncio.to_thread(main.capture.record, path, payload, form)
+
+
+async def route_gravity_forms_workout(path: str, body: bytes) -> tuple:
+    entry = json.loads(body)
+    await capture(path, entry)
+    return await dispatch(Job_Type.GravityFormsWorkout, {'entry':entry}, map_approval.handle_gravity_forms_submission, Deduplicator.get_gravity_forms_keys('workout', entry), main.get_workout_coalesce_key(entry))
+
+
+async def route_gravity_forms_workout_delete(path: str, body: bytes) -> tuple:
+    entry = json.loads(body)
+    await capture(path, entry)
+    return await dispatch(Job_Type.GravityFormsWorkoutDelete, {'entry':entry}, map_approval.handle_gravity_forms_delete, Deduplicator.get_gravity_forms_keys('workoutdelete', entry))
+
+
+async def route_slack(path: str, body: bytes) -> tuple:
+    payload = json.loads(parse_qs(body.decode())['payload'][0])
+    logging.debug(payload)
+
+    if payload['type'] == 'block_actions':
+        (job_type, target) = (Job_Type.SlackAction, map_approval.handle_slack_action if AsyncMapApprovalHandler.handles_slack_action(payload) else None)
+    elif payload['type'] == 'view_submission':
+        (job_type, target) = (Job_Type.SlackViewSubmission, None)
+    else:
+        logging.warning('Received an interactive message from Slack with an unhandled type: ' + payload['type'])
+        return (400, '')
+
+    await capture(path, payload, form=True)
+    return await dispatch(job_type, {'body':payload}, target, Deduplicator.get_slack_keys(payload))
+
+
+ROUTES = {'/webhooks/gravityforms/workout': route_gravity_forms_workout,
+          '/webhooks/gravityforms/workoutdelete': route_gravity_forms_workout_delete,
+          '/webhooks/slack': route_slack}
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Jobs still running after the timeout stay unfinished in the job store and are replayed on the next start.
+            if len(in_flight) > 0:
+                logging.info('Event loop draining ' + str(len(in_flight)) + ' jobs.')
+                await asyncio.wait(list(in_flight), timeout=DRAIN_TIMEOUT_SECONDS)
+            await AsyncHttpSession.get_shared().close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    route = ROUTES.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+    if route is None:
+        await flask_app(scope, receive, send)
+        return
+
+    body = await read_body(receive)
+    try:
+        (status, text) = await route(scope['path'], body)
+    except (ValueError, KeyError, TypeError, IndexError):
+        logging.exception('Could not read the payload sent to ' + scope['path'] + '.')
+        (status, text) = (400, '')
+
+    await respond(send, status, text)
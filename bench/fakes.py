@@ -0,0 +1,327 @@
+"""Local stand-ins for the services the app calls: Gravity Forms REST, the Slack Web API, Google Maps geocoding,
+the workout history Apps Script and SMTP. Each one serves on 127.0.0.1, counts calls by operation, and can add
+latency (with jitter) and fail a fraction of calls.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+class FakeBehavior:
+    """Latency and error injection shared by the fakes. error_rate is the fraction of calls (0 to 1) that fail."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, seed: int|None = None) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> None:
+        with self._lock:
+            seconds = max(0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+class _FakeHttpService:
+    """Base for the HTTP fakes. Subclasses implement handle(method, path, query, body) returning (status, json body)."""
+    name = 'fake'
+
+    def __init__(self, behavior: FakeBehavior) -> None:
+        self.behavior = behavior
+        self.calls = Counter()
+        self.errors = Counter()
+        self._calls_lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> str:
+        """Starts serving on a free port and returns the base URL."""
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._serve('GET')
+
+            def do_POST(self):
+                self._serve('POST')
+
+            def do_PUT(self):
+                self._serve('PUT')
+
+            def do_DELETE(self):
+                self._serve('DELETE')
+
+            def _serve(self, method: str) -> None:
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length > 0 else b''
+                body = {}
+                if raw:
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        body = json.loads(raw)
+                    else:
+                        body = {key: values[0] for (key, values) in parse_qs(raw.decode()).items()}
+                query = {key: values[0] for (key, values) in parse_qs(url.query).items()}
+
+                (status, payload) = service._dispatch(method, url.path, query, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-' + self.name, daemon=True).start()
+        return 'http://127.0.0.1:' + str(self._server.server_port)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+    def reset_counts(self) -> None:
+        with self._calls_lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def _dispatch(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        operation = self.get_operation(method, path, query, body)
+        self.behavior.delay()
+        with self._calls_lock:
+            self.calls[operation] += 1
+        if self.behavior.should_fail():
+            with self._calls_lock:
+                self.errors[operation] += 1
+            return (500, {'ok': False, 'error': 'injected_error', 'Status': 500, 'Message': 'Injected error'})
+
+        return self.handle(method, path, query, body)
+
+    def get_operation(self, method: str, path: str, query: dict, body: dict) -> str:
+        return method + ' ' + path
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        raise NotImplementedError
+
+
+class FakeGravityForms(_FakeHttpService):
+    """Entries live in memory, keyed by ID. PUT bumps date_updated and DELETE moves an entry to the trash, like WordPress."""
+    name = 'gravity_forms'
+
+    def __init__(self, behavior: FakeBehavior) -> None:
+        super().__init__(behavior)
+        self.entries = {}
+        self._entries_lock = threading.Lock()
+
+    def add_entry(self, entry: dict) -> None:
+        with self._entries_lock:
+            self.entries[str(entry['id'])] = dict(entry)
+
+    def get_operation(self, method: str, path: str, query: dict, body: dict) -> str:
+        if path.endswith('/entries') and '/forms/' in path:
+            return 'get_unapproved_count'
+        return {'GET': 'get_entry', 'PUT': 'update_entry', 'DELETE': 'trash_entry'}.get(method, method)
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        pieces = path.strip('/').split('/')
+        with self._entries_lock:
+            if pieces[-1] == 'entries' and 'forms' in pieces:
+                formId = pieces[-2]
+                count = len([entry for entry in self.entries.values() if entry.get('form_id') == formId and entry.get('is_approved') == '3'])
+                return (200, {'total_count': count})
+
+            entry = self.entries.get(pieces[-1])
+            if entry is None:
+                return (404, {'code': 'not_found', 'message': 'Entry not found'})
+
+            if method == 'PUT':
+                entry.update(body)
+                entry['date_updated'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            elif method == 'DELETE':
+                entry['status'] = 'trash'
+
+            return (200, dict(entry))
+
+
+class FakeSlack(_FakeHttpService):
+    """Answers the Web API methods the app uses. on_message is called with (method, channel, ts, message) for every
+    chat.postMessage and chat.update, so a driver can tell when a webhook has reached Slack.
+    """
+    name = 'slack'
+
+    def __init__(self, behavior: FakeBehavior, on_message=None) -> None:
+        super().__init__(behavior)
+        self.messages = {}
+        self.on_message = on_message
+        self._messages_lock = threading.Lock()
+        self._next_ts = 1700000000.0
+
+    def get_operation(self, method: str, path: str, query: dict, body: dict) -> str:
+        return path.rstrip('/').split('/')[-1]
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        operation = self.get_operation(method, path, query, body)
+        arguments = dict(query)
+        arguments.update(body)
+
+        if operation in ('chat.postMessage', 'chat.update'):
+            blocks = arguments.get('blocks') or []
+            if isinstance(blocks, str):
+                blocks = json.loads(blocks)
+            blocks = [dict(block, block_id=block.get('block_id', 'b' + str(index))) for (index, block) in enumerate(blocks)]
+            channel = arguments.get('channel')
+            with self._messages_lock:
+                if operation == 'chat.postMessage':
+                    self._next_ts += 1
+                    ts = '{0:.6f}'.format(self._next_ts)
+                else:
+                    ts = arguments.get('ts')
+                message = {'type': 'message', 'ts': ts, 'text': arguments.get('text'), 'blocks': blocks, 'thread_ts': arguments.get('thread_ts')}
+                self.messages[(channel, ts)] = message
+
+            if self.on_message is not None:
+                self.on_message(operation, channel, ts, message)
+            return (200, {'ok': True, 'channel': channel, 'ts': ts, 'message': message})
+
+        if operation == 'conversations.history':
+            with self._messages_lock:
+                message = self.messages.get((arguments.get('channel'), arguments.get('oldest')))
+            return (200, {'ok': True, 'messages': [] if message is None else [message]})
+
+        if operation == 'users.profile.get':
+            return (200, {'ok': True, 'profile': {'display_name_normalized': 'bench-' + str(arguments.get('user'))}})
+
+        if operation == 'users.list':
+            return (200, {'ok': True, 'members': [], 'response_metadata': {'next_cursor': ''}})
+
+        if operation in ('views.open', 'views.update'):
+            return (200, {'ok': True, 'view': {'id': 'VBENCH'}})
+
+        return (200, {'ok': True})
+
+
+class FakeGoogleMaps(_FakeHttpService):
+    """Geocodes every address to the same point and reverse geocodes every point to the same address."""
+    name = 'google_maps'
+
+    def get_operation(self, method: str, path: str, query: dict, body: dict) -> str:
+        return 'reverse_geocode' if 'latlng' in query else 'geocode'
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        return (200, {'status': 'OK', 'results': [{'types': ['street_address'],
+                                                    'formatted_address': '1 Bench St, Charlotte, NC 28202, USA',
+                                                    'geometry': {'location': {'lat': 35.2271, 'lng': -80.8431}}}]})
+
+
+class FakeGoogleSheets(_FakeHttpService):
+    """The workout history Apps Script. rows are dicts keyed by column name; the trailing column the app skips is added here."""
+    name = 'google_sheets'
+
+    def __init__(self, behavior: FakeBehavior, fields: list) -> None:
+        super().__init__(behavior)
+        self.fields = fields
+        self.rows = {}
+
+    def add_row(self, row: dict) -> None:
+        self.rows[str(row['Entry ID'])] = row
+
+    def get_operation(self, method: str, path: str, query: dict, body: dict) -> str:
+        return 'get_single_entity' if 'entryid' in query else 'get_dataset'
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        header = self.fields + ['Last Updated']
+        if 'entryid' in query:
+            row = self.rows.get(str(query['entryid']))
+            if row is None:
+                return (200, {'Status': 404, 'Message': 'Entry not found'})
+            return (200, {'Status': 200, 'Data': [header, [row.get(field, '') for field in self.fields] + ['']]})
+
+        return (200, {'Status': 200, 'Data': [header] + [[row.get(field, '') for field in self.fields] + [''] for row in self.rows.values()]})
+
+
+class FakeSmtp:
+    """Accepts mail over plain SMTP (no STARTTLS) with any AUTH credentials. Counts messages accepted."""
+    name = 'smtp'
+
+    def __init__(self, behavior: FakeBehavior) -> None:
+        self.behavior = behavior
+        self.calls = Counter()
+        self.errors = Counter()
+        self._calls_lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> tuple:
+        """Starts serving on a free port and returns (host, port)."""
+
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self._reply('220 fake-smtp ready')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors='replace').strip()
+                    verb = command.split(' ')[0].upper()
+
+                    if verb in ('EHLO', 'HELO'):
+                        self._reply('250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME')
+                    elif verb == 'AUTH':
+                        service._count('login')
+                        self._reply('235 Authentication successful')
+                    elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self._reply('250 OK')
+                    elif verb == 'DATA':
+                        self._reply('354 End data with <CR><LF>.<CR><LF>')
+                        while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                            pass
+                        service.behavior.delay()
+                        service._count('send_message')
+                        if service.behavior.should_fail():
+                            with service._calls_lock:
+                                service.errors['send_message'] += 1
+                            self._reply('451 Injected error')
+                        else:
+                            self._reply('250 OK queued')
+                    elif verb == 'QUIT':
+                        self._reply('221 Bye')
+                        return
+                    else:
+                        self._reply('502 Command not implemented')
+
+            def _reply(self, text: str) -> None:
+                self.wfile.write(text.encode() + b'\r\n')
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-smtp', daemon=True).start()
+        return ('127.0.0.1', self._server.server_address[1])
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+    def reset_counts(self) -> None:
+        with self._calls_lock:
+            self.calls.clear()
+            self.errors.clear()
+
+    def _count(self, operation: str) -> None:
+        with self._calls_lock:
+            self.calls[operation] += 1
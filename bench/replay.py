@@ -0,0 +1,144 @@
+"""Sends webhooks captured with CAPTURE_PAYLOADS_PATH back to an instance and reports throughput and error rates.
+
+    python bench/replay.py captured.jsonl --target http://localhost:8080 --rate 20
+    python bench/replay.py captured.jsonl --target https://staging.example.run.app --time-scale 10 --repeat 3
+
+--rate sends at a fixed number of webhooks per second. --time-scale keeps the captured spacing, sped up by the
+given factor. Without either, webhooks are sent as fast as --concurrency allows.
+
+Replayed payloads make real downstream calls, so point this at an instance wired to test services (or to the fakes
+in bench/run.py). By default each replay gets new dedup keys (date_updated, action_ts, view hash) so the instance's
+duplicate suppression does not drop it (clicks on the same button less than DEDUP_DOUBLE_CLICK_SECONDS apart
+still are). Pass --keep-ids to replay byte for byte, e.g. to test the deduplication itself.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.run import percentile
+
+
+def load(path: str) -> list:
+    with open(path, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    return sorted(records, key=lambda record: record['at'])
+
+
+def make_unique(record: dict, shift_seconds: int) -> dict:
+    """Moves the fields the instance deduplicates on by shift_seconds, without changing what the webhook means.
+    Webhooks that were duplicates of each other in the capture stay duplicates of each other.
+    """
+
+    record = copy.deepcopy(record)
+    payload = record['payload']
+
+    if not record['form']:
+        # Gravity Forms entries are deduplicated on (id, date_updated). Shift both dates together so New stays New.
+        for field in ('date_created', 'date_updated'):
+            if payload.get(field, '0000-00-00 00:00:00') != '0000-00-00 00:00:00':
+                shifted = datetime.datetime.strptime(payload[field], '%Y-%m-%d %H:%M:%S') + datetime.timedelta(seconds=shift_seconds)
+                payload[field] = shifted.strftime('%Y-%m-%d %H:%M:%S')
+    elif payload.get('type') == 'block_actions':
+        for action in payload.get('actions', []):
+            action['action_ts'] = '{0:.6f}'.format(float(action.get('action_ts', time.time())) + shift_seconds)
+    elif payload.get('type') == 'view_submission':
+        payload.setdefault('view', {})['hash'] = str(payload['view'].get('hash', '')) + '-' + str(shift_seconds)
+
+    return record
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay captured webhooks against an instance.')
+    parser.add_argument('path', help='File written by CAPTURE_PAYLOADS_PATH.')
+    parser.add_argument('--target', required=True, help='Base URL of the instance, e.g. http://localhost:8080')
+    schedule = parser.add_mutually_exclusive_group()
+    schedule.add_argument('--rate', type=float, help='Webhooks per second.')
+    schedule.add_argument('--time-scale', type=float, help='Replay the captured schedule this many times faster.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Webhooks in flight at once.')
+    parser.add_argument('--repeat', type=int, default=1, help='Times to replay the whole capture.')
+    parser.add_argument('--keep-ids', action='store_true', help='Send payloads unchanged, so repeats look like duplicates.')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for each response.')
+    args = parser.parse_args()
+
+    records = load(args.path)
+    if len(records) == 0:
+        print('No webhooks in ' + args.path + '.')
+        return
+
+    # Build the schedule up front: (seconds after start, record)
+    plan = []
+    offset = 0.0
+    duration = records[-1]['at'] - records[0]['at']
+    nonce = int(time.time()) % 86400 # Differs between runs, so replaying twice against one instance is not deduplicated either
+    for repetition in range(args.repeat):
+        for record in records:
+            if args.rate:
+                due = len(plan) / args.rate
+            elif args.time_scale:
+                due = offset + (record['at'] - records[0]['at']) / args.time_scale
+            else:
+                due = 0.0
+            plan.append((due, record if args.keep_ids else make_unique(record, nonce + repetition)))
+        if args.time_scale:
+            offset += duration / args.time_scale
+
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    lock = threading.Lock()
+    statuses = Counter()
+    routes = Counter()
+    latencies = []
+
+    def send(record: dict) -> None:
+        url = args.target.rstrip('/') + record['route']
+        start = time.perf_counter()
+        try:
+            if record['form']:
+                response = session.post(url, data={'payload': json.dumps(record['payload'])}, timeout=args.timeout)
+            else:
+                response = session.post(url, json=record['payload'], timeout=args.timeout)
+            status = str(response.status_code)
+        except requests.RequestException as error:
+            status = type(error).__name__
+
+        with lock:
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            routes[record['route']] += 1
+
+    start = time.perf_counter()
+    lateness = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for (due, record) in plan:
+            wait = due - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+            elif (args.rate or args.time_scale) and wait < -0.05:
+                lateness.append(-wait)
+            executor.submit(send, record)
+    elapsed = time.perf_counter() - start
+
+    sent = len(plan)
+    failed = sum(count for (status, count) in statuses.items() if not status.startswith('2'))
+    print('sent: ' + str(sent) + ' in ' + str(round(elapsed, 2)) + ' s (' + str(round(sent / elapsed, 1)) + ' webhooks/sec)')
+    print('errors: ' + str(failed) + ' (' + '{0:.1%}'.format(failed / sent) + ')')
+    print('response: p50 ' + str(round(percentile(latencies, 50) * 1000, 1)) + ' ms   p99 ' + str(round(percentile(latencies, 99) * 1000, 1)) + ' ms')
+    if len(lateness) > 0:
+        print('behind schedule: ' + str(len(lateness)) + ' sends, worst by ' + str(round(max(lateness) * 1000)) + ' ms (raise --concurrency)')
+    print('by status: ' + ', '.join(status + ' ' + str(count) for (status, count) in sorted(statuses.items())))
+    print('by route: ' + ', '.join(route + ' ' + str(count) for (route, count) in sorted(routes.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Drives main.py's webhook routes against local stand-ins for every external service and reports throughput,
+end-to-end latency and downstream call counts.
+
+    python bench/run.py --scenario all --count 200 --concurrency 16 --latency-ms 80 --jitter-ms 40
+    python bench/run.py --scenario approve --error-rate 0.05 --latency slack=300
+    python bench/run.py --asgi --concurrency 64 --latency-ms 200
+
+Scenarios:
+    new      Gravity Forms webhooks for new workouts. Done when the request message is posted to Slack.
+    update   Gravity Forms webhooks for updated workouts. Done when the previous values are posted in the thread.
+    approve  Slack Approve clicks on posted requests. Done when the Slack message is updated.
+
+End-to-end latency runs from sending the webhook to the fake Slack receiving the final message, so it includes the
+dispatcher queue, every downstream call and Slack rate limiting. The app is configured through its usual environment
+variables, which can be overridden from the shell (e.g. DISPATCHER_WORKERS=16). SLACK_POST_RATE_PER_SECOND defaults
+to 1000 here instead of 1 so the Slack rate limit does not hide everything else; set it to 1 to measure production pacing.
+
+--asgi serves asgi.py with uvicorn on a local port and sends the webhooks to it over HTTP, instead of calling the
+Flask app in process, so the thread-per-job and event loop handlers can be compared on the same workload.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.fakes import FakeBehavior, FakeGravityForms, FakeSlack, FakeGoogleMaps, FakeGoogleSheets, FakeSmtp
+
+_WORKOUT_FORM_ID = '1'
+_HISTORY_FIELDS = ['Workout Name', 'Region', 'Time', 'Type', 'Latitude', 'Longitude', 'Weekday', 'Note', 'Website', 'Logo',
+                   'Address 1', 'Address 2', 'City', 'State', 'Postal Code', 'Country', 'Address Accurate?', 'Stationary?',
+                   'Submitter', 'Submitter Email', 'Entry ID']
+
+
+class Tracker:
+    """Matches the messages the fake Slack receives to the webhooks that caused them."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Condition()
+        self._expected = {}
+        self._done = {}
+        self._entry_by_ts = {}
+        self.ts_by_entry = {}
+
+    def expect(self, key: tuple) -> None:
+        with self._lock:
+            self._expected[key] = time.perf_counter()
+
+    def on_message(self, operation: str, channel: str, ts: str, message: dict) -> None:
+        with self._lock:
+            if operation == 'chat.update':
+                key = ('update', self._entry_by_ts.get(ts))
+            elif message.get('thread_ts'):
+                key = ('thread', self._entry_by_ts.get(message['thread_ts']))
+            else:
+                entryId = Tracker._get_entry_id(message.get('blocks') or [])
+                if entryId is None:
+                    return
+                self._entry_by_ts[ts] = entryId
+                self.ts_by_entry[entryId] = (channel, ts)
+                key = ('post', entryId)
+
+            if key in self._expected and key not in self._done:
+                self._done[key] = time.perf_counter()
+                self._lock.notify_all()
+
+    def wait(self, timeout: float) -> None:
+        with self._lock:
+            self._lock.wait_for(lambda: len(self._done) >= len(self._expected), timeout=timeout)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._expected.clear()
+            self._done.clear()
+
+    def get_latencies(self) -> tuple:
+        """Returns (end-to-end seconds for completed webhooks, number not completed, time the last one completed)."""
+
+        with self._lock:
+            latencies = [self._done[key] - sent_at for (key, sent_at) in self._expected.items() if key in self._done]
+            last = max(self._done.values()) if len(self._done) > 0 else None
+            return (latencies, len(self._expected) - len(latencies), last)
+
+    def _get_entry_id(blocks: list) -> str|None:
+        for block in blocks:
+            for element in block.get('elements', []):
+                value = element.get('value', '')
+                if value.startswith('Approve_'):
+                    return value.split('_')[1]
+        return None
+
+
+def make_entry(entryId: int, update: bool) -> dict:
+    created = '2024-01-01 12:00:00'
+    return {'id': str(entryId), 'form_id': _WORKOUT_FORM_ID, 'status': 'active', 'is_approved': '3',
+            'date_created': created, 'date_updated': '2024-02-01 12:00:00' if update else created,
+            '21': 'Bench Region', '2': 'The Bench ' + str(entryId), '24': 'Yes', '23': 'Yes',
+            '1.1': str(entryId) + ' Main St', '1.2': '', '1.3': 'Charlotte', '1.4': 'NC', '1.5': '28202', '1.6': 'United States',
+            '13': '{0:.5f}'.format(35 + entryId % 100000 / 10000 + entryId // 100000 / 10), '12': '{0:.5f}'.format(-80 - entryId % 100000 / 10000),
+            '14': 'Monday', '4': '0530', '5': 'Bootcamp', '17': 'https://example.com', '16': '', '15': 'Bench notes',
+            '18': 'Bench Submitter', '19': 'bench@example.com'}
+
+
+def make_history_row(entry: dict) -> dict:
+    """The workout as it was before the update: a different name and time, so the thread has something to report."""
+
+    return {'Workout Name': 'Old ' + entry['2'], 'Region': entry['21'], 'Time': '0600', 'Type': entry['5'],
+            'Latitude': entry['13'], 'Longitude': entry['12'], 'Weekday': entry['14'], 'Note': entry['15'], 'Website': entry['17'],
+            'Logo': entry['16'], 'Address 1': entry['1.1'], 'Address 2': entry['1.2'], 'City': entry['1.3'], 'State': entry['1.4'],
+            'Postal Code': entry['1.5'], 'Country': entry['1.6'], 'Address Accurate?': entry['23'], 'Stationary?': entry['24'],
+            'Submitter': entry['18'], 'Submitter Email': entry['19'], 'Entry ID': entry['id']}
+
+
+def percentile(values: list, percent: float) -> float:
+    if len(values) == 0:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def send_all(post, requests: list, concurrency: int, tracker: Tracker) -> list:
+    """requests is a list of (tracker key, path, kwargs for post). post takes the path and the kwargs, like the
+    Flask test client's post, and returns a response with a status_code. Returns ack latencies in seconds and the status codes.
+    """
+
+    def send(request: tuple) -> tuple:
+        (key, path, kwargs) = request
+        tracker.expect(key)
+        start = time.perf_counter()
+        response = post(path, **kwargs)
+        return (time.perf_counter() - start, response.status_code)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, requests))
+
+
+def build_requests(scenario: str, entries: list, slack: FakeSlack, tracker: Tracker) -> list:
+    if scenario == 'new':
+        return [(('post', entry['id']), '/webhooks/gravityforms/workout', {'json': entry}) for entry in entries]
+
+    if scenario == 'update':
+        return [(('thread', entry['id']), '/webhooks/gravityforms/workout', {'json': entry}) for entry in entries]
+
+    requests = []
+    for entry in entries:
+        (channel, ts) = tracker.ts_by_entry[entry['id']]
+        body = {'type': 'block_actions', 'user': {'id': 'UBENCH'}, 'container': {'message_ts': ts}, 'message': slack.messages[(channel, ts)],
+                'actions': [{'value': 'Approve_' + entry['id'], 'action_ts': '{0:.6f}'.format(time.time())}]}
+        requests.append((('update', entry['id']), '/webhooks/slack', {'data': {'payload': json.dumps(body)}}))
+    return requests
+
+
+def serve_asgi() -> str:
+    """Starts asgi.py under uvicorn on a free local port and returns its base URL."""
+
+    import uvicorn
+    import asgi
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=port, log_level='warning', lifespan='off'))
+    threading.Thread(target=server.run, name='bench-uvicorn', daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    return 'http://127.0.0.1:' + str(port)
+
+
+def wait_for_email_jobs(main, timeout: float) -> None:
+    """Emails are sent by Email jobs after the final Slack message, so wait for them before reading the call counts."""
+
+    deadline = time.monotonic() + timeout
+    while main.dispatcher.get_queue_depth() > 0 or main.dispatcher.get_in_flight().get('Email', 0) > 0:
+        if time.monotonic() > deadline:
+            return
+        time.sleep(0.01)
+
+
+def run_scenario(scenario: str, args, main, post, fakes: dict, tracker: Tracker, first_id: int) -> dict:
+    entries = [make_entry(first_id + index, update=(scenario == 'update')) for index in range(args.count)]
+    for entry in entries:
+        fakes['gravity_forms'].add_entry(entry)
+
+    if scenario == 'approve':
+        # Post the requests first, unmeasured, so there are messages to approve.
+        tracker.reset()
+        send_all(post, build_requests('new', entries, fakes['slack'], tracker), args.concurrency, tracker)
+        tracker.wait(args.timeout)
+
+    tracker.reset()
+    for fake in fakes.values():
+        fake.reset_counts()
+
+    requests = build_requests(scenario, entries, fakes['slack'], tracker)
+    start = time.perf_counter()
+    acks = send_all(post, requests, args.concurrency, tracker)
+    tracker.wait(args.timeout)
+    wait_for_email_jobs(main, args.timeout)
+
+    (latencies, incomplete, last) = tracker.get_latencies()
+    elapsed = (last or time.perf_counter()) - start
+    return {'scenario': scenario,
+            'webhooks': len(requests),
+            'completed': len(latencies),
+            'incomplete': incomplete,
+            'rejected': len([status for (seconds, status) in acks if status != 200]),
+            'elapsed_seconds': round(elapsed, 3),
+            'webhooks_per_second': round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+            'ack_ms': {'p50': round(percentile([seconds for (seconds, status) in acks], 50) * 1000, 1),
+                       'p99': round(percentile([seconds for (seconds, status) in acks], 99) * 1000, 1)},
+            'end_to_end_ms': {'p50': round(percentile(latencies, 50) * 1000, 1), 'p99': round(percentile(latencies, 99) * 1000, 1)},
+            'downstream_calls': {name: dict(fake.calls) for (name, fake) in fakes.items()},
+            'downstream_errors': {name: dict(fake.errors) for (name, fake) in fakes.items() if len(fake.errors) > 0}}
+
+
+def print_report(result: dict) -> None:
+    print('== ' + result['scenario'] + ' ==')
+    print('  webhooks: ' + str(result['webhooks']) + '  completed: ' + str(result['completed']) + '  incomplete: ' + str(result['incomplete']) + '  rejected: ' + str(result['rejected']))
+    print('  throughput: ' + str(result['webhooks_per_second']) + ' webhooks/sec over ' + str(result['elapsed_seconds']) + ' s')
+    print('  ack:        p50 ' + str(result['ack_ms']['p50']) + ' ms   p99 ' + str(result['ack_ms']['p99']) + ' ms')
+    print('  end to end: p50 ' + str(result['end_to_end_ms']['p50']) + ' ms   p99 ' + str(result['end_to_end_ms']['p99']) + ' ms')
+    print('  downstream calls:')
+    for (service, calls) in result['downstream_calls'].items():
+        for (operation, count) in sorted(calls.items()):
+            errors = result['downstream_errors'].get(service, {}).get(operation, 0)
+            print('    ' + service + ' ' + operation + ': ' + str(count) + ' (' + '{0:.2f}'.format(count / max(1, result['webhooks'])) + '/webhook' + (', ' + str(errors) + ' errors' if errors else '') + ')')
+
+
+def parse_latency_overrides(values: list) -> dict:
+    overrides = {}
+    for value in values:
+        (service, milliseconds) = value.split('=')
+        overrides[service] = float(milliseconds)
+    return overrides
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the webhook pipeline against local fakes.')
+    parser.add_argument('--scenario', choices=['new', 'update', 'approve', 'all'], default='all')
+    parser.add_argument('--count', type=int, default=100, help='Webhooks per scenario.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Webhooks in flight from the driver at once.')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Latency added to every fake call.')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random +/- added to the latency.')
+    parser.add_argument('--latency', action='append', default=[], metavar='SERVICE=MS', help='Latency for one service: gravity_forms, slack, google_maps, google_sheets or smtp.')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of fake calls that fail (0 to 1).')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for a scenario to complete.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--asgi', action='store_true', help='Send the webhooks over HTTP to asgi.py under uvicorn instead of to main.py\'s Flask app.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    parser.add_argument('--verbose', action='store_true', help='Show the app\'s INFO logs.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(levelname)s:%(message)s')
+    latencies = parse_latency_overrides(args.latency)
+
+    def behavior(service: str) -> FakeBehavior:
+        return FakeBehavior(latencies.get(service, args.latency_ms), args.jitter_ms, args.error_rate, args.seed)
+
+    tracker = Tracker()
+    fakes = {'gravity_forms': FakeGravityForms(behavior('gravity_forms')),
+             'slack': FakeSlack(behavior('slack'), tracker.on_message),
+             'google_maps': FakeGoogleMaps(behavior('google_maps')),
+             'google_sheets': FakeGoogleSheets(behavior('google_sheets'), _HISTORY_FIELDS),
+             'smtp': FakeSmtp(behavior('smtp'))}
+
+    scenarios = ['new', 'update', 'approve'] if args.scenario == 'all' else [args.scenario]
+    if 'update' in scenarios:
+        # History rows exist before startup, so they are in the snapshot the app loads.
+        first_id = 100000 * (scenarios.index('update') + 1)
+        for index in range(args.count):
+            fakes['google_sheets'].add_row(make_history_row(make_entry(first_id + index, update=True)))
+
+    directory = tempfile.mkdtemp(prefix='map-approvals-bench-')
+    (smtp_host, smtp_port) = fakes['smtp'].start()
+    environment = {'GRAVITY_FORMS_BASE_URL': fakes['gravity_forms'].start(),
+                   'GRAVITY_FORM_WORKOUT_FORM_ID': _WORKOUT_FORM_ID, 'GRAVITY_FORM_DELETE_FORM_ID': '2', 'GRAVITY_FORM_REGION_FORM_ID': '3',
+                   'GRAVITY_FORM_KEY': 'bench', 'GRAVITY_FORM_SECRET': 'bench',
+                   'SLACK_API_BASE_URL': fakes['slack'].start() + '/api/', 'SLACK_BOT_TOKEN': 'xoxb-bench', 'SLACK_MAP_CHANNEL_ID': 'CBENCH',
+                   'GOOGLE_MAPS_BASE_URL': fakes['google_maps'].start(), 'GOOGLE_MAP_KEY': 'AIzaBench',
+                   'WORKOUT_HISTORY_SPREADSHEETURL': fakes['google_sheets'].start() + '/exec',
+                   'SMTP_HOST': smtp_host, 'SMTP_PORT': str(smtp_port), 'SMTP_STARTTLS': 'false',
+                   'EMAIL_ACCOUNT': 'bench', 'EMAIL_PASSWORD': 'bench', 'EMAIL_FROM_ADDRESS': 'bench@example.com'}
+    os.environ.update(environment)
+    os.environ.setdefault('ALERT_DISTANCE_FEET', '500')
+    os.environ.setdefault('CLOUD_LOGGING', 'false')
+    os.environ.setdefault('SLACK_POST_RATE_PER_SECOND', '1000')
+    os.environ.setdefault('SLACK_POST_BURST', '1000')
+    os.environ.setdefault('JOB_RETRY_BACKOFF_SECONDS', '1')
+    os.environ.setdefault('DISPATCHER_RETRY_POLL_SECONDS', '0.5')
+    os.environ.setdefault('JOB_STORE_PATH', os.path.join(directory, 'jobs.sqlite'))
+    os.environ.setdefault('MESSAGE_STORE_PATH', os.path.join(directory, 'messages.sqlite'))
+
+    import main
+    if 'update' in scenarios and not main.map_approval.workout_history.load():
+        logging.warning('The workout history snapshot did not load. Updates will fall back to single lookups.')
+
+    if args.asgi:
+        import requests
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+        base_url = serve_asgi()
+        post = lambda path, **kwargs: session.post(base_url + path, timeout=args.timeout, **kwargs)
+    else:
+        post = lambda path, **kwargs: main.app.test_client().post(path, **kwargs)
+
+    results = []
+    for (index, scenario) in enumerate(scenarios):
+        results.append(run_scenario(scenario, args, main, post, fakes, tracker, 100000 * (index + 1)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print_report(result)
+
+    main.dispatcher.shutdown()
+
+
+if __name__ == '__main__':
+    main_cli()
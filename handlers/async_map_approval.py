@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from handlers.map_approval import MapApprovalHandler
+from services.slack import Slack, Action_Value
+from services.gravity_forms import GravityForms
+from services.async_gravity_forms import AsyncGravityForms
+from services.async_google_sheets import AsyncGoogleSheets
+from services.async_map import AsyncMap
+from services.async_slack import AsyncSlack
+from services.async_smtp import AsyncSMTP
+
+class AsyncMapApprovalHandler:
+    """Runs the high volume handlers (workout and delete requests, and the Approve, Refresh and Mark Complete buttons)
+    on the event loop with the async services. The rest, such as the edit modal and the unapproved checks, are left to
+    the wrapped MapApprovalHandler on the dispatcher's workers. Message building is shared with MapApprovalHandler.
+    """
+    _SLACK_ACTIONS = (Action_Value.Approve.name, Action_Value.Refresh.name, Action_Value.MarkComplete.name)
+
+    def __init__(self, handler: MapApprovalHandler) -> None:
+        self._handler = handler
+        self.gravity_forms = AsyncGravityForms(handler.gravity_forms)
+        self.slack = AsyncSlack(handler.slack)
+        self.smtp = AsyncSMTP(handler.smtp)
+        self.map = AsyncMap()
+        self.google_sheets = AsyncGoogleSheets()
+        self.workout_history = handler.workout_history
+
+    async def _get_lookup_results(self, lookups: dict, fallbacks: dict) -> dict:
+        """Runs the lookups (name to coroutine) at the same time, within LOOKUP_DEADLINE_SECONDS.
+        Lookups that have not finished by then are cancelled and replaced with their fallback.
+        """
+
+        tasks = {name: asyncio.ensure_future(lookup) for (name, lookup) in lookups.items()}
+        (_, pending) = await asyncio.wait(tasks.values(), timeout=MapApprovalHandler._LOOKUP_DEADLINE_SECONDS)
+
+        results = {}
+        for (name, task) in tasks.items():
+            if task in pending:
+                task.cancel()
+                logging.warning('Lookup for ' + name + ' did not finish within ' + str(MapApprovalHandler._LOOKUP_DEADLINE_SECONDS) + ' seconds.')
+                results[name] = fallbacks[name]
+            else:
+                results[name] = task.result()
+
+        return results
+
+    async def _get_previous_values(self, entryId: str) -> dict:
+        entity = self.workout_history.get_snapshot_entity(entryId)
+        if entity is not None:
+            return entity
+
+        entity = await self.google_sheets.get_single_entity(entryId)
+        if len(entity) > 0:
+            self.workout_history.add_entity(entity)
+
+        return entity
+
+    async def _build_workout_slack_blocks(self, entry: dict, previousValues: bool = False) -> tuple:
+        """Returns (blocks, previous values). The previous values are only looked up when asked for, and are {} otherwise."""
+
+        full_address = MapApprovalHandler._get_full_address(entry)
+        (locationProblem, locationWarnings) = self._handler._check_location(entry)
+        lookups = {'lat/long to address distance': self.map.get_feet_between_address_and_latlong(address=full_address, latitude=entry['13'], longitude=entry['12'])}
+        fallbacks = {'address at lat/long': 'Lookup timed out', 'lat/long to address distance': 'Lookup timed out'}
+        if locationProblem is None:
+            lookups['address at lat/long'] = self.map.get_address_from_latlong(latitude=entry['13'], longitude=entry['12'])
+        if previousValues:
+            lookups['previous values'] = self._get_previous_values(entry['id'])
+            fallbacks['previous values'] = {}
+
+        results = await self._get_lookup_results(lookups, fallbacks)
+        blocks = self._handler._compose_workout_slack_blocks(entry, results.get('address at lat/long', locationProblem), results['lat/long to address distance'], locationWarnings)
+        return (blocks, results.get('previous values', {}))
+
+    async def handle_gravity_forms_submission(self, entry: dict):
+        logging.info('Handling Gravity Forms Workout.')
+        logging.debug(entry)
+
+        if 'form_id' not in entry:
+            logging.error('Not a proper Gravity Forms payload. Payload does not include "form_id", which represents the form ID, and is required. Will not process')
+            return
+
+        if entry['form_id'] != self.gravity_forms.FORM_ID_WORKOUT:
+            logging.error('Form ID submitted to the /webhooks/workout endpoint (' + entry['form_id'] + ' does not match configured form ID (' + self.gravity_forms.FORM_ID_WORKOUT + '). Will not process.')
+            return
+
+        self.gravity_forms.seed_entry(entry)
+
+        isUpdate = GravityForms.is_new_or_update(entry) == 'Update'
+        (blocks, previousValues) = await self._build_workout_slack_blocks(entry, previousValues=isUpdate)
+
+        pendingMessage = await asyncio.to_thread(self._handler._get_pending_message, entry['id']) if isUpdate else None # Reads the SQLite message store
+        if pendingMessage is None:
+            (postChannel, postTS) = await self.slack.post_msg_to_channel('Map Request from ' + entry['21'], blocks, entry_id=entry['id'])
+            replies = []
+        else:
+            (postChannel, postTS) = (pendingMessage['channel'], pendingMessage['ts'])
+            await self.slack.replace_msg(original_message=pendingMessage, ts=postTS, channel=postChannel, text='Map Request from ' + entry['21'], blocks=blocks)
+            replies = [MapApprovalHandler._UPDATED_AGAIN_MESSAGE]
+
+        if isUpdate:
+            if previousValues == {}:
+                replies.append('Previous values could not be loaded from the workout history.')
+            else:
+                replies.extend(MapApprovalHandler._get_previous_value_messages(entry, previousValues))
+
+            await self.slack.post_thread_replies(replies, thread_ts=postTS, channel=postChannel)
+
+    async def handle_gravity_forms_delete(self, entry: dict):
+        logging.info('Handling Gravity Forms Workout Delete.')
+        logging.debug(entry)
+
+        if 'form_id' not in entry:
+            logging.error('Not a proper Gravity Forms payload. Payload does not include "form_id", which represents the form ID, and is required. Will not process')
+            return
+
+        if entry['form_id'] != self.gravity_forms.FORM_ID_WORKOUT_DELETE:
+            logging.error('Form ID submitted to the /webhooks/workoutdelete endpoint (' + entry['form_id'] + ' does not match configured form ID (' + self.gravity_forms.FORM_ID_WORKOUT_DELETE + '). Will not process.')
+            return
+
+        self.gravity_forms.seed_entry(entry)
+        await self.slack.post_msg_to_channel('Map Delete Request from ' + entry['7'], self._handler._build_delete_slack_blocks(entry), entry_id=entry['id'])
+
+    async def _approve_entry(self, entryId: str) -> dict|None:
+        entry = await self.gravity_forms.get_entry(entryId, use_cache=False) # Get latest version
+        entry['is_approved'] = "1"
+        entry['is_read'] = "1"
+
+        logging.info('For entry ' + entryId + ', setting is_approved and is_read to 1. Updating entry.')
+        if not await self.gravity_forms.update_entry(entryId, entry):
+            return None
+
+        return entry
+
+    async def _get_approved_email(self, entry: dict) -> dict:
+        pin_to_address_distance = await self.map.get_feet_between_address_and_latlong(address=MapApprovalHandler._get_full_address(entry), latitude=entry['13'], longitude=entry['12'])
+        return self._handler._render_approved_email(entry, pin_to_address_distance)
+
+    def handles_slack_action(body: dict) -> bool:
+        """Whether handle_slack_action runs this block_actions payload. Other actions go to MapApprovalHandler."""
+
+        return str.split(body['actions'][0].get('value', ''), '_')[0] in AsyncMapApprovalHandler._SLACK_ACTIONS
+
+    async def handle_slack_action(self, body: dict):
+        action_value_pieces = str.split(body['actions'][0]['value'], '_')
+        action = action_value_pieces[0]
+
+        if action not in self._SLACK_ACTIONS:
+            logging.error('A Slack Action was received with an action value that is not handled on the event loop: ' + action)
+            return
+
+        logging.debug(body)
+        logging.info('Handling Slack Action.')
+
+        if action == Action_Value.Approve.name:
+            logging.info('Action: Approve')
+
+            entryId = action_value_pieces[1]
+            entry = await self._approve_entry(entryId)
+            if entry is not None:
+                statusBlock = Slack.get_block_section('Request approved by <@' + body['user']['id'] + '> at ' + Slack.convert_ts_to_et(body['actions'][0]['action_ts']))
+                blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
+                await self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
+                await self.smtp.queue_email(**await self._get_approved_email(entry))
+
+                logging.info('Entry updated, action logged to Slack thread, requestor email queued.')
+            else:
+                logging.error('Could not approve entry ' + entryId)
+                user_name = await self.slack.get_display_name(body['user']['id'])
+                await self.slack.post_msg_to_channel(text='Map Request Approval Failed! ' + user_name + ' tried to approve it, the system failed. Call admin.', thread_ts=body['container']['message_ts'])
+
+        elif action == Action_Value.Refresh.name:
+            logging.info('Action: Refresh')
+
+            entryId = action_value_pieces[1]
+            entry = await self.gravity_forms.get_entry(entryId, True, use_cache=False)
+            (blocks, _) = await self._build_workout_slack_blocks(entry)
+            await self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
+
+        else:
+            logging.info('Action: Mark Complete')
+
+            statusBlock = Slack.get_block_section('Request manually marked approved by <@' + body['user']['id'] + '> at ' + Slack.convert_ts_to_et(body['actions'][0]['action_ts']))
+            blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
+            await self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
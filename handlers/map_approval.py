@@ -1,13 +1,26 @@
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from services.slack import Slack, Action_Value, Button_Style, Views
 from services.gravity_forms import GravityForms
 from services.smtp import SMTP
 from services.map import Map
+from services.gazetteer import Gazetteer
 from services.google_sheets import GoogleSheets
+from services.workout_history import WorkoutHistory
+from services.tracing import Tracing
+from services.email_templates import EmailTemplates, ApprovedEmailContext, DeletedEmailContext, DeleteRejectedEmailContext
 
 class MapApprovalHandler:
     _ALERT_DISTANCE_FEET = float(os.getenv('ALERT_DISTANCE_FEET'))
+    _NEARBY_WORKOUT_RADIUS_FEET = float(os.getenv('NEARBY_WORKOUT_RADIUS_FEET', '5280'))
+    _NEARBY_WORKOUT_LIMIT = int(os.getenv('NEARBY_WORKOUT_LIMIT', '3'))
+    _DUPLICATE_WORKOUT_DISTANCE_FEET = float(os.getenv('DUPLICATE_WORKOUT_DISTANCE_FEET', '500'))
+    _UPDATE_IN_PLACE_SECONDS = float(os.getenv('UPDATE_IN_PLACE_SECONDS', '3600'))
+    _LOOKUP_WORKERS = int(os.getenv('LOOKUP_WORKERS', '8'))
+    _LOOKUP_DEADLINE_SECONDS = float(os.getenv('LOOKUP_DEADLINE_SECONDS', '10'))
+    _BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
     
     def __init__(self) -> None:
         self.gravity_forms = GravityForms()
@@ -15,9 +28,54 @@ class MapApprovalHandler:
         self.smtp = SMTP()
         self.map = Map()
         self.google_sheets = GoogleSheets()
+        self.workout_history = WorkoutHistory(self.google_sheets)
+        self.email_templates = EmailTemplates()
+        self.gazetteer = Gazetteer()
+        self._lookup_executor = ThreadPoolExecutor(max_workers=self._LOOKUP_WORKERS, thread_name_prefix='lookup')
+
+    def _get_lookup_deadline(self) -> float:
+        return time.monotonic() + self._LOOKUP_DEADLINE_SECONDS
+
+    def _get_lookup_result(self, future: Future, deadline: float, fallback, description: str):
+        """Waits for a lookup started on the lookup executor until the shared deadline. Returns fallback if it does not finish in time."""
+
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            logging.warning('Lookup for ' + description + ' did not finish within ' + str(self._LOOKUP_DEADLINE_SECONDS) + ' seconds.')
+            return fallback
+
+    def _get_full_address(entry: dict) -> str:
+        return entry['1.1'] + ' ' + entry['1.2'] + ' ' + entry['1.3'] + ' ' + entry['1.4'] + ' ' + entry['1.5'] + ' ' + entry['1.6']
+
+    def _build_workout_slack_blocks(self, entry: dict, deadline: float|None = None) -> list:
+        deadline = deadline or self._get_lookup_deadline()
+
+        full_address = MapApprovalHandler._get_full_address(entry)
+        # A pin the gazetteer can rule out offline is not worth a reverse geocode.
+        (locationProblem, locationWarnings) = self._check_location(entry)
+        # Reverse geocode and forward geocode (inside the distance lookup) do not depend on each other, so run them at the same time.
+        if locationProblem is None:
+            address_at_lat_long_future = self._lookup_executor.submit(Tracing.wrap(self.map.get_address_from_latlong), latitude=entry['13'], longitude=entry['12'])
+        pin_to_address_distance_future = self._lookup_executor.submit(Tracing.wrap(self.map.get_feet_between_address_and_latlong), address=full_address, latitude=entry['13'], longitude=entry['12'])
+        if locationProblem is None:
+            address_at_lat_long = self._get_lookup_result(address_at_lat_long_future, deadline, 'Lookup timed out', 'address at lat/long')
+        else:
+            address_at_lat_long = locationProblem
+        pin_to_address_distance = self._get_lookup_result(pin_to_address_distance_future, deadline, 'Lookup timed out', 'lat/long to address distance')
+
+        return self._compose_workout_slack_blocks(entry, address_at_lat_long, pin_to_address_distance, locationWarnings)
+
+    def _check_location(self, entry: dict) -> tuple:
+        """Gazetteer.check for the entry's pin, country, state and ZIP code."""
+
+        return self.gazetteer.check(entry['13'], entry['12'], entry['1.6'], entry['1.4'], entry['1.5'])
+
+    def _compose_workout_slack_blocks(self, entry: dict, address_at_lat_long: str, pin_to_address_distance: int|str, locationWarnings: list) -> list:
+        """The workout request message, given the results of the geocoding lookups and the warnings from _check_location.
+        Shared with AsyncMapApprovalHandler.
+        """
 
-    def _build_workout_slack_blocks(self, entry: dict) -> list:
-        
         submissionType = GravityForms.is_new_or_update(entry)
         region = entry['21']
         workout_name = entry['2']
@@ -41,18 +99,20 @@ class MapApprovalHandler:
         submitter_email = entry['19']
         date_created = GravityForms.convert_date_to_et(entry['date_created'])
 
-        full_address = street_1 + ' ' + street_2 + ' ' + city + ' ' + state + ' ' + zip_code + ' ' + country
-        address_at_lat_long = self.map.get_address_from_latlong(latitude=latitude, longitude=longitude)
+        full_address = MapApprovalHandler._get_full_address(entry)
         address_url = Map.get_address_url(full_address)
         lat_long_url = Map.get_address_url(latitude + ',' + longitude)
         direction_url = Map.get_directions_url(origin=full_address, destination=latitude + ',' + longitude)
-        pin_to_address_distance = self.map.get_feet_between_address_and_latlong(address=full_address, latitude=latitude, longitude=longitude)
         if type(pin_to_address_distance) is int:
             pin_to_address_distance = '{0:,.0f}'.format(pin_to_address_distance) + ' ft'
+        location_check = '' if len(locationWarnings) == 0 else '\n*Location Check:* :warning: ' + '. '.join(locationWarnings)
 
         blocks = Slack.start_blocks()
         blocks.append(Slack.get_block_header('Map Request: ' + submissionType))
-        blocks.append(Slack.get_block_section('*Region:* ' + region + '\n*Workout Name:* ' + workout_name + '\n\n*Workout is Stationary?:* ' + workout_stationary + '\n*Address Accurate?:* ' + address_accurate + '\n\n*Street 1:* ' + street_1 + '\n*Street 2:* ' + street_2 + '\n*City:* ' + city + '\n*State:* ' + state + '\n*ZIP Code:* ' + zip_code + '\n*Country:* ' + country + '\n<' + address_url + '|Map It>\n\n*Latitude:* \'' + latitude + '\'\n*Longitude:* \'' + longitude + '\'\n<' + lat_long_url + '|Map It>\n\n*Address at Lat/Long:* ' + address_at_lat_long + '\n*Lat/Long to Address Distance:* ' + pin_to_address_distance + '\n\n*Weekday:* ' + weekday + '\n*Time:* ' + time + '\n*Type:* ' + workout_type + '\n\n*Region Website:* ' + website + '\n*Region Logo:* ' + logo + '\n\n*Notes:* ' + notes + '\n\n*Submitter:* ' + submitter_name + '\n*Submitter Email:* ' + submitter_email + '\n*Original Submission:* ' + date_created))
+        blocks.append(Slack.get_block_section('*Region:* ' + region + '\n*Workout Name:* ' + workout_name + '\n\n*Workout is Stationary?:* ' + workout_stationary + '\n*Address Accurate?:* ' + address_accurate + '\n\n*Street 1:* ' + street_1 + '\n*Street 2:* ' + street_2 + '\n*City:* ' + city + '\n*State:* ' + state + '\n*ZIP Code:* ' + zip_code + '\n*Country:* ' + country + '\n<' + address_url + '|Map It>\n\n*Latitude:* \'' + latitude + '\'\n*Longitude:* \'' + longitude + '\'\n<' + lat_long_url + '|Map It>\n\n*Address at Lat/Long:* ' + address_at_lat_long + '\n*Lat/Long to Address Distance:* ' + pin_to_address_distance + location_check + '\n\n*Weekday:* ' + weekday + '\n*Time:* ' + time + '\n*Type:* ' + workout_type + '\n\n*Region Website:* ' + website + '\n*Region Logo:* ' + logo + '\n\n*Notes:* ' + notes + '\n\n*Submitter:* ' + submitter_name + '\n*Submitter Email:* ' + submitter_email + '\n*Original Submission:* ' + date_created))
+        nearbyBlock = self._build_nearby_workouts_block(entry)
+        if nearbyBlock is not None:
+            blocks.append(nearbyBlock)
         blocks.append(Slack.get_block_section('Helpful Links: <' + self.gravity_forms.BASE_URL + '/wp-admin/admin.php?page=gf_entries&filter=gv_unapproved&id=' + entry['form_id'] + '|All Unapproved Requests>, <' + self.gravity_forms.BASE_URL + '/wp-admin/admin.php?page=gf_entries&view=entry&id=' + entry['form_id'] + '&lid=' + entry['id'] + '|This Request>, <' + direction_url + '|Directions from address to lat/long>'))
 
         blocks.append(Slack.get_divider())
@@ -69,6 +129,27 @@ class MapApprovalHandler:
         return blocks
     
     
+    def _build_nearby_workouts_block(self, entry: dict) -> dict|None:
+        """Lists the existing workouts nearest the pin from the workout history snapshot, and flags any on the same weekday
+        within DUPLICATE_WORKOUT_DISTANCE_FEET as a likely duplicate. None when the snapshot has not loaded.
+        """
+
+        if self.workout_history.get_size() == 0:
+            return None
+
+        nearby = self.workout_history.get_nearby(entry['13'], entry['12'], self._NEARBY_WORKOUT_RADIUS_FEET, self._NEARBY_WORKOUT_LIMIT, exclude_entry_id=entry['id'])
+        if len(nearby) == 0:
+            return Slack.get_block_section('*Nearby Workouts:* None within ' + '{0:,.0f}'.format(self._NEARBY_WORKOUT_RADIUS_FEET) + ' ft')
+
+        lines = []
+        for workout in nearby:
+            line = '• ' + str(workout['Workout Name']) + ' (' + str(workout['Region']) + ', ' + str(workout['Weekday']) + ' ' + str(workout['Time']) + '): ' + '{0:,.0f}'.format(workout['Feet']) + ' ft'
+            if workout['Feet'] <= self._DUPLICATE_WORKOUT_DISTANCE_FEET and str(workout['Weekday']) == entry['14']:
+                line = line + ' :warning: *Likely duplicate*'
+            lines.append(line)
+
+        return Slack.get_block_section('*Nearby Workouts:*\n' + '\n'.join(lines))
+
     def _build_edit_view_content(self, entry: dict) -> dict:
         
         workout_name = entry['2']
@@ -116,40 +197,84 @@ class MapApprovalHandler:
             logging.error('Form ID submitted to the /webhooks/workout endpoint (' + entry['form_id'] + ' does not match configured form ID (' + self.gravity_forms.FORM_ID_WORKOUT + '). Will not process.')
             return
 
-        blocks = self._build_workout_slack_blocks(entry=entry)
+        self.gravity_forms.seed_entry(entry)
+
+        deadline = self._get_lookup_deadline()
+        isUpdate = GravityForms.is_new_or_update(entry) == 'Update'
+        if isUpdate:
+            # Start the history lookup now so it runs alongside the geocoding for the message.
+            previousValuesFuture = self._lookup_executor.submit(Tracing.wrap(self.workout_history.get_entity), entry["id"])
+
+        blocks = self._build_workout_slack_blocks(entry=entry, deadline=deadline)
         region = entry['21']
 
-        (postChannel, postTS) = self.slack.post_msg_to_channel('Map Request from ' + region, blocks)
-
-        if (GravityForms.is_new_or_update(entry) == 'Update'):
-            previousValues = self.google_sheets.get_single_entity(entry["id"])
-            newValues = {}
-            newValues["Workout Name"] = entry["2"]
-            newValues["Region"] = entry["21"]
-            newValues["Time"] = entry["4"]
-            newValues["Type"] = entry["5"]
-            newValues["Latitude"] = entry["13"]
-            newValues["Longitude"] = entry["12"]
-            newValues["Weekday"] = entry["14"]
-            newValues["Note"] = entry["15"]
-            newValues["Website"] = entry["17"]
-            newValues["Logo"] = entry["16"]
-            newValues["Address 1"] = entry["1.1"]
-            newValues["Address 2"] = entry["1.2"]
-            newValues["City"] = entry["1.3"]
-            newValues["State"] = entry["1.4"]
-            newValues["Postal Code"] = entry["1.5"]
-            newValues["Country"] = entry["1.6"]
-            newValues["Address Accurate?"] = entry["23"]
-            newValues["Stationary?"] = entry["24"]
-            newValues["Country"] = entry["1.6"]
-            newValues["Submitter"] = entry["18"]
-            newValues["Submitter Email"] = entry["19"]
-            newValues["Entry ID"] = entry["id"]
-
-            for field in newValues:
-                if str(previousValues[field]) != newValues[field]:
-                    self.slack.post_msg_to_channel('Previous ' + field + ':\n' + str(previousValues[field]), thread_ts=postTS, channel=postChannel)
+        pendingMessage = self._get_pending_message(entry['id']) if isUpdate else None
+        if pendingMessage is None:
+            (postChannel, postTS) = self.slack.post_msg_to_channel('Map Request from ' + region, blocks, entry_id=entry['id'])
+            replies = []
+        else:
+            (postChannel, postTS) = (pendingMessage['channel'], pendingMessage['ts'])
+            self.slack.replace_msg(original_message=pendingMessage, ts=postTS, channel=postChannel, text='Map Request from ' + region, blocks=blocks)
+            replies = [MapApprovalHandler._UPDATED_AGAIN_MESSAGE]
+
+        if isUpdate:
+            previousValues = self._get_lookup_result(previousValuesFuture, deadline, {}, 'previous values of entry ' + entry["id"])
+            if previousValues == {}:
+                replies.append('Previous values could not be loaded from the workout history.')
+            else:
+                replies.extend(MapApprovalHandler._get_previous_value_messages(entry, previousValues))
+
+            self.slack.post_thread_replies(replies, thread_ts=postTS, channel=postChannel)
+
+    _UPDATED_AGAIN_MESSAGE = 'The submitter updated this request again. The message above now shows the latest values.'
+
+    def _get_pending_message(self, entryId: str) -> dict|None:
+        """The request message already posted for the entry, if it was posted within UPDATE_IN_PLACE_SECONDS and still has its buttons.
+        Updates to the entry replace that message instead of posting another, so an edit storm leaves one request to review.
+        """
+
+        message = self.slack.get_msg_by_entry_id(entryId)
+        if message is None or time.time() - float(message['ts']) > self._UPDATE_IN_PLACE_SECONDS:
+            return None
+
+        if not any(block.get('block_id') == 'buttons' for block in message['blocks']):
+            return None # Already approved or marked complete
+
+        return message
+
+    def _get_previous_value_messages(entry: dict, previousValues: dict) -> list:
+        """One message for each field the update changed, giving the value from the workout history."""
+
+        newValues = {}
+        newValues["Workout Name"] = entry["2"]
+        newValues["Region"] = entry["21"]
+        newValues["Time"] = entry["4"]
+        newValues["Type"] = entry["5"]
+        newValues["Latitude"] = entry["13"]
+        newValues["Longitude"] = entry["12"]
+        newValues["Weekday"] = entry["14"]
+        newValues["Note"] = entry["15"]
+        newValues["Website"] = entry["17"]
+        newValues["Logo"] = entry["16"]
+        newValues["Address 1"] = entry["1.1"]
+        newValues["Address 2"] = entry["1.2"]
+        newValues["City"] = entry["1.3"]
+        newValues["State"] = entry["1.4"]
+        newValues["Postal Code"] = entry["1.5"]
+        newValues["Country"] = entry["1.6"]
+        newValues["Address Accurate?"] = entry["23"]
+        newValues["Stationary?"] = entry["24"]
+        newValues["Country"] = entry["1.6"]
+        newValues["Submitter"] = entry["18"]
+        newValues["Submitter Email"] = entry["19"]
+        newValues["Entry ID"] = entry["id"]
+
+        previousValueMessages = []
+        for field in newValues:
+            if str(previousValues[field]) != newValues[field]:
+                previousValueMessages.append('Previous ' + field + ':\n' + str(previousValues[field]))
+
+        return previousValueMessages
     
     
     def handle_gravity_forms_delete(self, entry: dict):
@@ -164,6 +289,10 @@ class MapApprovalHandler:
             logging.error('Form ID submitted to the /webhooks/workoutdelete endpoint (' + entry['form_id'] + ' does not match configured form ID (' + self.gravity_forms.FORM_ID_WORKOUT_DELETE + '). Will not process.')
             return
 
+        self.gravity_forms.seed_entry(entry)
+        self.slack.post_msg_to_channel('Map Delete Request from ' + entry['7'], self._build_delete_slack_blocks(entry), entry_id=entry['id'])
+
+    def _build_delete_slack_blocks(self, entry: dict) -> list:
         region = entry['7']
         workout_name = entry['1']
         reason = entry['5']
@@ -185,7 +314,66 @@ class MapApprovalHandler:
 
         blocks.append(Slack.get_divider())
 
-        self.slack.post_msg_to_channel('Map Delete Request from ' + region, blocks)
+        return blocks
+
+    
+    def _approve_entry(self, entryId: str) -> dict|None:
+        """Marks the latest version of the entry approved and read.
+        Returns the approved entry, or None if Gravity Forms did not accept the update.
+        Callers queue the email from _get_approved_email once the Slack message is updated.
+        """
+
+        entry = self.gravity_forms.get_entry(entryId, use_cache=False) # Get latest version
+        entry['is_approved'] = "1"
+        entry['is_read'] = "1"
+        
+        logging.info('For entry ' + entryId + ', setting is_approved and is_read to 1. Updating entry.')
+        if not self.gravity_forms.update_entry(entryId, entry):
+            return None
+
+        return entry
+
+    def _get_approved_email(self, entry: dict) -> dict:
+        """The SMTP.queue_email arguments for the approved email, with a warning when the pin is far from the address."""
+
+        pin_to_address_distance = self.map.get_feet_between_address_and_latlong(address=MapApprovalHandler._get_full_address(entry), latitude=entry['13'], longitude=entry['12'])
+        return self._render_approved_email(entry, pin_to_address_distance)
+
+    def _render_approved_email(self, entry: dict, pin_to_address_distance: int|str) -> dict:
+        """_get_approved_email once the distance is known. Shared with AsyncMapApprovalHandler."""
+
+        context = ApprovedEmailContext.from_entry(entry, corrections_url=self.gravity_forms.BASE_URL + '/map-changes')
+        if type(pin_to_address_distance) is int and pin_to_address_distance > self._ALERT_DISTANCE_FEET:
+            context.discrepancy_warning = self.email_templates.render_distance_warning(pin_to_address_distance)
+
+        return {'subject': 'Map Request Approved', 'toEmails': [context.submitter_email], 'body': self.email_templates.render_approved(context)}
+
+
+    def _trash_workout(self, entryId: str, deleteEntryId: str) -> tuple:
+        """Sends the workout to the trash and marks the delete request approved and read.
+        Returns (result, email): result is 'Deleted', 'Already deleted' or 'Failed', and email is the SMTP.queue_email
+        arguments for the requestor's email when deleted, otherwise None. Callers queue it once Slack is updated.
+        """
+
+        entry = self.gravity_forms.get_entry(entryId)
+
+        if entry['status'] == 'trash':
+            logging.warning('Entry ' + entryId + ' has already been deleted. No action will be taken on workout. Updating Slack post to remove buttons.')
+            return ('Already deleted', None)
+
+        deleteEntry = self.gravity_forms.get_entry(deleteEntryId, use_cache=False)
+
+        logging.info('Sending delete command for workout entry ' + entryId + '.')
+        if not self.gravity_forms.trash_entry(entryId):
+            return ('Failed', None)
+
+        deleteEntry['is_approved'] = "1"
+        deleteEntry['is_read'] = "1"
+        logging.info('Marking delete request entry ' + deleteEntryId + ' as read and approved.')
+        self.gravity_forms.update_entry(deleteEntryId, deleteEntry)
+        
+        context = DeletedEmailContext.from_entries(entry, deleteEntry)
+        return ('Deleted', {'subject': 'Map Pin Deleted', 'toEmails': [context.submitter_email], 'body': self.email_templates.render_deleted(context)})
 
     
     def handle_slack_action(self, body: dict):
@@ -203,51 +391,14 @@ class MapApprovalHandler:
             logging.info('Action: Approve')
 
             entryId = action_value_pieces[1]
-            entry = self.gravity_forms.get_entry(entryId) # Get latest version
-            entry['is_approved'] = "1"
-            entry['is_read'] = "1"
-            
-            logging.info('For entry ' + entryId + ', setting is_approved and is_read to 1. Updating entry.')
-            success = self.gravity_forms.update_entry(entryId, entry)
-            if success:
+            entry = self._approve_entry(entryId)
+            if entry is not None:
                 statusBlock = Slack.get_block_section('Request approved by <@' + body['user']['id'] + '> at ' + Slack.convert_ts_to_et(body['actions'][0]['action_ts']))
                 blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
                 self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
-                
-                submissionType = GravityForms.is_new_or_update(entry)
-                region = entry['21']
-                workout_name = entry['2']
-                workout_stationary = entry['24']
-                address_accurate = entry['23']
-                street_1 = entry['1.1']
-                street_2 = entry['1.2']
-                city = entry['1.3']
-                state = entry['1.4']
-                zip_code = entry['1.5']
-                country = entry['1.6']
-                latitude = entry['13']
-                longitude = entry['12']
-                weekday = entry['14']
-                time = entry['4']
-                workout_type = entry['5']
-                website = entry['17']
-                logo = entry['16']
-                notes = entry['15']
-                submitter_name = entry['18']
-                submitter_email = entry['19']
-                date_created = GravityForms.convert_date_to_et(entry['date_created'])
-                date_updated = GravityForms.convert_date_to_et(entry['date_updated'])
-
-                full_address = street_1 + ' ' + street_2 + ' ' + city + ' ' + state + ' ' + zip_code + ' ' + country
-                pin_to_address_distance = self.map.get_feet_between_address_and_latlong(address=full_address, latitude=latitude, longitude=longitude)
-                if type(pin_to_address_distance) is int and pin_to_address_distance > self._ALERT_DISTANCE_FEET:
-                    discrepency_warning = '<p/><div style="background-color: yellow;"><b><u>WARNING:</u></b> The distance between the address provided and the latitude/longitude provided is ' + '{0:,.0f}'.format(pin_to_address_distance) + ' feet. If you are ok with this, no action is needed. If you think they should be closer, please research the issue and submit necessary changes using the link above. If you need help getting this information accurate, please repl to this email.</div><p/>'
-                else:
-                    discrepency_warning = ''
-                
-                self.smtp.send_email('Map Request Approved', [submitter_email], '<div style="display: none; max-height: 0px; overflow: hidden;">' + submissionType + ' -> ' + workout_name + ' @ ' + region + '</div><div style="display: none; max-height: 0px; overflow: hidden;">&#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy;</div><p>Your map request has been approved and should show up on <a href="https://map.f3nation.com">the map</a> within the hour. If you see a mistake, use this <a href="' + self.gravity_forms.BASE_URL + '/map-changes">link</a> to submit a correction. Reply to this email with any other issues.</p>' + discrepency_warning + '<table border="1" style="border-collapse:collapse" cellpadding="5"><tr><td><b>Region</b></td><td>' + region + '</td></tr><tr><td><b>Workout Name</b></td><td>' + workout_name + '</td></tr><tr><td><b>Workout is Stationary?</b></td><td>' + workout_stationary + '</td></tr><tr><td><b>Address is Accurate?</b></td><td>' + address_accurate + '</td></tr><tr><td><b>Street 1</b></td><td>' + street_1 + '</td></tr><tr><td><b>Street 2</b></td><td>' + street_2 + '</td></tr><tr><td><b>City</b></td><td>' + city + '</td></tr><tr><td><b>State</b></td><td>' + state + '</td></tr><tr><td><b>ZIP Code</b></td><td>' + zip_code + '</td></tr><tr><td><b>United States</b></td><td>' + country + '</td></tr><tr><td><b>Latitude</b></td><td>' + latitude + '</td></tr><tr><td><b>Longitude</b></td><td>' + longitude + '</td></tr><tr><td><b>Weekday</b></td><td>' + weekday + '</td></tr><tr><td><b>Time</b></td><td>' + time + '</td></tr><tr><td><b>Type</b></td><td>' + workout_type + '</td></tr><tr><td><b>Region Website</b></td><td>' + website + '</td></tr><tr><td><b>Region Logo</b></td><td>' + logo + '</td></tr><tr><td><b>Notes</b></td><td>' + notes + '</td></tr><tr><td><b>Submitter</b></td><td>' + submitter_name + '</td></tr><tr><td><b>Submitter Email</b></td><td>' + submitter_email + '</td></tr><tr><td><b>Request Created</b></td><td>' + date_created + '</td></tr><tr><td><b>Request Updated</b></td><td>' + date_updated + '</td></tr><tr><td><b>Workout ID</b></td><td>' + entryId + '</td></tr></table>')
-                
-                logging.info('Entry updated, action logged to Slack thread, requestor emailed.')
+                self.smtp.queue_email(**self._get_approved_email(entry))
+
+                logging.info('Entry updated, action logged to Slack thread, requestor email queued.')
             else:
                 logging.error('Could not approve entry ' + entryId)
                 self.slack.post_msg_to_channel(text='Map Request Approval Failed! ' + user_name + ' tried to approve it, the system failed. Call admin.', thread_ts=body['container']['message_ts'])
@@ -256,7 +407,7 @@ class MapApprovalHandler:
             logging.info('Action: Refresh')
 
             entryId = action_value_pieces[1]
-            entry = self.gravity_forms.get_entry(entryId, True)
+            entry = self.gravity_forms.get_entry(entryId, True, use_cache=False)
             blocks = self._build_workout_slack_blocks(entry=entry)
             self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
 
@@ -271,46 +422,22 @@ class MapApprovalHandler:
             logging.info('Action: Delete')
 
             entryId = action_value_pieces[1]
-            entry = self.gravity_forms.get_entry(entryId)
+            deleteEntryId = action_value_pieces[2] # Entry ID of the form submitted to request the deletion, not the ID of the workout.
+            (result, email) = self._trash_workout(entryId, deleteEntryId)
 
-            if entry['status'] == 'trash':
-                logging.warning('Entry ' + entryId + ' has already been deleted. No action will be taken on workout. Updating Slack post to remove buttons.')
-                
+            if result == 'Already deleted':
                 statusBlock = Slack.get_block_section('This workout was already deleted. Sorry about that. You should be good to go.')
                 blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
                 self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
                 return
 
-            deleteEntryId = action_value_pieces[2] # Entry ID of the form submitted to request the deletion, not the ID of the workout.
-            deleteEntry = self.gravity_forms.get_entry(deleteEntryId)
-
-            logging.info('Sending delete command for workout entry ' + entryId + '.')
-            success = self.gravity_forms.trash_entry(entryId)
-            if success:
+            if result == 'Deleted':
                 statusBlock = Slack.get_block_section('Workout sent to trash by <@' + body['user']['id'] + '> at ' + Slack.convert_ts_to_et(body['actions'][0]['action_ts']))
                 blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
                 self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
-                
-                region = deleteEntry['7']
-                workout_name = deleteEntry['1']
-                reason = deleteEntry['5']
-                submitter_name = deleteEntry['4']
-                submitter_email = deleteEntry['3']
-                date_created = GravityForms.convert_date_to_et(deleteEntry['date_created'])
-                date_updated = GravityForms.convert_date_to_et(deleteEntry['date_updated'])
-
-                weekday = entry['14']
-                time = entry['4']
-                workout_type = entry['5']
-
-                deleteEntry['is_approved'] = "1"
-                deleteEntry['is_read'] = "1"
-                logging.info('Marking delete request entry ' + deleteEntryId + ' as read and approved.')
-                self.gravity_forms.update_entry(deleteEntryId, deleteEntry)
-                
-                self.smtp.send_email('Map Pin Deleted', [submitter_email], '<div style="display: none; max-height: 0px; overflow: hidden;">Delete -> ' + workout_name + ' @ ' + region + '</div><div style="display: none; max-height: 0px; overflow: hidden;">&#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy;</div><p>Your request to remove a workout from <a href="https://map.f3nation.com">the map</a> has been approved; it should disappear within the hour. If you deleted this by mistake, or have any other issues, please <a href="mailto:map-admins@f3nation.com">email us</a>.</p><table border="1" style="border-collapse:collapse" cellpadding="5"><tr><td><b>Region</b></td><td>' + region + '</td></tr><tr><td><b>Workout Name</b></td><td>' + workout_name + '</td></tr><tr><td><b>Weekday</b></td><td>' + weekday + '</td></tr><tr><td><b>Time</b></td><td>' + time + '</td></tr><tr><td><b>Type</b></td><td>' + workout_type + '</td></tr><tr><td><b>Reason for deletion</b></td><td>' + reason + '</td></tr><tr><td><b>Submitter</b></td><td>' + submitter_name + '</td></tr><tr><td><b>Submitter Email</b></td><td>' + submitter_email + '</td></tr><tr><td><b>Request Created</b></td><td>' + date_created + '</td></tr><tr><td><b>Request Updated</b></td><td>' + date_updated + '</td></tr><tr><td><b>Workout ID</b></td><td>' + entryId + '</td></tr></table>')
-
-                logging.info('Entry deleted, action logged to Slack, requestor emailed.')
+                self.smtp.queue_email(**email)
+
+                logging.info('Entry deleted, action logged to Slack, requestor email queued.')
             else:
                 self.slack.post_msg_to_channel(text='Workout deletion failed! ' + user_name + ' tried to send it to trash, the system failed. Call admin.', thread_ts=body['container']['message_ts'])
 
@@ -318,6 +445,7 @@ class MapApprovalHandler:
             logging.info('Action: Reject Delete')
 
             entryId = action_value_pieces[1]
+            entry = self.gravity_forms.get_entry(entryId)
             logging.info('Sending delete command for delete request entry ' + entryId + '.')
             success = self.gravity_forms.trash_entry(entryId)
             if success:
@@ -325,17 +453,10 @@ class MapApprovalHandler:
                 blocks = Slack.replace_buttons(blocks=body['message']['blocks'], newBlock=statusBlock)
                 self.slack.replace_msg(original_message=body['message'], ts=body['container']['message_ts'], blocks=blocks)
 
-                region = entry['7']
-                workout_name = entry['1']
-                reason = entry['5']
-                submitter_name = entry['4']
-                submitter_email = entry['3']
-                date_created = GravityForms.convert_date_to_et(entry['date_created'])
-                date_updated = GravityForms.convert_date_to_et(entry['date_updated'])
-                
-                self.smtp.send_email('Map Pin NOT Deleted', [submitter_email], '<div style="display: none; max-height: 0px; overflow: hidden;">Delete -> ' + workout_name + ' @ ' + region + '</div><div style="display: none; max-height: 0px; overflow: hidden;">&#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy; &#847; &zwnj; &nbsp; &#8199; &shy;</div><p>A map admin has opted <u>NOT</u> to delete this workout. If this is a surprise, and you would like to find out more, please reply to this email.</p><table border="1" style="border-collapse:collapse" cellpadding="5"><tr><td><b>Region</b></td><td>' + region + '</td></tr><tr><td><b>Workout Name</b></td><td>' + workout_name + '</td></tr><tr><td><b>Reason for deletion</b></td><td>' + reason + '</td></tr><tr><td><b>Submitter</b></td><td>' + submitter_name + '</td></tr><tr><td><b>Submitter Email</b></td><td>' + submitter_email + '</td></tr><tr><td><b>Request Created</b></td><td>' + date_created + '</td></tr><tr><td><b>Request Updated</b></td><td>' + date_updated + '</td></tr></table>')
-
-                logging.info('Delete request entry (not workout) sent to trash, action logged to Slack, requestor emailed.')
+                context = DeleteRejectedEmailContext.from_entry(entry)
+                self.smtp.queue_email('Map Pin NOT Deleted', [context.submitter_email], self.email_templates.render_delete_rejected(context))
+
+                logging.info('Delete request entry (not workout) sent to trash, action logged to Slack, requestor email queued.')
             else:
                 self.slack.post_msg_to_channel(text='Workout delete rejection failed! ' + user_name + ' tried to not send it to trash, the system failed. Call admin.', thread_ts=body['container']['message_ts'])
 
@@ -361,6 +482,70 @@ class MapApprovalHandler:
         logging.info('Done handling Slack Action.')
     
 
+    def handle_bulk_action(self, action: str, entries: list, requested_by: str) -> None:
+        """Approves or trashes many entries at once. Gravity Forms reads and writes run BULK_CONCURRENCY entries at a time,
+        then the Slack messages given by message_ts are updated, the emails are queued as Email jobs and a summary is posted.
+        entries is a list of dicts with entry_id, optional message_ts, and (for trash) delete_entry_id.
+        Without message_ts, the request message is found in the message store by entry ID (delete_entry_id for trash).
+        """
+        logging.info('Handling bulk ' + action + ' of ' + str(len(entries)) + ' entries, requested by ' + requested_by + '.')
+
+        def run(item: dict) -> tuple:
+            """Returns (result, email), where email is the SMTP.queue_email arguments or None."""
+
+            try:
+                if action == 'approve':
+                    entry = self._approve_entry(str(item['entry_id']))
+                    return ('Failed', None) if entry is None else ('Approved', self._get_approved_email(entry))
+                else:
+                    return self._trash_workout(str(item['entry_id']), str(item['delete_entry_id']))
+            except Exception as error:
+                logging.exception('Bulk ' + action + ' failed for entry ' + str(item['entry_id']) + '.')
+                return ('Failed: ' + str(error), None)
+
+        with ThreadPoolExecutor(max_workers=self._BULK_CONCURRENCY, thread_name_prefix='bulk') as executor:
+            (results, emails) = zip(*executor.map(Tracing.wrap(run), entries))
+
+        # Slack updates go one after another through the rate limited client once all of the Gravity Forms work is done.
+        action_time = Slack.convert_ts_to_et(str(time.time()))
+        for (item, result) in zip(entries, results):
+            if result not in ('Approved', 'Deleted', 'Already deleted'):
+                continue
+
+            try:
+                if 'message_ts' in item:
+                    message = self.slack.get_msg(item['message_ts'])
+                    message_ts = item['message_ts']
+                else:
+                    message = self.slack.get_msg_by_entry_id(str(item['entry_id'] if action == 'approve' else item['delete_entry_id']))
+                    if message is None:
+                        continue
+                    message_ts = message['ts']
+
+                if result == 'Approved':
+                    statusBlock = Slack.get_block_section('Request approved by ' + requested_by + ' (bulk) at ' + action_time)
+                elif result == 'Deleted':
+                    statusBlock = Slack.get_block_section('Workout sent to trash by ' + requested_by + ' (bulk) at ' + action_time)
+                else:
+                    statusBlock = Slack.get_block_section('This workout was already deleted. Sorry about that. You should be good to go.')
+                blocks = Slack.replace_buttons(blocks=message['blocks'], newBlock=statusBlock)
+                self.slack.replace_msg(original_message=message, ts=message_ts, blocks=blocks)
+            except Exception:
+                logging.exception('Could not update the Slack message for entry ' + str(item['entry_id']) + '.')
+
+        for email in emails:
+            if email is not None:
+                self.smtp.queue_email(**email)
+
+        succeeded = len([result for result in results if result in ('Approved', 'Deleted', 'Already deleted')])
+        summary = 'Bulk ' + action + ' requested by ' + requested_by + ': ' + str(succeeded) + ' of ' + str(len(entries)) + ' succeeded.'
+        lines = ['Entry ' + str(item['entry_id']) + ': ' + result for (item, result) in zip(entries, results)]
+
+        (postChannel, postTS) = self.slack.post_msg_to_channel(summary)
+        self.slack.post_thread_replies(lines, thread_ts=postTS, channel=postChannel)
+        logging.info(summary)
+
+
     def handle_slack_view_submission(self, body: dict):
         logging.debug(body)
         logging.info('Handling Slack View Submission.')
@@ -373,7 +558,7 @@ class MapApprovalHandler:
             message_ts = callback_pieces[1]
             
             entryId = callback_pieces[2]
-            entry = self.gravity_forms.get_entry(entryId)
+            entry = self.gravity_forms.get_entry(entryId, use_cache=False)
 
             edited = False
             if body['view']['state']['values']['workout_name']['workout_name']['value'] != entry['2']:
@@ -446,10 +631,11 @@ class MapApprovalHandler:
 
     def handle_unapproved_workout_check(self, alert_on_no_unapproved: bool, include_channel_mention_on_alert: bool) -> None:
         logging.info('Handling Check Unapproved (workouts).')
-        unapprovedUpdateCount = self.gravity_forms.get_unapproved_count(self.gravity_forms.FORM_ID_WORKOUT)
-        unapprovedDeleteCount = self.gravity_forms.get_unapproved_count(self.gravity_forms.FORM_ID_WORKOUT_DELETE)
+        counts = self.gravity_forms.get_unapproved_counts([self.gravity_forms.FORM_ID_WORKOUT, self.gravity_forms.FORM_ID_WORKOUT_DELETE])
+        unapprovedUpdateCount = counts[self.gravity_forms.FORM_ID_WORKOUT]
+        unapprovedDeleteCount = counts[self.gravity_forms.FORM_ID_WORKOUT_DELETE]
 
-        if unapprovedUpdateCount == 0 & unapprovedDeleteCount == 0:
+        if unapprovedUpdateCount == 0 and unapprovedDeleteCount == 0:
             logging.info('No unapproved.')
             if alert_on_no_unapproved:
                 self.slack.post_msg_to_channel(text='There are no unapproved requests pending.')
@@ -476,7 +662,7 @@ class MapApprovalHandler:
 
     def handle_unapproved_region_check(self, alert_on_no_unapproved: bool, include_channel_mention_on_alert: bool) -> None:
         logging.info('Handling Check Unapproved (regions).')
-        unapprovedUpdateCount = self.gravity_forms.get_unapproved_count(self.gravity_forms.FORM_ID_REGION)
+        unapprovedUpdateCount = self.gravity_forms.get_unapproved_counts([self.gravity_forms.FORM_ID_REGION])[self.gravity_forms.FORM_ID_REGION]
 
         if unapprovedUpdateCount == 0:
             logging.info('No unapproved.')
@@ -1,45 +1,146 @@
+import time
+_STARTUP_BEGAN_AT = time.perf_counter()
+
 import os
 from flask import Flask, request, Response, send_from_directory
 from dotenv import load_dotenv
-from threading import Thread
 import logging
 import json
-import google.cloud.logging
+import hmac
+import threading
 from handlers.map_approval import MapApprovalHandler
 from services.google_sheets import GoogleSheets
+from services.dispatcher import Dispatcher, Job_Type
+from services.job_store import JobStore
+from services.dedup import Deduplicator
+from services.map import Map
+from services.metrics import Metrics
+from services.capture import PayloadCapture
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
-googleLoggingClient = google.cloud.logging.Client()
-googleLoggingClient.setup_logging()
+startup_timings = {'imports': time.perf_counter() - _STARTUP_BEGAN_AT}
 
 map_approval = MapApprovalHandler()
+startup_timings['handler'] = time.perf_counter() - _STARTUP_BEGAN_AT - sum(startup_timings.values())
+
+job_store = JobStore()
+dispatcher = Dispatcher(job_store=job_store)
+dispatcher.register(Job_Type.GravityFormsWorkout, map_approval.handle_gravity_forms_submission, Dispatcher.get_limit(Job_Type.GravityFormsWorkout, 4))
+dispatcher.register(Job_Type.GravityFormsWorkoutDelete, map_approval.handle_gravity_forms_delete, Dispatcher.get_limit(Job_Type.GravityFormsWorkoutDelete, 2))
+dispatcher.register(Job_Type.SlackAction, map_approval.handle_slack_action, Dispatcher.get_limit(Job_Type.SlackAction, 4))
+dispatcher.register(Job_Type.SlackViewSubmission, map_approval.handle_slack_view_submission, Dispatcher.get_limit(Job_Type.SlackViewSubmission, 2))
+dispatcher.register(Job_Type.UnapprovedWorkoutCheck, map_approval.handle_unapproved_workout_check, Dispatcher.get_limit(Job_Type.UnapprovedWorkoutCheck, 1))
+dispatcher.register(Job_Type.UnapprovedRegionCheck, map_approval.handle_unapproved_region_check, Dispatcher.get_limit(Job_Type.UnapprovedRegionCheck, 1))
+dispatcher.register(Job_Type.BulkAction, map_approval.handle_bulk_action, Dispatcher.get_limit(Job_Type.BulkAction, 1))
+dispatcher.register(Job_Type.Email, map_approval.smtp.send_email, Dispatcher.get_limit(Job_Type.Email, 4))
+map_approval.smtp.set_outbox(dispatcher)
+dispatcher.start()
+map_approval.workout_history.start()
+deduplicator = Deduplicator()
+capture = PayloadCapture()
+
+metrics = Metrics.get_shared()
+metrics.add_gauge('dispatcher_queue_depth', 'Jobs accepted but not yet started.', dispatcher.get_queue_depth)
+metrics.add_gauge('dispatcher_in_flight', 'Jobs currently running, by job type.', dispatcher.get_in_flight, label='job_type')
+metrics.add_gauge('jobs', 'Jobs in the job store, by state.', job_store.get_counts, label='state')
+metrics.add_gauge('webhook_duplicates_total', 'Webhooks dropped as duplicates.', lambda: deduplicator.duplicates, type='counter')
+metrics.add_gauge('webhook_debounced_total', 'Workout webhooks held to coalesce rapid resubmissions of the same entry.', lambda: job_store.debounced, type='counter')
+startup_timings['dispatcher'] = time.perf_counter() - _STARTUP_BEGAN_AT - sum(startup_timings.values())
 
 app = Flask(__name__)
 
+BULK_ACTION_TOKEN = os.getenv('BULK_ACTION_TOKEN')
+BULK_MAX_ENTRIES = int(os.getenv('BULK_MAX_ENTRIES', '200'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+EDIT_DEBOUNCE_SECONDS = float(os.getenv('EDIT_DEBOUNCE_SECONDS', '30')) # 0 turns debouncing off
+EDIT_DEBOUNCE_MAX_SECONDS = float(os.getenv('EDIT_DEBOUNCE_MAX_SECONDS', '120'))
+CLOUD_LOGGING = os.getenv('CLOUD_LOGGING', 'true').lower() in ('1', 'true', 'yes')
+
+
+def warm_up() -> None:
+    """Runs after startup, off the request path. Attaches Cloud Logging (its import alone takes about half a second)
+    and creates the clients and the Slack message store that are otherwise built on first use, so the first real job does not pay for them.
+    """
+
+    began_at = time.perf_counter()
+    if CLOUD_LOGGING:
+        try:
+            import google.cloud.logging
+            googleLoggingClient = google.cloud.logging.Client()
+            googleLoggingClient.setup_logging()
+        except Exception:
+            logging.exception('Could not attach Cloud Logging. Logging to stderr only.')
+    logging_seconds = time.perf_counter() - began_at
+
+    try:
+        map_approval.slack._client
+        map_approval.slack._messages
+        Map._get_client()
+    except Exception:
+        logging.exception('Could not create the API clients during warm up. They will be created on first use.')
+
+    logging.info('Warm up took ' + str(round((time.perf_counter() - began_at) * 1000)) + ' ms (cloud logging ' + str(round(logging_seconds * 1000)) + ' ms).')
+
+
+threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+startup_timings['total'] = time.perf_counter() - _STARTUP_BEGAN_AT
+logging.info('Started in ' + str(round(startup_timings['total'] * 1000)) + ' ms (' + ', '.join(phase + ' ' + str(round(seconds * 1000)) + ' ms' for (phase, seconds) in startup_timings.items() if phase != 'total') + ').')
+
 
 @app.route('/')
 def status():
     return Response('Service is running.', 200)
 
 
+@app.route('/metrics')
+def process_metrics():
+    """Prometheus text format. When METRICS_TOKEN is set, requires 'Authorization: Bearer <METRICS_TOKEN>'."""
+
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), ('Bearer ' + METRICS_TOKEN).encode()):
+        return Response(status=403)
+
+    return Response(metrics.render(), 200, mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'),
                           'favicon.ico',mimetype='image/vnd.microsoft.icon')
 
 
+def get_workout_coalesce_key(entry: dict) -> str|None:
+    """Resubmissions of the same workout entry share this key, so an edit storm is processed in one pass (see Dispatcher.submit)."""
+
+    return 'workout:' + str(entry['id']) if isinstance(entry, dict) and 'id' in entry else None
+
+
+def dispatch(job_type: Job_Type, kwargs: dict, dedup_keys: list|None = None, coalesce_key: str|None = None) -> Response:
+    """Hands the job to the worker pool. Returns 503 when the queue is full so the sender retries later.
+    A webhook whose dedup_keys were already seen is acknowledged with a 200 and dropped. One that follows another
+    with the same coalesce_key within EDIT_DEBOUNCE_SECONDS is held, and replaced by any that follow it.
+    """
+
+    dedup_keys = dedup_keys or []
+    if not deduplicator.claim(dedup_keys):
+        return Response(status=200)
+
+    if not dispatcher.submit(job_type, kwargs, coalesce_key, EDIT_DEBOUNCE_SECONDS, EDIT_DEBOUNCE_MAX_SECONDS):
+        deduplicator.release(dedup_keys)
+        return Response('Too many requests are being processed. Try again shortly.', status=503)
+
+    return Response(status=200)
+
+
 @app.route('/webhooks/gravityforms/workout', methods=['POST'])
 def process_gravity_forms_workout():
-    thread = Thread(target=map_approval.handle_gravity_forms_submission, kwargs={'entry':request.json})
-    thread.start()
-    return Response(status=200)
+    capture.record(request.path, request.json)
+    return dispatch(Job_Type.GravityFormsWorkout, {'entry':request.json}, Deduplicator.get_gravity_forms_keys('workout', request.json), get_workout_coalesce_key(request.json))
 
 
 @app.route('/webhooks/gravityforms/workoutdelete', methods=['POST'])
 def process_gravity_forms_workout_delete():
-    thread = Thread(target=map_approval.handle_gravity_forms_delete, kwargs={'entry':request.json})
-    thread.start()
-    return Response(status=200)
+    capture.record(request.path, request.json)
+    return dispatch(Job_Type.GravityFormsWorkoutDelete, {'entry':request.json}, Deduplicator.get_gravity_forms_keys('workoutdelete', request.json))
 
 
 @app.route('/webhooks/slack', methods=['POST'])
@@ -48,15 +149,15 @@ def process_slack():
     logging.debug(body)
 
     if body['type'] == 'block_actions':
-        thread = Thread(target=map_approval.handle_slack_action, kwargs={'body':body})
+        job_type = Job_Type.SlackAction
     elif body['type'] == 'view_submission':
-        thread = Thread(target=map_approval.handle_slack_view_submission, kwargs={'body':body})
+        job_type = Job_Type.SlackViewSubmission
     else:
         logging.warning('Received an interactive message from Slack with an unhandled type: ' + body['type'])
         return Response(status=400)
 
-    thread.start()
-    return Response(status=200)
+    capture.record(request.path, body, form=True)
+    return dispatch(job_type, {'body':body}, Deduplicator.get_slack_keys(body))
 
 
 @app.route('/webhooks/checkunapproved', methods=['POST'])
@@ -70,13 +171,39 @@ def process_unapproved_workout_check():
         return Response('Must include parameter called "type" with value "workouts" or "regions" (field name and value are case-sensative).', status=400)
     
     if check_type == 'workouts':
-        target_handler = map_approval.handle_unapproved_workout_check
+        job_type = Job_Type.UnapprovedWorkoutCheck
     else:
-        target_handler = map_approval.handle_unapproved_region_check
+        job_type = Job_Type.UnapprovedRegionCheck
 
-    thread = Thread(target=target_handler, kwargs={'alert_on_no_unapproved':alert_on_no_unapproved, 'include_channel_mention_on_alert':include_channel_mention_on_alert})
-    thread.start()
-    return Response(status=200)
+    return dispatch(job_type, {'alert_on_no_unapproved':alert_on_no_unapproved, 'include_channel_mention_on_alert':include_channel_mention_on_alert})
+
+
+@app.route('/webhooks/bulkapprove', methods=['POST'])
+def process_bulk_action():
+    """Approves or trashes a list of entries. Requires 'Authorization: Bearer <BULK_ACTION_TOKEN>'. Body:
+    {"action": "approve" or "trash", "requested_by": "name", "entries": [{"entry_id": "123", "message_ts": "optional", "delete_entry_id": "trash only"}]}
+    Per-entry results are posted to the map channel.
+    """
+
+    if not BULK_ACTION_TOKEN or not hmac.compare_digest(request.headers.get('Authorization', '').encode(), ('Bearer ' + BULK_ACTION_TOKEN).encode()):
+        return Response(status=403)
+
+    body = request.get_json(silent=True) or {}
+    action = body.get('action', 'approve')
+    entries = body.get('entries')
+
+    if action != 'approve' and action != 'trash':
+        return Response('"action" must be "approve" or "trash".', status=400)
+
+    if not isinstance(entries, list) or len(entries) == 0 or len(entries) > BULK_MAX_ENTRIES:
+        return Response('"entries" must be a list of 1 to ' + str(BULK_MAX_ENTRIES) + ' entries.', status=400)
+
+    required_keys = ['entry_id'] if action == 'approve' else ['entry_id', 'delete_entry_id']
+    for item in entries:
+        if not isinstance(item, dict) or any(key not in item for key in required_keys):
+            return Response('Every entry must include ' + ' and '.join(required_keys) + '.', status=400)
+
+    return dispatch(Job_Type.BulkAction, {'action':action, 'entries':entries, 'requested_by':str(body.get('requested_by', 'bulk request'))})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,18 @@
+from services.google_sheets import GoogleSheets
+from services.async_http import AsyncHttpSession
+
+class AsyncGoogleSheets:
+    """Async counterpart of GoogleSheets. Responses are parsed by the same code as the sync calls."""
+
+    def __init__(self) -> None:
+        self._http = AsyncHttpSession.get_shared()
+
+    async def get_single_entity(self, entryId: str) -> dict:
+        param = {"dataset":"workouts","entryid": entryId}
+        response = await self._http.get(GoogleSheets.WORKOUT_HISTORY_SPREADSHEETURL, params=param, metric=('google_sheets', 'get_single_entity'))
+        return GoogleSheets._parse_single_entity(response.json(), entryId)
+
+    async def get_dataset(self, dataset: str) -> list:
+        param = {"dataset": dataset}
+        response = await self._http.get(GoogleSheets.WORKOUT_HISTORY_SPREADSHEETURL, params=param, metric=('google_sheets', 'get_dataset'))
+        return GoogleSheets._parse_dataset(response.json(), dataset)
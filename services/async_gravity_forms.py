@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from services.gravity_forms import GravityForms
+from services.async_http import AsyncHttpSession
+
+class AsyncGravityForms:
+    """Async counterpart of GravityForms. Wraps a GravityForms instance and shares its configuration and its
+    entry and count caches, so entries seeded or updated on either side are seen by the other.
+    """
+
+    def __init__(self, gravity_forms: GravityForms) -> None:
+        self._gravity_forms = gravity_forms
+        self._http = AsyncHttpSession.get_shared()
+        self.BASE_URL = gravity_forms.BASE_URL
+        self.FORM_ID_WORKOUT = gravity_forms.FORM_ID_WORKOUT
+        self.FORM_ID_WORKOUT_DELETE = gravity_forms.FORM_ID_WORKOUT_DELETE
+
+    def _get_request_kwargs(self) -> dict:
+        return {'auth': (self._gravity_forms.KEY, self._gravity_forms.SECRET), 'headers': self._gravity_forms.headers}
+
+    async def get_unapproved_count(self, formId: str) -> int:
+        cached = self._gravity_forms._count_cache.get(formId)
+        if cached is not None:
+            return cached
+
+        param = {"search": '{"field_filters": [{"key":"is_approved","value":3,"operator":"="}]}'}
+        response = await self._http.get(self.BASE_URL + '/wp-json/gf/v2/forms/' + formId + '/entries', params=param, metric=('gravity_forms', 'get_unapproved_count'), **self._get_request_kwargs())
+        count = int(response.json()['total_count'])
+        self._gravity_forms._count_cache.set(formId, count)
+        return count
+
+    async def get_unapproved_counts(self, formIds: list) -> dict:
+        counts = await asyncio.gather(*[self.get_unapproved_count(formId) for formId in formIds])
+        return dict(zip(formIds, counts))
+
+    async def get_entry(self, entryId: str, print_response: bool = False, use_cache: bool = True) -> dict:
+        if use_cache:
+            cached = self._gravity_forms._get_cached_entry(entryId)
+            if cached is not None:
+                return cached
+
+        response = await self._http.get(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, metric=('gravity_forms', 'get_entry'), **self._get_request_kwargs())
+
+        if print_response:
+            logging.info(response.content)
+
+        entry = response.json()
+
+        if response.status_code == 200:
+            self._gravity_forms._cache_entry(entry)
+
+        return entry
+
+    def seed_entry(self, entry: dict) -> bool:
+        return self._gravity_forms.seed_entry(entry)
+
+    async def update_entry(self, entryId: str, entry: dict) -> bool:
+        response = await self._http.put(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, json=entry, metric=('gravity_forms', 'update_entry'), **self._get_request_kwargs())
+
+        if response.status_code != 200:
+            self._gravity_forms._entry_cache.delete(entryId)
+            return False
+
+        try:
+            updated = response.json()
+        except ValueError:
+            updated = None
+
+        await asyncio.to_thread(self._gravity_forms._record_update, entryId, entry, updated) # Records the write on the job
+        return True
+
+    async def trash_entry(self, entryId: str) -> bool:
+        response = await self._http.delete(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, metric=('gravity_forms', 'trash_entry'), **self._get_request_kwargs())
+
+        if response.status_code != 200:
+            return False
+
+        await asyncio.to_thread(self._gravity_forms._record_trash, entryId)
+        return True
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import logging
+import json
+import time
+from urllib.parse import urlsplit
+from services.http import HttpSession
+from services.metrics import Metrics
+from services.tracing import Tracing
+
+class AsyncHttpResponse:
+    """The parts of a requests.Response the services read, with the body already downloaded."""
+
+    def __init__(self, status_code: int, content: bytes, headers: dict) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = 'utf-8-sig'
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding))
+
+
+class AsyncHttpSession:
+    """aiohttp counterpart of HttpSession for the async services. One event loop keeps every call in flight without
+    a thread per call, so the connection limit is higher. Timeout and retry/backoff settings are shared with HttpSession.
+    The aiohttp session is created on first use, inside the running event loop.
+    """
+    _POOL_SIZE = int(os.getenv('ASYNC_HTTP_POOL_SIZE', '100'))
+    _RETRY_STATUSES = (429, 500, 502, 503, 504)
+    _RETRY_METHODS = ('GET', 'PUT', 'DELETE')
+    _shared = None
+
+    def __init__(self, pool_size: int|None = None, timeout_seconds: float|None = None) -> None:
+        self._pool_size = pool_size or self._POOL_SIZE
+        self._timeout_seconds = timeout_seconds or HttpSession._TIMEOUT_SECONDS
+        self._session = None
+
+    def get_shared() -> 'AsyncHttpSession':
+        """The process wide session that all async services share. Only used from the one event loop, so no lock is needed."""
+
+        if AsyncHttpSession._shared is None:
+            AsyncHttpSession._shared = AsyncHttpSession()
+        return AsyncHttpSession._shared
+
+    def get_session(self):
+        """The aiohttp.ClientSession, also handed to the async Slack client so it shares the connection pool."""
+
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._pool_size),
+                                                  timeout=aiohttp.ClientTimeout(total=self._timeout_seconds))
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def get(self, url: str, **kwargs) -> AsyncHttpResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> AsyncHttpResponse:
+        return await self.request('PUT', url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> AsyncHttpResponse:
+        return await self.request('DELETE', url, **kwargs)
+
+    async def request(self, method: str, url: str, metric: tuple|None = None, auth: tuple|None = None, **kwargs) -> AsyncHttpResponse:
+        """Takes the same arguments as HttpSession.request. auth is a (user, password) tuple, as with requests."""
+
+        import aiohttp
+
+        if auth is not None:
+            kwargs['auth'] = aiohttp.BasicAuth(auth[0], auth[1])
+
+        host = urlsplit(url).netloc
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                async with self.get_session().request(method, url, **kwargs) as response:
+                    result = AsyncHttpResponse(response.status, await response.read(), dict(response.headers))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if method not in self._RETRY_METHODS or attempt >= HttpSession._RETRIES:
+                    self._record(host, time.perf_counter() - start, True, metric)
+                    raise
+                result = None
+
+            if result is not None and (result.status_code not in self._RETRY_STATUSES or method not in self._RETRY_METHODS or attempt >= HttpSession._RETRIES):
+                self._record(host, time.perf_counter() - start, result.status_code >= 400, metric)
+                return result
+
+            await asyncio.sleep(self._get_backoff_seconds(attempt, result))
+            attempt += 1
+
+    def _get_backoff_seconds(self, attempt: int, response: AsyncHttpResponse|None) -> float:
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return float(response.headers['Retry-After'])
+
+        return HttpSession._RETRY_BACKOFF_SECONDS * (2 ** attempt)
+
+    def _record(self, host: str, seconds: float, error: bool, metric: tuple|None) -> None:
+        if metric is not None:
+            Metrics.get_shared().observe(metric[0], metric[1], seconds, error)
+            Tracing.record(metric[0] + '.' + metric[1], seconds, error)
+
+        if seconds > self._timeout_seconds / 2:
+            logging.warning('Slow call to ' + host + ': ' + str(round(seconds * 1000)) + ' ms.')
@@ -0,0 +1,71 @@
+from services.distance import Distance
+from services.geocode_cache import GeocodeCache
+from services.gazetteer import Gazetteer
+from services.cache import MISSING
+from services.map import Map
+from services.async_http import AsyncHttpSession
+
+class AsyncMap:
+    """Async counterpart of Map's geocoding. Calls the Geocoding web service directly instead of through the googlemaps
+    client, and reads and fills the same GeocodeCache as Map. The URL helpers do not make calls, so use Map's.
+    """
+
+    def __init__(self) -> None:
+        self._http = AsyncHttpSession.get_shared()
+
+    async def _geocode(self, operation: str, params: dict) -> list:
+        """Returns the results list, which is empty for ZERO_RESULTS. Raises ValueError for any other failed status, like googlemaps."""
+
+        params['key'] = Map._KEY
+        response = await self._http.get(Map._BASE_URL + '/maps/api/geocode/json', params=params, metric=('google_maps', operation))
+        body = response.json()
+
+        if body.get('status') == 'ZERO_RESULTS':
+            return []
+
+        if body.get('status') != 'OK':
+            raise ValueError('Geocoding failed with status ' + str(body.get('status')) + ': ' + str(body.get('error_message', '')))
+
+        return body['results']
+
+    async def get_address_from_latlong(self, latitude: str, longitude: str) -> str:
+        if Gazetteer.parse_latlong(latitude, longitude) is None:
+            return 'Invalid lat/long'
+
+        key = GeocodeCache.get_latlong_key(latitude, longitude)
+        if key is not None:
+            cached = Map._cache.get(key)
+            if cached is not MISSING:
+                return cached
+
+        try:
+            addresses = await self._geocode('reverse_geocode', {'latlng': latitude + ',' + longitude})
+        except:
+            return 'Invalid lat/long'
+
+        result = Map._parse_reverse_geocode(addresses)
+        if key is not None:
+            Map._cache.set(key, result)
+
+        return result
+
+    async def get_latlong_from_address(self, address) -> tuple[str, str]:
+        key = GeocodeCache.get_address_key(address)
+        cached = Map._cache.get(key)
+        if cached is not MISSING:
+            return tuple(cached)
+
+        result = Map._parse_geocode(await self._geocode('geocode', {'address': address}))
+        Map._cache.set(key, result)
+        return result
+
+    async def get_feet_between_address_and_latlong(self, address: str, latitude: str, longitude: str) -> int|str:
+        (address_lat, address_long) = await self.get_latlong_from_address(address=address)
+        if address_lat == None:
+            return 'Address could not be converted to lat/long'
+
+        try:
+            feet = round(Distance.get_feet(address_lat, address_long, latitude, longitude))
+        except Exception as error:
+            return 'Distance could not be calculated: ' + str(error)
+        return feet
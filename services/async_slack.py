@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from services.slack import Slack
+from services.cache import MISSING
+from services.metrics import Metrics
+from services.job_store import JobStore
+from services.async_http import AsyncHttpSession
+
+class AsyncSlack:
+    """Async counterpart of Slack's Web API calls. Wraps a Slack instance and shares its per-channel token buckets,
+    message store and user cache. Block building and the other helpers that make no calls are used from Slack directly.
+    The message store is SQLite, so its reads and writes run on a worker thread.
+    """
+
+    def __init__(self, slack: Slack) -> None:
+        self._slack = slack
+        self._web_client = None
+
+    @property
+    def _client(self):
+        """The AsyncWebClient, created on first use inside the event loop. It shares AsyncHttpSession's connection pool."""
+
+        if self._web_client is None:
+            from slack_sdk.web.async_client import AsyncWebClient
+            self._web_client = AsyncWebClient(token=Slack._TOKEN, base_url=Slack._API_BASE_URL, session=AsyncHttpSession.get_shared().get_session())
+        return self._web_client
+
+    async def get_display_name(self, userId: str) -> str:
+        cached = self._slack._user_cache.get(userId, MISSING)
+        if cached is MISSING:
+            user = await self._call(self._client.users_profile_get, user=userId)
+            display_name = user['profile']['display_name_normalized']
+            self._slack._user_cache.set(userId, (display_name, time.monotonic()))
+            return display_name
+
+        (display_name, fetched_at) = cached
+        if time.monotonic() - fetched_at > Slack._USER_CACHE_REFRESH_SECONDS:
+            self._slack._refresh_display_name_in_background(userId)
+
+        return display_name
+
+    async def get_msg(self, ts: str, channel: str|None = None) -> dict:
+        channel = channel or Slack._MAP_CHANNEL_ID
+        message = await asyncio.to_thread(self._slack._get_stored_msg, channel, ts)
+        if message is not None:
+            return message
+
+        response = await self._call(self._client.conversations_history, channel=channel, inclusive=True, oldest=ts, limit=1)
+        message = response['messages'][0]
+        await asyncio.to_thread(self._slack._store_msg, channel, ts, message)
+        return message
+
+    async def get_msg_by_entry_id(self, entryId: str, channel: str|None = None) -> dict|None:
+        return await asyncio.to_thread(self._slack.get_msg_by_entry_id, entryId, channel)
+
+    async def post_msg_to_channel(self, text: str, blocks: list|None = None, thread_ts: str|None = None, unfurl: bool = False, channel: str = None, entry_id: str|None = None) -> tuple[str, str]:
+        if channel is None:
+            channel = Slack._MAP_CHANNEL_ID
+
+        response = await self._call_rate_limited(self._client.chat_postMessage, channel=channel, text=text, blocks=blocks, thread_ts=thread_ts, unfurl_links=unfurl, unfurl_media=unfurl)
+        await asyncio.to_thread(JobStore.record_write, 'posted to Slack')
+        if thread_ts is None:
+            await asyncio.to_thread(self._slack._record_message, response, text, blocks, entry_id)
+
+        logging.info('Posted request to Slack. Done handling.')
+        return (response['channel'], response["ts"])
+
+    async def post_thread_replies(self, texts: list, thread_ts: str, channel: str|None = None) -> None:
+        if not Slack._COALESCE_THREAD_REPLIES:
+            for text in texts:
+                await self.post_msg_to_channel(text, thread_ts=thread_ts, channel=channel)
+            return
+
+        message = ''
+        for text in texts:
+            if len(message) > 0 and len(message) + len(text) + 2 > Slack._MAX_REPLY_LENGTH:
+                await self.post_msg_to_channel(message, thread_ts=thread_ts, channel=channel)
+                message = ''
+
+            message = text if len(message) == 0 else message + '\n\n' + text
+
+        if len(message) > 0:
+            await self.post_msg_to_channel(message, thread_ts=thread_ts, channel=channel)
+
+    async def replace_msg(self, original_message: dict, ts: str, channel: str|None = None, text: str|None = None, blocks: dict|None = None) -> None:
+        channel = channel or Slack._MAP_CHANNEL_ID
+        text = text or original_message['text']
+        blocks = blocks or original_message['blocks']
+
+        response = await self._call_rate_limited(self._client.chat_update, channel=channel, ts=ts, blocks=blocks, text=text)
+        await asyncio.to_thread(JobStore.record_write, 'updated a Slack message')
+        await asyncio.to_thread(self._slack._record_message, response, text, blocks)
+
+    async def _call(self, method, **kwargs):
+        with Metrics.get_shared().timed('slack', method.__name__):
+            return await method(**kwargs)
+
+    async def _call_rate_limited(self, method, **kwargs):
+        """Same as Slack._call_rate_limited, but waits for the channel's token bucket with asyncio.sleep instead of blocking."""
+
+        from slack_sdk.errors import SlackApiError
+
+        channel = kwargs['channel']
+        bucket = self._slack._get_post_bucket(channel)
+        attempt = 0
+        while True:
+            wait = bucket.try_acquire()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.try_acquire()
+
+            try:
+                return await self._call(method, **kwargs)
+            except SlackApiError as error:
+                if error.response.status_code != 429 or attempt >= Slack._RATE_LIMIT_RETRIES:
+                    raise
+
+                attempt += 1
+                retry_after = float(error.response.headers.get('Retry-After', 1))
+                logging.warning('Slack rate limited channel ' + channel + '. Retrying in ' + str(retry_after) + ' seconds.')
+                bucket.pause(retry_after)
@@ -0,0 +1,13 @@
+import asyncio
+from services.smtp import SMTP
+
+class AsyncSMTP:
+    """Async counterpart of SMTP. Queuing an email writes an Email job to the JobStore, so it runs on a worker thread
+    to keep the event loop free. The job itself is sent by the dispatcher with the shared SMTP instance.
+    """
+
+    def __init__(self, smtp: SMTP) -> None:
+        self._smtp = smtp
+
+    async def queue_email(self, subject: str, toEmails: list, body: str) -> None:
+        await asyncio.to_thread(self._smtp.queue_email, subject, toEmails, body)
@@ -0,0 +1,79 @@
+import os
+import logging
+import threading
+import json
+import re
+import time
+
+class PayloadCapture:
+    """Appends incoming webhook payloads, with personal details and Slack secrets removed, to a JSON lines file
+    that bench/replay.py can send back to an instance. Only enabled when CAPTURE_PAYLOADS_PATH is set.
+    """
+    _PATH = os.getenv('CAPTURE_PAYLOADS_PATH')
+    _EMAIL = re.compile(r'[\w.+-]+@[\w-]+(\.[\w-]+)+')
+    _SUBMITTER_LINE = re.compile(r'(\*Submitter:\* )[^\n]*') # In the request messages Slack sends back with block_actions
+    _REDACTED_KEYS = {'token', 'trigger_id', 'response_url', 'ip', 'user_agent', 'source_url', 'hash', 'enterprise', 'authorizations'}
+    _VIEW_KEPT_KEYS = {'hash'} # A view's hash is not a secret, and Deduplicator keys view submissions on it
+    _NAME_KEYS = {'name', 'username', 'real_name', 'display_name'}
+    # Gravity Forms fields that hold the submitter's name and email, by route
+    _FORM_FIELDS = {'/webhooks/gravityforms/workout': {'18': 'Captured Submitter', '19': 'submitter@example.com'},
+                    '/webhooks/gravityforms/workoutdelete': {'4': 'Captured Submitter', '3': 'submitter@example.com'}}
+
+    def __init__(self, path: str|None = None) -> None:
+        self._path = path or self._PATH
+        self._lock = threading.Lock()
+        self.enabled = bool(self._path)
+
+    def record(self, route: str, payload, form: bool = False) -> None:
+        """Writes one captured webhook. form is True when the payload arrived as a form 'payload' field (Slack) instead of a JSON body."""
+
+        if not self.enabled:
+            return
+
+        try:
+            line = json.dumps({'at': time.time(), 'route': route, 'form': form, 'payload': PayloadCapture.sanitize(route, payload)})
+            with self._lock:
+                with open(self._path, 'a', encoding='utf-8') as file:
+                    file.write(line + '\n')
+        except Exception:
+            logging.exception('Could not capture payload for ' + route + '.')
+
+    def sanitize(route: str, payload):
+        """Returns a copy of the payload with submitter names and emails replaced and Slack tokens and URLs removed.
+        IDs and timestamps are kept so the replayed webhooks behave like the originals.
+        """
+
+        payload = PayloadCapture._scrub(payload)
+        if isinstance(payload, dict):
+            for (field, value) in PayloadCapture._FORM_FIELDS.get(route, {}).items():
+                if field in payload:
+                    payload[field] = value
+
+            # The edit modal's submitter name input
+            submitterName = payload.get('view', {}).get('state', {}).get('values', {}).get('submitter_name', {}).get('submitter_name')
+            if isinstance(submitterName, dict) and submitterName.get('value') is not None:
+                submitterName['value'] = 'Captured Submitter'
+
+        return payload
+
+    def _scrub(value, key: str|None = None):
+        if isinstance(value, dict):
+            # Secrets are replaced rather than dropped, so handlers that read them still find the key.
+            return {childKey: 'redacted' if PayloadCapture._is_redacted(childKey, key) else PayloadCapture._scrub(childValue, childKey)
+                    for (childKey, childValue) in value.items()}
+
+        if isinstance(value, list):
+            return [PayloadCapture._scrub(item) for item in value]
+
+        if isinstance(value, str):
+            if key in PayloadCapture._NAME_KEYS:
+                return 'captured'
+            return PayloadCapture._SUBMITTER_LINE.sub(r'\1Captured Submitter', PayloadCapture._EMAIL.sub('submitter@example.com', value))
+
+        return value
+
+    def _is_redacted(key: str, parentKey: str|None) -> bool:
+        if parentKey == 'view' and key in PayloadCapture._VIEW_KEPT_KEYS:
+            return False
+
+        return key in PayloadCapture._REDACTED_KEYS
@@ -0,0 +1,70 @@
+import os
+import logging
+from services.cache import TTLCache
+
+class Deduplicator:
+    """Remembers recently accepted webhooks for a time window so repeats are dropped before they are dispatched.
+    Gravity Forms webhooks are keyed on (entry id, date_updated), Slack actions on (action_ts, message_ts).
+    A second, shorter window keyed on the message and button catches double clicks, which Slack sends with different action_ts values.
+    """
+    _WINDOW_SECONDS = float(os.getenv('DEDUP_WINDOW_SECONDS', '600'))
+    _DOUBLE_CLICK_SECONDS = float(os.getenv('DEDUP_DOUBLE_CLICK_SECONDS', '5'))
+    _MAX_SIZE = int(os.getenv('DEDUP_MAX_SIZE', '10000'))
+
+    def __init__(self) -> None:
+        self._seen = TTLCache(max_size=self._MAX_SIZE, ttl_seconds=self._WINDOW_SECONDS)
+        self.duplicates = 0
+
+    def get_gravity_forms_keys(webhook: str, entry: dict) -> list:
+        """Returns [] when the entry has no id or date_updated, in which case it is never treated as a duplicate."""
+
+        if not isinstance(entry, dict) or not entry.get('id') or not entry.get('date_updated'):
+            return []
+
+        return [(webhook, str(entry['id']), str(entry['date_updated']))]
+
+    def get_slack_keys(body: dict) -> list:
+        """Returns [] for payloads that can not be identified, in which case they are never treated as duplicates."""
+
+        if body.get('type') == 'view_submission':
+            view = body.get('view') or {}
+            if not view.get('id'):
+                return []
+            return [('view_submission', view['id'], str(view.get('hash', '')))]
+
+        actions = body.get('actions') or []
+        messageTs = (body.get('container') or {}).get('message_ts')
+        if len(actions) == 0 or not messageTs:
+            return []
+
+        keys = []
+        if actions[0].get('action_ts'):
+            keys.append(('block_actions', str(actions[0]['action_ts']), str(messageTs)))
+        keys.append(('click', str(messageTs), str(actions[0].get('value', actions[0].get('action_id', '')))))
+        return keys
+
+    def claim(self, keys: list) -> bool:
+        """Records the keys and returns True if none of them was seen within its window. Returns False for a duplicate."""
+
+        claimed = []
+        for key in keys:
+            ttl_seconds = self._DOUBLE_CLICK_SECONDS if key[0] == 'click' else None
+            if not self._seen.add(key, True, ttl_seconds):
+                for claimedKey in claimed:
+                    self._seen.delete(claimedKey)
+                self.duplicates += 1
+                logging.info('Dropped duplicate webhook ' + str(key) + '.')
+                return False
+            claimed.append(key)
+
+        return True
+
+    def release(self, keys: list) -> None:
+        """Forgets the keys, for when the webhook was accepted but could not be dispatched and the sender will retry."""
+
+        for key in keys:
+            self._seen.delete(key)
+
+    def get_stats(self) -> dict:
+        stats = self._seen.get_stats()
+        return {'duplicates': self.duplicates, 'size': stats['size']}
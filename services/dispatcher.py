@@ -0,0 +1,266 @@
+import os
+import logging
+import threading
+import queue
+import atexit
+import time
+from collections import deque
+from enum import Enum, auto
+from services.job_store import JobStore
+from services.metrics import Metrics
+from services.tracing import Tracing
+
+class Job_Type(Enum):
+    GravityFormsWorkout = auto()
+    GravityFormsWorkoutDelete = auto()
+    SlackAction = auto()
+    SlackViewSubmission = auto()
+    UnapprovedWorkoutCheck = auto()
+    UnapprovedRegionCheck = auto()
+    BulkAction = auto()
+    Email = auto()
+
+
+class Dispatcher:
+    """Runs handler jobs on a fixed pool of worker threads instead of one thread per webhook.
+    Jobs wait in a bounded queue, and each job type can be limited to a number of jobs running at once.
+    When given a JobStore, every accepted job is recorded before submit returns, failed jobs are retried
+    with backoff, and jobs left unfinished by a previous process are replayed on start. Jobs submitted with a
+    coalesce_key are debounced through the JobStore (see JobStore.add_debounced).
+    """
+    _WORKER_COUNT = int(os.getenv('DISPATCHER_WORKERS', '8'))
+    _QUEUE_SIZE = int(os.getenv('DISPATCHER_QUEUE_SIZE', '500'))
+    _DRAIN_TIMEOUT_SECONDS = float(os.getenv('DISPATCHER_DRAIN_TIMEOUT_SECONDS', '8'))
+    _RETRY_POLL_SECONDS = float(os.getenv('DISPATCHER_RETRY_POLL_SECONDS', '5'))
+
+    def __init__(self, worker_count: int|None = None, queue_size: int|None = None, job_store: JobStore|None = None) -> None:
+        self._worker_count = worker_count or self._WORKER_COUNT
+        self._queue_size = queue_size or self._QUEUE_SIZE
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._targets = {}
+        self._limits = {}
+        self._running = {}
+        self._waiting = {}
+        self._pending = 0
+        self._accepting = True
+        self._workers = []
+        self._job_store = job_store
+        self._stopped = threading.Event()
+
+    def get_limit(job_type: Job_Type, default: int) -> int:
+        """Reads the concurrency limit for a job type from DISPATCHER_LIMIT_<JOBTYPE>, e.g. DISPATCHER_LIMIT_SLACKACTION."""
+
+        return int(os.getenv('DISPATCHER_LIMIT_' + job_type.name.upper(), str(default)))
+
+    def register(self, job_type: Job_Type, target, limit: int|None = None) -> None:
+        """Sets the function run for a job type. limit caps how many jobs of that type run at once (defaults to the worker count)."""
+
+        with self._lock:
+            self._targets[job_type] = target
+            self._limits[job_type] = max(1, min(limit or self._worker_count, self._worker_count))
+            self._running[job_type] = 0
+            self._waiting[job_type] = deque()
+
+    def start(self) -> None:
+        for index in range(self._worker_count):
+            worker = threading.Thread(target=self._work, name='dispatcher-' + str(index), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        if self._job_store is not None:
+            self._replay_unfinished()
+            threading.Thread(target=self._poll_retries, name='dispatcher-retry', daemon=True).start()
+
+        atexit.register(self.shutdown)
+        logging.info('Dispatcher started with ' + str(self._worker_count) + ' workers and a queue size of ' + str(self._queue_size) + '.')
+
+    def submit(self, job_type: Job_Type, kwargs: dict, coalesce_key: str|None = None, debounce_seconds: float = 0, max_delay_seconds: float = 0) -> bool:
+        """Queues a job. Returns False if the job was rejected because the queue is full or the dispatcher is shutting down.
+        kwargs must be JSON serializable when a JobStore is used. A job with a coalesce_key that follows another with the
+        same key within debounce_seconds is held and run by the retry poll instead. Needs a JobStore, otherwise it runs now.
+        """
+
+        if not self._reserve(job_type):
+            return False
+
+        jobId = None
+        if self._job_store is not None:
+            try:
+                if coalesce_key is None or debounce_seconds <= 0:
+                    jobId = self._job_store.add(job_type.name, kwargs)
+                else:
+                    (jobId, run_now) = self._job_store.add_debounced(job_type.name, kwargs, coalesce_key, debounce_seconds, max(debounce_seconds, max_delay_seconds))
+                    if not run_now:
+                        logging.info('Holding ' + job_type.name + ' job ' + str(jobId) + ' for ' + coalesce_key + ' to coalesce rapid resubmissions.')
+                        self._release()
+                        return True
+            except Exception:
+                self._release()
+                raise
+
+        self._queue.put((job_type, kwargs, jobId))
+        return True
+
+    def enqueue(self, job_type: Job_Type, kwargs: dict) -> None:
+        """Queues a job that must not be dropped, such as an email. Needs a JobStore. If submit rejects the job,
+        it is recorded in the retry state instead, for the retry poll to pick up once there is room.
+        """
+
+        if self.submit(job_type, kwargs):
+            return
+
+        jobId = self._job_store.add(job_type.name, kwargs, delay_seconds=self._RETRY_POLL_SECONDS)
+        logging.info('Deferred ' + job_type.name + ' job ' + str(jobId) + ' to the retry poll.')
+
+    def _reserve(self, job_type: Job_Type) -> bool:
+        with self._lock:
+            if job_type not in self._targets:
+                raise ValueError('No target registered for job type ' + job_type.name)
+
+            if not self._accepting:
+                logging.warning('Dispatcher is shutting down. Rejected ' + job_type.name + ' job.')
+                return False
+
+            if self._pending >= self._queue_size:
+                logging.warning('Dispatcher queue is full (' + str(self._pending) + ' jobs). Rejected ' + job_type.name + ' job.')
+                return False
+
+            self._pending += 1
+            return True
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def get_queue_depth(self) -> int:
+        """Number of jobs accepted but not yet started."""
+
+        with self._lock:
+            return self._pending - sum(self._running.values())
+
+    def get_in_flight(self) -> dict:
+        """Number of jobs currently running, by job type name."""
+
+        with self._lock:
+            return {job_type.name: count for (job_type, count) in self._running.items()}
+
+    def shutdown(self, timeout: float|None = None) -> bool:
+        """Stops accepting jobs and waits for queued and running jobs to finish. Returns True if everything drained before the timeout."""
+
+        timeout = self._DRAIN_TIMEOUT_SECONDS if timeout is None else timeout
+
+        with self._lock:
+            if not self._accepting:
+                return self._pending == 0
+
+            self._accepting = False
+            logging.info('Dispatcher draining ' + str(self._pending) + ' jobs.')
+            drained = self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+        self._stopped.set()
+        for _ in self._workers:
+            self._queue.put(None)
+
+        if not drained:
+            logging.warning('Dispatcher did not finish draining before the timeout. ' + str(self._pending) + ' jobs were not completed.')
+
+        return drained
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            (job_type, kwargs, jobId) = job
+
+            with self._lock:
+                if self._running[job_type] >= self._limits[job_type]:
+                    # Another worker will pick it up when a job of the same type finishes.
+                    self._waiting[job_type].append((kwargs, jobId))
+                    continue
+
+                self._running[job_type] += 1
+
+            while job is not None:
+                self._run(job_type, kwargs, jobId)
+
+                with self._lock:
+                    self._pending -= 1
+                    if len(self._waiting[job_type]) > 0:
+                        (kwargs, jobId) = self._waiting[job_type].popleft()
+                    else:
+                        job = None
+                        self._running[job_type] -= 1
+
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def _run(self, job_type: Job_Type, kwargs: dict, jobId: int|None) -> None:
+        if jobId is not None:
+            self._job_store.mark_running(jobId)
+
+        # The job store ID follows a job through its retries, so it doubles as the trace's correlation ID.
+        with JobStore.track_writes(self._job_store, jobId) as writes:
+            try:
+                with Tracing.trace(job_type.name, trace_id=None if jobId is None else 'job-' + str(jobId)), Metrics.get_shared().timed('handler', job_type.name):
+                    self._targets[job_type](**kwargs)
+            except Exception as error:
+                logging.exception('Unhandled error while running ' + job_type.name + ' job.')
+                if jobId is not None:
+                    Dispatcher.fail_job(self._job_store, jobId, error, writes)
+                return
+
+
+        if jobId is not None:
+            self._job_store.mark_done(jobId)
+
+    def fail_job(job_store: JobStore, jobId: int, error: Exception, writes: list) -> None:
+        """Marks a job failed, retrying it only if it failed before making any external writes."""
+
+        if len(writes) > 0:
+            job_store.mark_failed(jobId, repr(error), retry=False)
+            logging.error('Job ' + str(jobId) + ' failed after it ' + ', '.join(dict.fromkeys(writes)) + '. It will not be retried, since running it again would repeat that.')
+        elif job_store.mark_failed(jobId, repr(error)):
+            logging.info('Job ' + str(jobId) + ' will be retried.')
+        else:
+            logging.error('Job ' + str(jobId) + ' failed too many times and will not be retried.')
+
+    def _resubmit(self, jobs: list) -> None:
+        """Queues jobs that are already in the JobStore. Jobs that do not fit are deferred to a later poll."""
+
+        for (jobId, job_type_name, kwargs) in jobs:
+            if job_type_name not in Job_Type.__members__ or Job_Type[job_type_name] not in self._targets:
+                logging.error('Job ' + str(jobId) + ' has an unknown job type (' + job_type_name + '). Marking it failed.')
+                self._job_store.mark_failed(jobId, 'Unknown job type', retry=False)
+                continue
+
+            job_type = Job_Type[job_type_name]
+            if self._reserve(job_type):
+                self._queue.put((job_type, kwargs, jobId))
+            else:
+                self._job_store.defer(jobId, self._RETRY_POLL_SECONDS)
+
+    def _replay_unfinished(self) -> None:
+        (jobs, abandoned) = self._job_store.claim_unfinished()
+        for (jobId, job_type_name, writes) in abandoned:
+            logging.error(job_type_name + ' job ' + str(jobId) + ' was interrupted after it ' + ', '.join(dict.fromkeys(writes)) + '. It will not be replayed, since that would repeat them. Check it by hand.')
+        if len(jobs) > 0:
+            logging.info('Replaying ' + str(len(jobs)) + ' jobs left unfinished by a previous run.')
+            self._resubmit(jobs)
+
+    def _poll_retries(self) -> None:
+        last_purge = time.time()
+        while not self._stopped.wait(self._RETRY_POLL_SECONDS):
+            try:
+                self._resubmit(self._job_store.claim_due())
+
+                if time.time() - last_purge > 3600:
+                    self._job_store.purge()
+                    last_purge = time.time()
+            except Exception:
+                logging.exception('Failed to poll the job store for retries.')
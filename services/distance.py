@@ -0,0 +1,109 @@
+import math
+import numpy
+from enum import Enum, auto
+
+class Distance_Mode(Enum):
+    """Haversine treats the earth as a sphere (fast, within about 0.5%). Ellipsoidal uses Vincenty's formula on WGS-84 (sub-millimeter)."""
+    Haversine = auto()
+    Ellipsoidal = auto()
+
+
+class Distance:
+    _FEET_PER_METER = 1 / 0.3048
+    _EARTH_RADIUS_METERS = 6371008.8
+    _WGS84_A = 6378137.0
+    _WGS84_F = 1 / 298.257223563
+    _WGS84_B = _WGS84_A * (1 - _WGS84_F)
+    _VINCENTY_MAX_ITERATIONS = 200
+    _VINCENTY_TOLERANCE = 1e-12
+
+    def get_feet(latitude_1: float, longitude_1: float, latitude_2: float, longitude_2: float, mode: Distance_Mode = Distance_Mode.Ellipsoidal) -> float:
+        """Distance in feet between two points given in decimal degrees.
+        Raises ValueError if a coordinate is not a finite number or a latitude is outside [-90, 90], as geopy did.
+        """
+
+        for (latitude, longitude) in ((latitude_1, longitude_1), (latitude_2, longitude_2)):
+            Distance._check_point(float(latitude), float(longitude))
+
+        return float(Distance.get_feet_batch([latitude_1], [longitude_1], [latitude_2], [longitude_2], mode)[0])
+
+    def get_feet_batch(latitudes_1, longitudes_1, latitudes_2, longitudes_2, mode: Distance_Mode = Distance_Mode.Ellipsoidal) -> numpy.ndarray:
+        """Pairwise distances in feet between two equally sized sequences of points, computed in one vectorized pass.
+        Any sequence may also be a single value, which is broadcast against the others.
+        Pairs with a coordinate that get_feet would reject come back as NaN, so callers must check for it.
+        """
+
+        latitudes_1 = numpy.asarray(latitudes_1, dtype=numpy.float64)
+        longitudes_1 = numpy.asarray(longitudes_1, dtype=numpy.float64)
+        latitudes_2 = numpy.asarray(latitudes_2, dtype=numpy.float64)
+        longitudes_2 = numpy.asarray(longitudes_2, dtype=numpy.float64)
+        with numpy.errstate(invalid='ignore'):
+            invalid = ~(Distance._get_valid(latitudes_1, longitudes_1) & Distance._get_valid(latitudes_2, longitudes_2))
+
+        (latitudes_1, longitudes_1, latitudes_2, longitudes_2) = (numpy.radians(latitudes_1), numpy.radians(longitudes_1), numpy.radians(latitudes_2), numpy.radians(longitudes_2))
+        if mode == Distance_Mode.Haversine:
+            meters = Distance._haversine_meters(latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+        else:
+            meters = Distance._vincenty_meters(latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+
+        return numpy.where(invalid, numpy.nan, meters * Distance._FEET_PER_METER)
+
+    def _check_point(latitude: float, longitude: float) -> None:
+        if not (math.isfinite(latitude) and math.isfinite(longitude)):
+            raise ValueError('Coordinates must be finite numbers, not ' + str(latitude) + ', ' + str(longitude))
+
+        if abs(latitude) > 90:
+            raise ValueError('Latitude must be in the [-90; 90] range, not ' + str(latitude))
+
+    def _get_valid(latitudes: numpy.ndarray, longitudes: numpy.ndarray) -> numpy.ndarray:
+        return numpy.isfinite(latitudes) & numpy.isfinite(longitudes) & (numpy.abs(latitudes) <= 90)
+
+    def _haversine_meters(latitudes_1, longitudes_1, latitudes_2, longitudes_2) -> numpy.ndarray:
+        a = numpy.sin((latitudes_2 - latitudes_1) / 2) ** 2 + numpy.cos(latitudes_1) * numpy.cos(latitudes_2) * numpy.sin((longitudes_2 - longitudes_1) / 2) ** 2
+        return 2 * Distance._EARTH_RADIUS_METERS * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0, 1)))
+
+    def _vincenty_meters(latitudes_1, longitudes_1, latitudes_2, longitudes_2) -> numpy.ndarray:
+        a = Distance._WGS84_A
+        b = Distance._WGS84_B
+        f = Distance._WGS84_F
+
+        (latitudes_1, longitudes_1, latitudes_2, longitudes_2) = numpy.broadcast_arrays(latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+        L = longitudes_2 - longitudes_1
+        U1 = numpy.arctan((1 - f) * numpy.tan(latitudes_1))
+        U2 = numpy.arctan((1 - f) * numpy.tan(latitudes_2))
+        sinU1 = numpy.sin(U1)
+        cosU1 = numpy.cos(U1)
+        sinU2 = numpy.sin(U2)
+        cosU2 = numpy.cos(U2)
+
+        lam = L.copy()
+        converged = numpy.zeros(L.shape, dtype=bool)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            for _ in range(Distance._VINCENTY_MAX_ITERATIONS):
+                sinLam = numpy.sin(lam)
+                cosLam = numpy.cos(lam)
+                sinSigma = numpy.sqrt((cosU2 * sinLam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cosLam) ** 2)
+                cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+                sigma = numpy.arctan2(sinSigma, cosSigma)
+                sinAlpha = numpy.where(sinSigma == 0, 0, cosU1 * cosU2 * sinLam / sinSigma)
+                cos2Alpha = 1 - sinAlpha ** 2
+                cos2SigmaM = numpy.where(cos2Alpha == 0, 0, cosSigma - 2 * sinU1 * sinU2 / cos2Alpha) # Equatorial lines have cos2Alpha == 0
+                C = f / 16 * cos2Alpha * (4 + f * (4 - 3 * cos2Alpha))
+                lamPrevious = lam
+                lam = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma * (cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2)))
+                converged = numpy.abs(lam - lamPrevious) <= Distance._VINCENTY_TOLERANCE
+                if converged.all():
+                    break
+
+            u2 = cos2Alpha * (a ** 2 - b ** 2) / b ** 2
+            A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+            B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+            deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma * (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM * (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+            meters = b * A * (sigma - deltaSigma)
+
+        # Vincenty does not converge for nearly antipodal points. Those are nowhere near a workout, so the sphere is close enough.
+        notConverged = ~converged | numpy.isnan(meters)
+        if notConverged.any():
+            meters = numpy.where(notConverged, Distance._haversine_meters(latitudes_1, longitudes_1, latitudes_2, longitudes_2), meters)
+
+        return meters
@@ -0,0 +1,166 @@
+import os
+import re
+import html
+from dataclasses import dataclass, asdict, field
+from services.gravity_forms import GravityForms
+
+@dataclass
+class ApprovedEmailContext:
+    entry_id: str
+    submission_type: str
+    region: str
+    workout_name: str
+    workout_stationary: str
+    address_accurate: str
+    street_1: str
+    street_2: str
+    city: str
+    state: str
+    zip_code: str
+    country: str
+    latitude: str
+    longitude: str
+    weekday: str
+    time: str
+    workout_type: str
+    website: str
+    logo: str
+    notes: str
+    submitter_name: str
+    submitter_email: str
+    date_created: str
+    date_updated: str
+    corrections_url: str
+    discrepancy_warning: str = field(default='') # Pre-rendered HTML from the DistanceWarning template
+
+    def from_entry(entry: dict, corrections_url: str) -> 'ApprovedEmailContext':
+        return ApprovedEmailContext(entry_id=entry['id'],
+                                    submission_type=GravityForms.is_new_or_update(entry),
+                                    region=entry['21'],
+                                    workout_name=entry['2'],
+                                    workout_stationary=entry['24'],
+                                    address_accurate=entry['23'],
+                                    street_1=entry['1.1'],
+                                    street_2=entry['1.2'],
+                                    city=entry['1.3'],
+                                    state=entry['1.4'],
+                                    zip_code=entry['1.5'],
+                                    country=entry['1.6'],
+                                    latitude=entry['13'],
+                                    longitude=entry['12'],
+                                    weekday=entry['14'],
+                                    time=entry['4'],
+                                    workout_type=entry['5'],
+                                    website=entry['17'],
+                                    logo=entry['16'],
+                                    notes=entry['15'],
+                                    submitter_name=entry['18'],
+                                    submitter_email=entry['19'],
+                                    date_created=GravityForms.convert_date_to_et(entry['date_created']),
+                                    date_updated=GravityForms.convert_date_to_et(entry['date_updated']),
+                                    corrections_url=corrections_url)
+
+
+@dataclass
+class DeletedEmailContext:
+    entry_id: str
+    region: str
+    workout_name: str
+    weekday: str
+    time: str
+    workout_type: str
+    reason: str
+    submitter_name: str
+    submitter_email: str
+    date_created: str
+    date_updated: str
+
+    def from_entries(entry: dict, deleteEntry: dict) -> 'DeletedEmailContext':
+        """entry is the workout being deleted, deleteEntry is the delete request."""
+
+        return DeletedEmailContext(entry_id=entry['id'],
+                                   region=deleteEntry['7'],
+                                   workout_name=deleteEntry['1'],
+                                   weekday=entry['14'],
+                                   time=entry['4'],
+                                   workout_type=entry['5'],
+                                   reason=deleteEntry['5'],
+                                   submitter_name=deleteEntry['4'],
+                                   submitter_email=deleteEntry['3'],
+                                   date_created=GravityForms.convert_date_to_et(deleteEntry['date_created']),
+                                   date_updated=GravityForms.convert_date_to_et(deleteEntry['date_updated']))
+
+
+@dataclass
+class DeleteRejectedEmailContext:
+    region: str
+    workout_name: str
+    reason: str
+    submitter_name: str
+    submitter_email: str
+    date_created: str
+    date_updated: str
+
+    def from_entry(deleteEntry: dict) -> 'DeleteRejectedEmailContext':
+        return DeleteRejectedEmailContext(region=deleteEntry['7'],
+                                          workout_name=deleteEntry['1'],
+                                          reason=deleteEntry['5'],
+                                          submitter_name=deleteEntry['4'],
+                                          submitter_email=deleteEntry['3'],
+                                          date_created=GravityForms.convert_date_to_et(deleteEntry['date_created']),
+                                          date_updated=GravityForms.convert_date_to_et(deleteEntry['date_updated']))
+
+
+class _Compiled_Template:
+    """A template split once into literal text and placeholders. {{name}} is HTML escaped, {{{name}}} is inserted as is."""
+    _PLACEHOLDER = re.compile(r'\{\{\{\s*(\w+)\s*\}\}\}|\{\{\s*(\w+)\s*\}\}')
+
+    def __init__(self, source: str) -> None:
+        parts = []
+        position = 0
+        for match in self._PLACEHOLDER.finditer(source):
+            parts.append((source[position:match.start()], None, False))
+            if match.group(1) is not None:
+                parts.append(('', match.group(1), True))
+            else:
+                parts.append(('', match.group(2), False))
+            position = match.end()
+        parts.append((source[position:], None, False))
+
+        # Literal runs are joined ahead of time, so rendering is one join over the changing values.
+        self._literals = [literal for (literal, name, raw) in parts if name is None]
+        self._names = [(name, raw) for (literal, name, raw) in parts if name is not None]
+
+    def render(self, values: dict) -> str:
+        pieces = [self._literals[0]]
+        for index in range(len(self._names)):
+            (name, raw) = self._names[index]
+            value = '' if values[name] is None else str(values[name])
+            pieces.append(value if raw else html.escape(value))
+            pieces.append(self._literals[index + 1])
+
+        return ''.join(pieces)
+
+
+class EmailTemplates:
+    """Loads and compiles the email templates in static/ once, when created."""
+    _DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+    _NAMES = ['ApprovedEmail', 'DistanceWarning', 'DeletedEmail', 'DeleteRejectedEmail']
+
+    def __init__(self, directory: str|None = None) -> None:
+        self._templates = {}
+        for name in self._NAMES:
+            with open(os.path.join(directory or self._DIRECTORY, name + '.html'), encoding='utf-8') as file:
+                self._templates[name] = _Compiled_Template(file.read())
+
+    def render_approved(self, context: ApprovedEmailContext) -> str:
+        return self._templates['ApprovedEmail'].render(asdict(context))
+
+    def render_distance_warning(self, feet: int) -> str:
+        return self._templates['DistanceWarning'].render({'feet': '{0:,.0f}'.format(feet)})
+
+    def render_deleted(self, context: DeletedEmailContext) -> str:
+        return self._templates['DeletedEmail'].render(asdict(context))
+
+    def render_delete_rejected(self, context: DeleteRejectedEmailContext) -> str:
+        return self._templates['DeleteRejectedEmail'].render(asdict(context))
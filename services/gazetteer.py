@@ -0,0 +1,123 @@
+import os
+import json
+import math
+
+class Gazetteer:
+    """Offline location checks against static/gazetteer.json: bounding boxes for countries and US states, and the state
+    of each 3-digit ZIP prefix. Boxes are padded by GAZETTEER_PADDING_DEGREES so points near a border are not flagged.
+    Being boxes, they can only say a point is definitely outside a country or state, never that it is inside one.
+    """
+    _PATH = os.getenv('GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'gazetteer.json'))
+    _PADDING_DEGREES = float(os.getenv('GAZETTEER_PADDING_DEGREES', '0.1'))
+    _UNITED_STATES = 'United States'
+
+    def __init__(self, path: str|None = None) -> None:
+        with open(path or self._PATH, encoding='utf-8') as file:
+            data = json.load(file)
+
+        self._countries = [(country['name'], Gazetteer._pad(country['boxes'])) for country in data['countries']]
+        self._states = [(state['code'], Gazetteer._pad(state['boxes'])) for state in data['states']]
+        self._country_names = {}
+        for country in data['countries']:
+            for name in [country['name']] + country['aliases']:
+                self._country_names[name.lower()] = country['name']
+        self._state_codes = {}
+        for state in data['states']:
+            self._state_codes[state['code'].lower()] = state['code']
+            self._state_codes[state['name'].lower()] = state['code']
+        self._zip_states = {}
+        for (first, last, states) in data['zip3']:
+            for prefix in range(int(first), int(last) + 1):
+                self._zip_states[format(prefix, '03d')] = [states] if isinstance(states, str) else states
+
+    def _pad(boxes: list) -> list:
+        padding = Gazetteer._PADDING_DEGREES
+        return [(south - padding, north + padding, west - padding, east + padding) for (south, north, west, east) in boxes]
+
+    def _contains(boxes: list, latitude: float, longitude: float) -> bool:
+        for (south, north, west, east) in boxes:
+            if south <= latitude <= north and west <= longitude <= east:
+                return True
+        return False
+
+    def parse_latlong(latitude, longitude) -> tuple|None:
+        """(latitude, longitude) as floats, or None if they are not numbers, are out of range, or are 0,0 (an empty pin)."""
+
+        try:
+            point = (float(latitude), float(longitude))
+        except (TypeError, ValueError):
+            return None
+
+        if not all(math.isfinite(value) for value in point) or abs(point[0]) > 90 or abs(point[1]) > 180 or point == (0.0, 0.0):
+            return None
+
+        return point
+
+    def get_country_name(self, country: str) -> str|None:
+        """The gazetteer's name for a submitted country, or None if it has no boxes for it."""
+
+        return self._country_names.get(str(country).strip().lower())
+
+    def get_state_code(self, state: str) -> str|None:
+        """The two letter code for a submitted US state name or code, or None if it is not one."""
+
+        return self._state_codes.get(str(state).strip().lower())
+
+    def get_zip_states(self, zip_code: str) -> list:
+        """The states and territories that use the ZIP code's 3-digit prefix. Some prefixes are shared, e.g. 969 by GU and MP."""
+
+        zip_code = str(zip_code).strip()
+        if len(zip_code) < 5 or not zip_code[:5].isdigit():
+            return []
+
+        return self._zip_states.get(zip_code[:3], [])
+
+    def get_countries(self, latitude: float, longitude: float) -> list:
+        return [name for (name, boxes) in self._countries if Gazetteer._contains(boxes, latitude, longitude)]
+
+    def get_states(self, latitude: float, longitude: float) -> list:
+        return [code for (code, boxes) in self._states if Gazetteer._contains(boxes, latitude, longitude)]
+
+    def check(self, latitude: str, longitude: str, country: str, state: str, zip_code: str) -> tuple:
+        """Checks a submission's pin against its country, state and ZIP. Returns (problem, warnings).
+        problem is a message when the pin can not be right (not a valid lat/long, or outside the submitted country),
+        in which case reverse geocoding it is not worth a Maps call. Otherwise it is None, and warnings lists any
+        disagreement between the pin, the state and the ZIP code for US submissions.
+        """
+
+        point = Gazetteer.parse_latlong(latitude, longitude)
+        if point is None:
+            return ('Invalid lat/long', [])
+
+        countryName = self.get_country_name(country)
+        if countryName is None:
+            return (None, [])
+
+        countries = self.get_countries(*point)
+        if countryName not in countries:
+            problem = 'Not looked up, pin is outside ' + countryName
+            if len(countries) > 0:
+                problem = problem + ' (in ' + ' or '.join(countries) + ')'
+            for (hint, candidate) in (('Longitude may be missing a minus sign', (point[0], -point[1])),
+                                      ('Latitude may be missing a minus sign', (-point[0], point[1])),
+                                      ('Latitude and longitude may be swapped', (point[1], point[0]))):
+                if abs(candidate[0]) <= 90 and countryName in self.get_countries(*candidate):
+                    problem = problem + '. ' + hint
+                    break
+            return (problem, [])
+
+        if countryName != self._UNITED_STATES:
+            return (None, [])
+
+        warnings = []
+        stateCode = self.get_state_code(state)
+        if stateCode is not None:
+            states = self.get_states(*point)
+            if stateCode not in states:
+                warnings.append('Pin is not in ' + stateCode + (' (looks like ' + ' or '.join(states) + ')' if len(states) > 0 else ''))
+
+            zipStates = self.get_zip_states(zip_code)
+            if len(zipStates) > 0 and stateCode not in zipStates:
+                warnings.append('ZIP ' + str(zip_code).strip() + ' is in ' + ' or '.join(zipStates) + ', not ' + stateCode)
+
+        return (None, warnings)
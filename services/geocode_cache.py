@@ -0,0 +1,77 @@
+import os
+import logging
+import sqlite3
+import threading
+import json
+import re
+import time
+from services.cache import TTLCache, MISSING
+
+class GeocodeCache:
+    """Two tier cache for geocoding results: an in-memory LRU in front of an optional SQLite file.
+    The SQLite tier is only used when GEOCODE_CACHE_PATH is set.
+    """
+    _PATH = os.getenv('GEOCODE_CACHE_PATH')
+    _MAX_SIZE = int(os.getenv('GEOCODE_CACHE_MAX_SIZE', '5000'))
+    _TTL_SECONDS = float(os.getenv('GEOCODE_CACHE_TTL_SECONDS', '604800'))
+    _LATLONG_PRECISION = 5 # About a meter, well under any distance we alert on
+
+    def __init__(self, path: str|None = None) -> None:
+        self._memory = TTLCache(max_size=self._MAX_SIZE, ttl_seconds=self._TTL_SECONDS)
+        self._lock = threading.Lock()
+        self._connection = None
+        self.disk_hits = 0
+        self.misses = 0
+
+        path = path or self._PATH
+        if path:
+            try:
+                self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                self._connection.execute('CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+            except sqlite3.Error as error:
+                logging.warning('Could not open geocode cache at ' + path + ', using memory only. Error: ' + str(error))
+                self._connection = None
+
+    def get_address_key(address: str) -> str:
+        return 'address:' + re.sub(r'\s+', ' ', address).strip().lower()
+
+    def get_latlong_key(latitude: str, longitude: str) -> str|None:
+        """Returns None if the lat/long can not be parsed, in which case the result should not be cached."""
+
+        try:
+            return 'latlong:' + format(round(float(latitude), GeocodeCache._LATLONG_PRECISION), '.5f') + ',' + format(round(float(longitude), GeocodeCache._LATLONG_PRECISION), '.5f')
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key: str):
+        """Returns the cached value or MISSING."""
+
+        value = self._memory.get(key, MISSING)
+        if value is not MISSING or self._connection is None:
+            if value is MISSING:
+                self.misses += 1
+            return value
+
+        with self._lock:
+            row = self._connection.execute('SELECT value, expires_at FROM geocode WHERE key = ?', (key,)).fetchone()
+
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return MISSING
+
+        value = json.loads(row[0])
+        self._memory.set(key, value, ttl_seconds=row[1] - time.time())
+        self.disk_hits += 1
+        return value
+
+    def set(self, key: str, value) -> None:
+        self._memory.set(key, value)
+
+        if self._connection is not None:
+            with self._lock:
+                self._connection.execute('INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)', (key, json.dumps(value), time.time() + self._TTL_SECONDS))
+
+    def get_stats(self) -> dict:
+        memory = self._memory.get_stats()
+        return {'memory_hits': memory['hits'], 'disk_hits': self.disk_hits, 'misses': self.misses, 'size': memory['size']}
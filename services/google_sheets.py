@@ -1,16 +1,20 @@
 import os
-import requests
 import logging
+from services.http import HttpSession
 
 class GoogleSheets:
     WORKOUT_HISTORY_SPREADSHEETURL = os.getenv('WORKOUT_HISTORY_SPREADSHEETURL')
 
+    def __init__(self) -> None:
+        self._http = HttpSession.get_shared()
+
     def get_single_entity(self, entryId: str) -> dict:
         param = {"dataset":"workouts","entryid": entryId}
-        response = requests.get(self.WORKOUT_HISTORY_SPREADSHEETURL, params=param)
+        response = self._http.get(self.WORKOUT_HISTORY_SPREADSHEETURL, params=param, metric=('google_sheets', 'get_single_entity'))
         response.encoding = 'utf-8-sig'
-        body = response.json()
+        return GoogleSheets._parse_single_entity(response.json(), entryId)
 
+    def _parse_single_entity(body: dict, entryId: str) -> dict:
         if body["Status"] != 200:
             logging.error("Failed to successfully pull historical workout data from Google Sheets using Entry ID '" + entryId + "'. Error: " + body["Message"])
             return {}
@@ -22,3 +26,18 @@ class GoogleSheets:
             entity[data[0][field]] = data[1][field]
 
         return entity
+
+    def get_dataset(self, dataset: str) -> list:
+        """Pulls every row of a dataset in one request. The first row is the header. Returns an empty list on failure."""
+
+        param = {"dataset": dataset}
+        response = self._http.get(self.WORKOUT_HISTORY_SPREADSHEETURL, params=param, metric=('google_sheets', 'get_dataset'))
+        response.encoding = 'utf-8-sig'
+        return GoogleSheets._parse_dataset(response.json(), dataset)
+
+    def _parse_dataset(body: dict, dataset: str) -> list:
+        if body["Status"] != 200:
+            logging.error("Failed to successfully pull the '" + dataset + "' dataset from Google Sheets. Error: " + body["Message"])
+            return []
+
+        return body["Data"]
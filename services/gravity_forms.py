@@ -1,8 +1,13 @@
 import os
 import logging
-import requests
 import datetime
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 import pytz
+from services.http import HttpSession
+from services.cache import TTLCache
+from services.job_store import JobStore
 
 class GravityForms:
     BASE_URL = os.getenv('GRAVITY_FORMS_BASE_URL')
@@ -12,18 +17,70 @@ class GravityForms:
     KEY = os.getenv('GRAVITY_FORM_KEY')
     SECRET = os.getenv('GRAVITY_FORM_SECRET')
     headers = {"User-Agent":"MapApprovals"}
+    _ENTRY_CACHE_SIZE = int(os.getenv('GRAVITY_FORMS_ENTRY_CACHE_SIZE', '1000'))
+    _ENTRY_CACHE_TTL_SECONDS = float(os.getenv('GRAVITY_FORMS_ENTRY_CACHE_TTL_SECONDS', '300'))
+    _SEED_REQUIRED_KEYS = ('id', 'form_id', 'date_updated', 'status')
+    _COUNT_CACHE_TTL_SECONDS = float(os.getenv('GRAVITY_FORMS_COUNT_CACHE_TTL_SECONDS', '30'))
+
+    def __init__(self) -> None:
+        self._http = HttpSession.get_shared()
+        self._entry_cache = TTLCache(max_size=self._ENTRY_CACHE_SIZE, ttl_seconds=self._ENTRY_CACHE_TTL_SECONDS)
+        self._count_cache = TTLCache(max_size=100, ttl_seconds=self._COUNT_CACHE_TTL_SECONDS)
+        self._count_requests = {}
+        self._count_lock = threading.Lock()
+        self._count_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='gravity-forms-count')
     
     def get_unapproved_count(self, formId: str) -> int:
         param = {"search": '{"field_filters": [{"key":"is_approved","value":3,"operator":"="}]}'}
-        response = requests.get(self.BASE_URL + '/wp-json/gf/v2/forms/' + formId + '/entries', params=param, auth=(self.KEY, self.SECRET), headers=self.headers)
+        response = self._http.get(self.BASE_URL + '/wp-json/gf/v2/forms/' + formId + '/entries', params=param, auth=(self.KEY, self.SECRET), headers=self.headers, metric=('gravity_forms', 'get_unapproved_count'))
         response.encoding = 'utf-8-sig'
         body = response.json()
 
         return int(body['total_count'])
+
+    def get_unapproved_counts(self, formIds: list) -> dict:
+        """Returns the unapproved count for each form ID, querying the forms at the same time.
+        Counts are cached for GRAVITY_FORMS_COUNT_CACHE_TTL_SECONDS, and callers asking for a form that is
+        already being counted share that request, so overlapping cron and manual checks cost one search.
+        """
+
+        futures = {formId: self._get_unapproved_count_future(formId) for formId in formIds}
+        return {formId: future.result() for (formId, future) in futures.items()}
+
+    def _get_unapproved_count_future(self, formId: str) -> Future:
+        with self._count_lock:
+            cached = self._count_cache.get(formId)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                return future
+
+            if formId not in self._count_requests:
+                self._count_requests[formId] = self._count_executor.submit(self._fetch_unapproved_count, formId)
+
+            return self._count_requests[formId]
+
+    def _fetch_unapproved_count(self, formId: str) -> int:
+        try:
+            count = self.get_unapproved_count(formId)
+            self._count_cache.set(formId, count)
+            return count
+        finally:
+            with self._count_lock:
+                self._count_requests.pop(formId, None)
     
 
-    def get_entry(self, entryId: str, print_response: bool = False) -> dict:
-        response = requests.get(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, auth=(self.KEY, self.SECRET), headers=self.headers)
+    def get_entry(self, entryId: str, print_response: bool = False, use_cache: bool = True) -> dict:
+        """Returns the entry from the entry cache when it holds a copy, otherwise from Gravity Forms.
+        Pass use_cache=False to always get the latest version, e.g. before writing the whole entry back with update_entry.
+        """
+
+        if use_cache:
+            cached = self._get_cached_entry(entryId)
+            if cached is not None:
+                return cached
+
+        response = self._http.get(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, auth=(self.KEY, self.SECRET), headers=self.headers, metric=('gravity_forms', 'get_entry'))
         response.encoding = 'utf-8-sig'
 
         if print_response:
@@ -31,23 +88,87 @@ class GravityForms:
         
         entry = response.json()
 
+        if response.status_code == 200:
+            self._cache_entry(entry)
+
         return entry
 
+    def seed_entry(self, entry: dict) -> bool:
+        """Caches an entry received from a Gravity Forms webhook so the Slack actions that follow do not need to fetch it.
+        Ignored if it is missing entry properties or is older (by date_updated) than the cached copy. Returns True if cached.
+        """
+
+        for key in self._SEED_REQUIRED_KEYS:
+            if key not in entry:
+                return False
+
+        return self._cache_entry(entry)
+
 
     def update_entry(self, entryId: str, entry: dict) -> bool:
         """Updates indicated entry with the json provided. Will return True if response from Gravity Forms is 200."""
 
-        response = requests.put(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, json=entry, auth=(self.KEY, self.SECRET), headers=self.headers)
+        response = self._http.put(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, json=entry, auth=(self.KEY, self.SECRET), headers=self.headers, metric=('gravity_forms', 'update_entry'))
 
-        return response.status_code == 200
+        if response.status_code != 200:
+            self._entry_cache.delete(entryId)
+            return False
+
+        try:
+            updated = response.json()
+        except ValueError:
+            updated = None
+
+        self._record_update(entryId, entry, updated)
+        return True
 
 
     def trash_entry(self, entryId: str) -> bool:
         """Moves indicated entry to the trash. Will return True if response from Gravity Forms is 200."""
 
-        response = requests.delete(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, auth=(self.KEY, self.SECRET), headers=self.headers)
+        response = self._http.delete(self.BASE_URL + '/wp-json/gf/v2/entries/' + entryId, auth=(self.KEY, self.SECRET), headers=self.headers, metric=('gravity_forms', 'trash_entry'))
+
+        if response.status_code != 200:
+            return False
+
+        self._record_trash(entryId)
+        return True
+
+    # The cache bookkeeping below is shared with AsyncGravityForms, which makes the same calls without blocking.
+
+    def _get_cached_entry(self, entryId: str) -> dict|None:
+        cached = self._entry_cache.get(entryId)
+        return None if cached is None else copy.deepcopy(cached)
+
+    def _record_update(self, entryId: str, entry: dict, updated) -> None:
+        JobStore.record_write('updated entry ' + entryId)
+
+        # Gravity Forms responds with the updated entry, which includes the new date_updated.
+        if isinstance(updated, dict) and str(updated.get('id')) == str(entryId):
+            self._entry_cache.set(entryId, updated)
+        else:
+            self._entry_cache.set(entryId, copy.deepcopy(entry))
+
+    def _record_trash(self, entryId: str) -> None:
+        JobStore.record_write('trashed entry ' + entryId)
+
+        cached = self._entry_cache.get(entryId)
+        if cached is not None:
+            cached = copy.deepcopy(cached)
+            cached['status'] = 'trash'
+            self._entry_cache.set(entryId, cached)
+
+    def _cache_entry(self, entry: dict) -> bool:
+        if 'id' not in entry:
+            return False
+
+        entryId = str(entry['id'])
+        cached = self._entry_cache.get(entryId)
+        if cached is not None and cached.get('date_updated', '') > entry.get('date_updated', ''):
+            return False
 
-        return response.status_code == 200
+        self._entry_cache.set(entryId, copy.deepcopy(entry))
+        return True
     
     def is_new_or_update(entry: dict) -> str:
         """Takes a Gravity Form entry and returns a string indicating if the submission is 'New' or 'Updated'."""
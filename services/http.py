@@ -0,0 +1,97 @@
+import os
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from services.metrics import Metrics
+from services.tracing import Tracing
+
+class HttpSession:
+    """Shared requests.Session with keep-alive connection pools, a default timeout and retry/backoff
+    for transient failures. Records call counts and latency per host.
+    """
+    # Default pool size covers every dispatcher worker and lookup thread calling the same host at once.
+    _POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', str(int(os.getenv('DISPATCHER_WORKERS', '8')) + int(os.getenv('LOOKUP_WORKERS', '8')))))
+    _TIMEOUT_SECONDS = float(os.getenv('HTTP_TIMEOUT_SECONDS', '15'))
+    _RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+    _RETRY_BACKOFF_SECONDS = float(os.getenv('HTTP_RETRY_BACKOFF_SECONDS', '0.5'))
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, pool_size: int|None = None, timeout_seconds: float|None = None) -> None:
+        self._timeout_seconds = timeout_seconds or self._TIMEOUT_SECONDS
+        retry = Retry(total=self._RETRIES,
+                      backoff_factor=self._RETRY_BACKOFF_SECONDS,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'PUT', 'DELETE']),
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size or self._POOL_SIZE, max_retries=retry)
+
+        self._session = requests.Session()
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get_shared() -> 'HttpSession':
+        """The process wide session that all services share, so they share its connection pools."""
+
+        with HttpSession._shared_lock:
+            if HttpSession._shared is None:
+                HttpSession._shared = HttpSession()
+            return HttpSession._shared
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method: str, url: str, metric: tuple|None = None, **kwargs) -> requests.Response:
+        """metric is an optional (component, operation) pair the call is recorded under in Metrics, e.g. ('gravity_forms', 'get_entry')."""
+
+        kwargs.setdefault('timeout', self._timeout_seconds)
+        host = urlsplit(url).netloc
+
+        start = time.perf_counter()
+        try:
+            response = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(host, time.perf_counter() - start, True, metric)
+            raise
+
+        self._record(host, time.perf_counter() - start, response.status_code >= 400, metric)
+        return response
+
+    def get_stats(self) -> dict:
+        """Call count, error count, and average and max latency in milliseconds, by host."""
+
+        with self._stats_lock:
+            return {host: {'count': stat['count'],
+                           'errors': stat['errors'],
+                           'avg_ms': round(stat['total_seconds'] / stat['count'] * 1000, 1),
+                           'max_ms': round(stat['max_seconds'] * 1000, 1)}
+                    for (host, stat) in self._stats.items()}
+
+    def _record(self, host: str, seconds: float, error: bool, metric: tuple|None) -> None:
+        if metric is not None:
+            Metrics.get_shared().observe(metric[0], metric[1], seconds, error)
+            Tracing.record(metric[0] + '.' + metric[1], seconds, error)
+
+        with self._stats_lock:
+            stat = self._stats.setdefault(host, {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            stat['count'] += 1
+            stat['total_seconds'] += seconds
+            stat['max_seconds'] = max(stat['max_seconds'], seconds)
+            if error:
+                stat['errors'] += 1
+
+        if seconds > self._timeout_seconds / 2:
+            logging.warning('Slow call to ' + host + ': ' + str(round(seconds * 1000)) + ' ms.')
@@ -0,0 +1,228 @@
+import os
+import sqlite3
+import threading
+import json
+import time
+import contextvars
+from contextlib import contextmanager
+from enum import Enum
+
+class Job_State(Enum):
+    Queued = 'queued'
+    Running = 'running'
+    Retry = 'retry'
+    Done = 'done'
+    Failed = 'failed'
+
+
+class JobStore:
+    """SQLite (WAL) log of accepted webhook jobs. A job is written before the webhook is acknowledged
+    and stays unfinished until its handler returns, so work interrupted by a crash or restart is replayed.
+    The default JOB_STORE_PATH is under /tmp, which on Cloud Run is in memory and goes with the instance. For jobs to
+    survive an instance being recycled, set JOB_STORE_PATH to a file on a persistent volume mount.
+    Handlers are not idempotent, so a failed job is only retried if it made no external writes (see record_write).
+    Writes are saved on the job as they happen, so a job interrupted after one is not replayed either.
+    """
+    _PATH = os.getenv('JOB_STORE_PATH', '/tmp/map_approvals_jobs.sqlite')
+    _MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+    _RETRY_BACKOFF_SECONDS = float(os.getenv('JOB_RETRY_BACKOFF_SECONDS', '10'))
+    _RETRY_BACKOFF_MAX_SECONDS = float(os.getenv('JOB_RETRY_BACKOFF_MAX_SECONDS', '600'))
+    _RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', '86400'))
+    _writes = contextvars.ContextVar('job_writes', default=None)
+
+    def __init__(self, path: str|None = None) -> None:
+        self._lock = threading.Lock()
+        self.debounced = 0 # Jobs add_debounced held or coalesced
+        self._connection = sqlite3.connect(path or self._PATH, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            last_error TEXT,
+            coalesce_key TEXT,
+            writes TEXT
+        )''')
+        # Job stores created before coalescing and write tracking were added
+        columns = [column[1] for column in self._connection.execute('PRAGMA table_info(jobs)')]
+        for column in ('coalesce_key', 'writes'):
+            if column not in columns:
+                self._connection.execute('ALTER TABLE jobs ADD COLUMN ' + column + ' TEXT')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_attempt_at)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_coalesce_key ON jobs (coalesce_key, created_at)')
+
+    @contextmanager
+    def track_writes(job_store: 'JobStore|None' = None, jobId: int|None = None):
+        """Collects the external writes recorded while the block runs a job. Yields the list they are added to.
+        Given the job's store and ID, each write is also saved on the job row as it happens.
+        """
+
+        writes = []
+        token = JobStore._writes.set((writes, job_store, jobId))
+        try:
+            yield writes
+        finally:
+            JobStore._writes.reset(token)
+
+    def record_write(description: str) -> None:
+        """Notes that the current job changed something outside this process, e.g. posted to Slack or updated an entry.
+        Running the job again would repeat the change, so a job that fails or is interrupted after a write is not run again.
+        Saving the write is a SQLite write, so coroutines call this through asyncio.to_thread.
+        """
+
+        current = JobStore._writes.get()
+        if current is None:
+            return
+
+        (writes, job_store, jobId) = current
+        writes.append(description)
+        if job_store is not None and jobId is not None:
+            with job_store._lock:
+                job_store._connection.execute("UPDATE jobs SET writes = COALESCE(writes || char(10), '') || ?, updated_at = ? WHERE id = ?", (description, time.time(), jobId))
+
+    def add(self, job_type: str, kwargs: dict, delay_seconds: float|None = None) -> int:
+        """Records a newly accepted job in the queued state and returns its ID.
+        With delay_seconds, it is recorded in the retry state instead, for claim_due to return once the delay has passed.
+        """
+
+        now = time.time()
+        state = Job_State.Queued if delay_seconds is None else Job_State.Retry
+        with self._lock:
+            cursor = self._connection.execute('INSERT INTO jobs (job_type, payload, state, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                                              (job_type, json.dumps(kwargs), state.value, now + (delay_seconds or 0), now, now))
+        return cursor.lastrowid
+
+    def add_debounced(self, job_type: str, kwargs: dict, coalesce_key: str, debounce_seconds: float, max_delay_seconds: float) -> tuple:
+        """Records a job that should not start within debounce_seconds of an earlier job with the same coalesce_key.
+        Returns (job ID, run now). With no such job added in the window, the job is queued like add and run now is True.
+        Otherwise it is held in the retry state until the window has passed, for the dispatcher's poll to pick up.
+        A newer job supersedes one still held for the same key: the held job takes its kwargs and its start is pushed
+        back, but never later than max_delay_seconds after it was first held, so a steady stream still gets processed.
+        """
+
+        now = time.time()
+        with self._lock:
+            held = self._connection.execute('SELECT id, created_at FROM jobs WHERE coalesce_key = ? AND job_type = ? AND state = ? AND attempts = 0 ORDER BY id DESC LIMIT 1',
+                                            (coalesce_key, job_type, Job_State.Retry.value)).fetchone()
+            if held is not None:
+                (jobId, created_at) = held
+                self._connection.execute('UPDATE jobs SET payload = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?',
+                                         (json.dumps(kwargs), min(now + debounce_seconds, created_at + max_delay_seconds), now, jobId))
+                self.debounced += 1
+                return (jobId, False)
+
+            recent = self._connection.execute('SELECT 1 FROM jobs WHERE coalesce_key = ? AND job_type = ? AND created_at > ? LIMIT 1',
+                                              (coalesce_key, job_type, now - debounce_seconds)).fetchone()
+            state = Job_State.Queued if recent is None else Job_State.Retry
+            if recent is not None:
+                self.debounced += 1
+            cursor = self._connection.execute('INSERT INTO jobs (job_type, payload, state, next_attempt_at, created_at, updated_at, coalesce_key) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                              (job_type, json.dumps(kwargs), state.value, now if recent is None else now + debounce_seconds, now, now, coalesce_key))
+
+        return (cursor.lastrowid, recent is None)
+
+    def mark_running(self, jobId: int) -> None:
+        self._set_state(jobId, Job_State.Running, attempted=True)
+
+    def mark_done(self, jobId: int) -> None:
+        self._set_state(jobId, Job_State.Done)
+
+    def defer(self, jobId: int, seconds: float) -> None:
+        """Puts a job back into the retry state without counting an attempt, e.g. when the dispatcher queue is full."""
+
+        now = time.time()
+        with self._lock:
+            self._connection.execute('UPDATE jobs SET state = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?', (Job_State.Retry.value, now + seconds, now, jobId))
+
+    def mark_failed(self, jobId: int, error: str, retry: bool = True) -> bool:
+        """Schedules the job to be retried with exponential backoff. Returns False if retry is False or it has used all of its attempts and was given up on."""
+
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT attempts FROM jobs WHERE id = ?', (jobId,)).fetchone()
+            if row is None:
+                return False
+
+            attempts = row[0]
+            if not retry or attempts >= self._MAX_ATTEMPTS:
+                self._connection.execute('UPDATE jobs SET state = ?, updated_at = ?, last_error = ? WHERE id = ?', (Job_State.Failed.value, now, error, jobId))
+                return False
+
+            delay = min(self._RETRY_BACKOFF_SECONDS * (2 ** (attempts - 1)), self._RETRY_BACKOFF_MAX_SECONDS)
+            self._connection.execute('UPDATE jobs SET state = ?, next_attempt_at = ?, updated_at = ?, last_error = ? WHERE id = ?', (Job_State.Retry.value, now + delay, now, error, jobId))
+            return True
+
+    def claim_due(self, limit: int = 50) -> list:
+        """Moves retry jobs whose backoff has elapsed back to queued and returns them as (id, job_type, kwargs) tuples."""
+
+        with self._lock, self._immediate():
+            rows = self._connection.execute('SELECT id, job_type, payload FROM jobs WHERE state = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?',
+                                            (Job_State.Retry.value, time.time(), limit)).fetchall()
+            self._claim(rows)
+
+        return [(jobId, job_type, json.loads(payload)) for (jobId, job_type, payload) in rows]
+
+    def claim_unfinished(self) -> tuple:
+        """Claims the jobs that were queued or running when the previous process stopped. Returns (jobs, abandoned).
+        jobs are (id, job_type, kwargs) tuples to replay. abandoned are (id, job_type, writes) for jobs that were
+        interrupted after an external write. Those are marked failed instead, for someone to check by hand.
+        """
+
+        now = time.time()
+        with self._lock, self._immediate():
+            rows = self._connection.execute('SELECT id, job_type, payload, writes FROM jobs WHERE state IN (?, ?) ORDER BY id',
+                                            (Job_State.Queued.value, Job_State.Running.value)).fetchall()
+            abandoned = [(jobId, job_type, writes.split('\n')) for (jobId, job_type, _, writes) in rows if writes]
+            self._connection.executemany('UPDATE jobs SET state = ?, updated_at = ?, last_error = ? WHERE id = ?',
+                                         [(Job_State.Failed.value, now, 'Interrupted after external writes', jobId) for (jobId, _, _) in abandoned])
+            rows = [row for row in rows if not row[3]]
+            self._claim(rows)
+
+        return ([(jobId, job_type, json.loads(payload)) for (jobId, job_type, payload, _) in rows], abandoned)
+
+    def get_counts(self) -> dict:
+        """Number of jobs in each state."""
+
+        with self._lock:
+            rows = self._connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+
+        return {state: count for (state, count) in rows}
+
+    def purge(self) -> int:
+        """Deletes finished jobs older than the retention period. Returns the number removed."""
+
+        with self._lock:
+            cursor = self._connection.execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?',
+                                              (Job_State.Done.value, Job_State.Failed.value, time.time() - self._RETENTION_SECONDS))
+        return cursor.rowcount
+
+    @contextmanager
+    def _immediate(self):
+        """Runs the block in a transaction that takes SQLite's write lock up front, so processes sharing the file
+        can not both select the same rows before either marks them claimed.
+        """
+
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _claim(self, rows: list) -> None:
+        now = time.time()
+        self._connection.executemany('UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?', [(Job_State.Queued.value, now, row[0]) for row in rows])
+
+    def _set_state(self, jobId: int, state: Job_State, attempted: bool = False) -> None:
+        with self._lock:
+            if attempted:
+                self._connection.execute('UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?', (state.value, time.time(), jobId))
+            else:
+                self._connection.execute('UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?', (state.value, time.time(), jobId))
@@ -1,35 +1,83 @@
 import os
-import googlemaps
-import geopy.distance
+import math
+import threading
+from services.distance import Distance
+from services.geocode_cache import GeocodeCache
+from services.gazetteer import Gazetteer
+from services.cache import MISSING
+from services.metrics import Metrics
 
 class Map:
     _KEY = os.getenv('GOOGLE_MAP_KEY')
-    _client = googlemaps.Client(key=_KEY)
+    _BASE_URL = os.getenv('GOOGLE_MAPS_BASE_URL', 'https://maps.googleapis.com')
+    _client = None
+    _client_lock = threading.Lock()
+    _cache = GeocodeCache()
+
+    def _get_client():
+        """The googlemaps client, created on first use so that importing googlemaps does not slow down startup."""
+
+        with Map._client_lock:
+            if Map._client is None:
+                import googlemaps
+                Map._client = googlemaps.Client(key=Map._KEY, base_url=Map._BASE_URL)
+            return Map._client
 
     def get_address_from_latlong(self, latitude: str, longitude: str) -> str:
         """Takes lat and long and returns an address.
         Will return error strings if lat/long is invalid or does not produce an address.
         """
 
+        if Gazetteer.parse_latlong(latitude, longitude) is None:
+            return 'Invalid lat/long'
+
+        key = GeocodeCache.get_latlong_key(latitude, longitude)
+        if key is not None:
+            cached = self._cache.get(key)
+            if cached is not MISSING:
+                return cached
+
         try:
-            addresses = self._client.reverse_geocode(latitude + ',' + longitude)
+            with Metrics.get_shared().timed('google_maps', 'reverse_geocode'):
+                addresses = Map._get_client().reverse_geocode(latitude + ',' + longitude)
         except:
             return 'Invalid lat/long'
 
+        result = Map._parse_reverse_geocode(addresses)
+        if key is not None:
+            self._cache.set(key, result)
+
+        return result
+    
+    def get_latlong_from_address(self, address) -> tuple[str, str]:
+        """Takes an address string and returns a str tuple of latitude and longitude."""
+
+        key = GeocodeCache.get_address_key(address)
+        cached = self._cache.get(key)
+        if cached is not MISSING:
+            return tuple(cached)
+
+        with Metrics.get_shared().timed('google_maps', 'geocode'):
+            response = Map._get_client().geocode(address)
+
+        result = Map._parse_geocode(response)
+        self._cache.set(key, result)
+        return result
+
+    # The parsing below is shared with AsyncMap, which calls the same Geocoding API without blocking.
+
+    def _parse_reverse_geocode(addresses: list) -> str:
         address = addresses[0]
         if address['types'][0] == 'plus_code':
             return 'No address found'
 
         return address['formatted_address']
-    
-    def get_latlong_from_address(self, address) -> tuple[str, str]:
-        """Takes an address string and returns a str tuple of latitude and longitude."""
 
-        response = self._client.geocode(address)
-        if response == []:
+    def _parse_geocode(results: list) -> tuple:
+        if results == []:
             return (None, None)
 
-        coordinates = response[0]['geometry']['location']
+        coordinates = results[0]['geometry']['location']
         return (coordinates['lat'], coordinates['lng'])
     
     def get_feet_between_address_and_latlong(self, address: str, latitude: str, longitude: str) -> int|str:
@@ -38,12 +86,54 @@ class Map:
             return 'Address could not be converted to lat/long'
 
         try:
-            feet = geopy.distance.distance((address_lat, address_long), (latitude, longitude)).feet
-            feet = round(float(feet))
+            feet = round(Distance.get_feet(address_lat, address_long, latitude, longitude))
         except Exception as error:
             return 'Distance could not be calculated: ' + str(error)
         return feet
+
+    def get_feet_between_addresses_and_latlongs(self, addresses: list, latitudes: list, longitudes: list) -> list:
+        """Batch version of get_feet_between_address_and_latlong for auditing many workouts at once.
+        Addresses are geocoded (through the cache) one at a time, then all distances are computed in one vectorized call.
+        Each item in the returned list is an int number of feet or an error string, like the single version.
+        """
+
+        results = [None] * len(addresses)
+        indexes = []
+        address_lats = []
+        address_longs = []
+        pin_lats = []
+        pin_longs = []
+
+        for index in range(len(addresses)):
+            (address_lat, address_long) = self.get_latlong_from_address(address=addresses[index])
+            if address_lat == None:
+                results[index] = 'Address could not be converted to lat/long'
+                continue
+
+            try:
+                pin_lats.append(float(latitudes[index]))
+                pin_longs.append(float(longitudes[index]))
+            except (TypeError, ValueError) as error:
+                results[index] = 'Distance could not be calculated: ' + str(error)
+                continue
+
+            indexes.append(index)
+            address_lats.append(address_lat)
+            address_longs.append(address_long)
+
+        if len(indexes) > 0:
+            feet = Distance.get_feet_batch(address_lats, address_longs, pin_lats, pin_longs)
+            for (index, distance) in zip(indexes, feet):
+                if math.isnan(distance):
+                    results[index] = 'Distance could not be calculated: the pin is not a valid lat/long'
+                else:
+                    results[index] = round(float(distance))
+
+        return results
     
+    def get_cache_stats(self) -> dict:
+        return self._cache.get_stats()
+
     def _get_map_safe_str(str: str) -> str:
         return str.replace('+', '%2B').replace(' ', "+")
     
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import threading
+import json
+import time
+
+class MessageStore:
+    """SQLite (WAL) copy of the messages this service has posted to Slack, so a message can be read back
+    without a conversations_history call, and found by the Gravity Forms entry it is about.
+    """
+    _PATH = os.getenv('MESSAGE_STORE_PATH', '/tmp/map_approvals_messages.sqlite')
+    _RETENTION_SECONDS = float(os.getenv('MESSAGE_STORE_RETENTION_SECONDS', '2592000'))
+
+    def __init__(self, path: str|None = None) -> None:
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path or self._PATH, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS messages (
+            channel TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            entry_id TEXT,
+            text TEXT,
+            blocks TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (channel, ts)
+        )''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS messages_entry_id ON messages (entry_id, ts)')
+
+    def save(self, channel: str, ts: str, text: str|None, blocks: list|None, entry_id: str|None = None) -> None:
+        """Records a message. Saving a message that is already stored replaces its text and blocks, and keeps its entry ID unless a new one is given."""
+
+        with self._lock:
+            self._connection.execute('''INSERT INTO messages (channel, ts, entry_id, text, blocks, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                                        ON CONFLICT (channel, ts) DO UPDATE SET text = excluded.text, blocks = excluded.blocks, updated_at = excluded.updated_at,
+                                        entry_id = COALESCE(excluded.entry_id, messages.entry_id)''',
+                                     (channel, ts, entry_id, text, json.dumps(blocks or []), time.time()))
+
+    def get(self, channel: str, ts: str) -> dict|None:
+        """Returns the message as {'channel', 'ts', 'entry_id', 'text', 'blocks'}, or None if it was not recorded."""
+
+        with self._lock:
+            row = self._connection.execute('SELECT channel, ts, entry_id, text, blocks FROM messages WHERE channel = ? AND ts = ?', (channel, ts)).fetchone()
+
+        return None if row is None else MessageStore._to_message(row)
+
+    def get_by_entry_id(self, entryId: str, channel: str|None = None) -> list:
+        """Every recorded message about the entry, newest first."""
+
+        with self._lock:
+            if channel is None:
+                rows = self._connection.execute('SELECT channel, ts, entry_id, text, blocks FROM messages WHERE entry_id = ? ORDER BY ts DESC', (str(entryId),)).fetchall()
+            else:
+                rows = self._connection.execute('SELECT channel, ts, entry_id, text, blocks FROM messages WHERE entry_id = ? AND channel = ? ORDER BY ts DESC', (str(entryId), channel)).fetchall()
+
+        return [MessageStore._to_message(row) for row in rows]
+
+    def purge(self) -> int:
+        """Deletes messages not posted or updated within the retention period. Returns the number removed."""
+
+        with self._lock:
+            cursor = self._connection.execute('DELETE FROM messages WHERE updated_at < ?', (time.time() - self._RETENTION_SECONDS,))
+        return cursor.rowcount
+
+    def _to_message(row: tuple) -> dict:
+        (channel, ts, entry_id, text, blocks) = row
+        return {'channel': channel, 'ts': ts, 'entry_id': entry_id, 'text': text, 'blocks': json.loads(blocks)}
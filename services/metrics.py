@@ -0,0 +1,106 @@
+import threading
+import time
+from contextlib import contextmanager
+from services.tracing import Tracing
+
+class Metrics:
+    """Process wide call counts, error counts and latency histograms, by component (a dependency such as
+    gravity_forms or slack, or handler for dispatcher jobs) and operation. Gauges are read from callbacks when rendered.
+    render() returns everything in the Prometheus text exposition format.
+    """
+    _PREFIX = 'map_approvals_'
+    _BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._series = {}
+        self._gauges = []
+
+    def get_shared() -> 'Metrics':
+        with Metrics._shared_lock:
+            if Metrics._shared is None:
+                Metrics._shared = Metrics()
+            return Metrics._shared
+
+    def observe(self, component: str, operation: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            series = self._series.get((component, operation))
+            if series is None:
+                series = {'count': 0, 'errors': 0, 'sum': 0.0, 'buckets': [0] * len(self._BUCKETS)}
+                self._series[(component, operation)] = series
+
+            series['count'] += 1
+            series['sum'] += seconds
+            if error:
+                series['errors'] += 1
+
+            for index in range(len(self._BUCKETS)):
+                if seconds <= self._BUCKETS[index]:
+                    series['buckets'][index] += 1
+                    break
+
+    @contextmanager
+    def timed(self, component: str, operation: str):
+        """Times the block, which is also a span of the current trace. An exception raised out of it is counted as an error and re-raised."""
+
+        start = time.perf_counter()
+        try:
+            with Tracing.span(component + '.' + operation):
+                yield
+        except BaseException:
+            self.observe(component, operation, time.perf_counter() - start, True)
+            raise
+
+        self.observe(component, operation, time.perf_counter() - start)
+
+    def add_gauge(self, name: str, help: str, callback, label: str|None = None, type: str = 'gauge') -> None:
+        """callback returns a number, or a dict of label value to number when label is given. It is called on every render."""
+
+        with self._lock:
+            self._gauges.append((name, help, callback, label, type))
+
+    def render(self) -> str:
+        with self._lock:
+            series = {key: {'count': value['count'], 'errors': value['errors'], 'sum': value['sum'], 'buckets': list(value['buckets'])}
+                      for (key, value) in sorted(self._series.items())}
+            gauges = list(self._gauges)
+
+        lines = []
+        lines.append('# HELP ' + self._PREFIX + 'calls_total Calls made, by component and operation.')
+        lines.append('# TYPE ' + self._PREFIX + 'calls_total counter')
+        for ((component, operation), value) in series.items():
+            lines.append(self._PREFIX + 'calls_total' + Metrics._labels(component=component, operation=operation) + ' ' + str(value['count']))
+
+        lines.append('# HELP ' + self._PREFIX + 'call_errors_total Calls that raised or returned an error status, by component and operation.')
+        lines.append('# TYPE ' + self._PREFIX + 'call_errors_total counter')
+        for ((component, operation), value) in series.items():
+            lines.append(self._PREFIX + 'call_errors_total' + Metrics._labels(component=component, operation=operation) + ' ' + str(value['errors']))
+
+        lines.append('# HELP ' + self._PREFIX + 'call_duration_seconds Call latency, by component and operation.')
+        lines.append('# TYPE ' + self._PREFIX + 'call_duration_seconds histogram')
+        for ((component, operation), value) in series.items():
+            cumulative = 0
+            for (bound, count) in zip(self._BUCKETS, value['buckets']):
+                cumulative += count
+                lines.append(self._PREFIX + 'call_duration_seconds_bucket' + Metrics._labels(component=component, operation=operation, le=repr(bound)) + ' ' + str(cumulative))
+            lines.append(self._PREFIX + 'call_duration_seconds_bucket' + Metrics._labels(component=component, operation=operation, le='+Inf') + ' ' + str(value['count']))
+            lines.append(self._PREFIX + 'call_duration_seconds_sum' + Metrics._labels(component=component, operation=operation) + ' ' + repr(value['sum']))
+            lines.append(self._PREFIX + 'call_duration_seconds_count' + Metrics._labels(component=component, operation=operation) + ' ' + str(value['count']))
+
+        for (name, help, callback, label, type) in gauges:
+            lines.append('# HELP ' + self._PREFIX + name + ' ' + help)
+            lines.append('# TYPE ' + self._PREFIX + name + ' ' + type)
+            value = callback()
+            if label is None:
+                lines.append(self._PREFIX + name + ' ' + str(value))
+            else:
+                for (labelValue, number) in sorted(value.items()):
+                    lines.append(self._PREFIX + name + Metrics._labels(**{label: labelValue}) + ' ' + str(number))
+
+        return '\n'.join(lines) + '\n'
+
+    def _labels(**labels) -> str:
+        escaped = [name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for (name, value) in labels.items()]
+        return '{' + ','.join(escaped) + '}'
@@ -1,9 +1,14 @@
 import logging
 import os
+import threading
+import time
 from enum import Enum, auto
-from slack_sdk import WebClient
 from datetime import datetime
 import pytz
+from services.cache import TTLCache, MISSING
+from services.message_store import MessageStore
+from services.job_store import JobStore
+from services.metrics import Metrics
 
 class Action_Value(Enum):
     Approve = auto()
@@ -23,37 +28,263 @@ class Button_Style(Enum):
     primary = 1
     danger = 2
 
+class _Token_Bucket:
+    """Allows rate_per_second calls on average with bursts of up to burst calls. pause() stops all calls until Slack's Retry-After has passed."""
+
+    def __init__(self, rate_per_second: float, burst: int) -> None:
+        self._rate_per_second = rate_per_second
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self) -> float:
+        """Takes a token and returns 0, or returns the seconds to wait before trying again. For callers that can not block."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate_per_second)
+            self._updated_at = now
+
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return max(self._paused_until - now, (1 - self._tokens) / self._rate_per_second)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
 class Slack:
     _MAP_CHANNEL_ID = os.getenv('SLACK_MAP_CHANNEL_ID')
     _TOKEN = os.getenv('SLACK_BOT_TOKEN')
+    _API_BASE_URL = os.getenv('SLACK_API_BASE_URL', 'https://slack.com/api/')
+    _USER_CACHE_REFRESH_SECONDS = float(os.getenv('SLACK_USER_CACHE_REFRESH_SECONDS', '3600'))
+    _USER_CACHE_TTL_SECONDS = float(os.getenv('SLACK_USER_CACHE_TTL_SECONDS', '604800'))
+    _WARM_USER_CACHE = os.getenv('SLACK_WARM_USER_CACHE', '').lower() in ('1', 'true', 'yes')
+    _POST_RATE_PER_SECOND = float(os.getenv('SLACK_POST_RATE_PER_SECOND', '1'))
+    _POST_BURST = int(os.getenv('SLACK_POST_BURST', '3'))
+    _RATE_LIMIT_RETRIES = int(os.getenv('SLACK_RATE_LIMIT_RETRIES', '3'))
+    _COALESCE_THREAD_REPLIES = os.getenv('SLACK_COALESCE_THREAD_REPLIES', 'true').lower() in ('1', 'true', 'yes')
+    _MAX_REPLY_LENGTH = 3000
 
-    def __init__(self):
-        self._client = WebClient(token=self._TOKEN)
+    def __init__(self, message_store: MessageStore|None = None):
+        self._web_client = None
+        self._web_client_lock = threading.Lock()
+        self._message_store = message_store
+        self._message_store_ready = False
+        self._message_store_lock = threading.Lock()
+        self._user_cache = TTLCache(max_size=5000, ttl_seconds=self._USER_CACHE_TTL_SECONDS)
+        self._user_refreshes = set()
+        self._user_refreshes_lock = threading.Lock()
+        self._post_buckets = {}
+        self._post_buckets_lock = threading.Lock()
+
+        if self._WARM_USER_CACHE:
+            threading.Thread(target=self.warm_user_cache, name='slack-user-cache', daemon=True).start()
         
+    @property
+    def _client(self):
+        """The Slack WebClient, created on first use so that importing slack_sdk does not slow down startup."""
+
+        with self._web_client_lock:
+            if self._web_client is None:
+                from slack_sdk import WebClient
+                self._web_client = WebClient(token=self._TOKEN, base_url=self._API_BASE_URL)
+            return self._web_client
+
+    @property
+    def _messages(self) -> MessageStore:
+        """The local message store, opened and purged of old messages on first use so that SQLite stays off startup."""
+
+        with self._message_store_lock:
+            if not self._message_store_ready:
+                if self._message_store is None:
+                    self._message_store = MessageStore()
+                self._message_store.purge()
+                self._message_store_ready = True
+            return self._message_store
+
     def get_display_name(self, userId: str) -> str:
-        user = self._client.users_profile_get(user=userId)
-        return user['profile']['display_name_normalized']
+        """Returns the user's display name from the cache when possible.
+        Names older than SLACK_USER_CACHE_REFRESH_SECONDS are still returned, but refreshed in the background.
+        """
+
+        cached = self._user_cache.get(userId, MISSING)
+        if cached is MISSING:
+            return self._fetch_display_name(userId)
+
+        (display_name, fetched_at) = cached
+        if time.monotonic() - fetched_at > self._USER_CACHE_REFRESH_SECONDS:
+            self._refresh_display_name_in_background(userId)
+
+        return display_name
+
+    def warm_user_cache(self) -> int:
+        """Loads every workspace user's display name with users_list, a page at a time. Returns the number cached."""
+
+        count = 0
+        cursor = None
+        try:
+            while True:
+                response = self._call(self._client.users_list, cursor=cursor, limit=200)
+                fetched_at = time.monotonic()
+                for member in response['members']:
+                    if 'profile' in member:
+                        self._user_cache.set(member['id'], (member['profile'].get('display_name_normalized', ''), fetched_at))
+                        count += 1
+
+                cursor = response.get('response_metadata', {}).get('next_cursor')
+                if not cursor:
+                    break
+        except Exception:
+            logging.exception('Failed to warm the Slack user cache.')
+
+        logging.info('Cached ' + str(count) + ' Slack display names.')
+        return count
+
+    def _fetch_display_name(self, userId: str) -> str:
+        user = self._call(self._client.users_profile_get, user=userId)
+        display_name = user['profile']['display_name_normalized']
+        self._user_cache.set(userId, (display_name, time.monotonic()))
+        return display_name
+
+    def _refresh_display_name_in_background(self, userId: str) -> None:
+        with self._user_refreshes_lock:
+            if userId in self._user_refreshes:
+                return
+            self._user_refreshes.add(userId)
+
+        def refresh():
+            try:
+                self._fetch_display_name(userId)
+            except Exception:
+                logging.exception('Failed to refresh Slack display name for ' + userId + '.')
+            finally:
+                with self._user_refreshes_lock:
+                    self._user_refreshes.discard(userId)
+
+        threading.Thread(target=refresh, name='slack-user-refresh', daemon=True).start()
 
     def get_msg(self, ts: str, channel: str|None = None) -> dict:
+        """Returns the message from the local message store, and only reads the channel history for messages it did not record."""
+
         channel = channel or self._MAP_CHANNEL_ID
-        response = self._client.conversations_history(channel=channel, inclusive=True, oldest=ts, limit=1)
-        a = response['messages']
-        return response['messages'][0]
+        message = self._get_stored_msg(channel, ts)
+        if message is not None:
+            return message
+
+        response = self._call(self._client.conversations_history, channel=channel, inclusive=True, oldest=ts, limit=1)
+        message = response['messages'][0]
+        self._store_msg(channel, ts, message)
+        return message
+
+    def _get_stored_msg(self, channel: str, ts: str) -> dict|None:
+        return self._messages.get(channel, ts)
+
+    def _store_msg(self, channel: str, ts: str, message: dict) -> None:
+        self._messages.save(channel, ts, message.get('text'), message.get('blocks'))
+
+    def get_msg_by_entry_id(self, entryId: str, channel: str|None = None) -> dict|None:
+        """The newest message posted about the Gravity Forms entry, or None if this service has no record of one."""
+
+        messages = self._messages.get_by_entry_id(entryId, channel or self._MAP_CHANNEL_ID)
+        return messages[0] if len(messages) > 0 else None
     
-    def post_msg_to_channel(self, text: str, blocks: list|None = None, thread_ts: str|None = None, unfurl: bool = False, channel: str = None) -> tuple[str, str]:
+    def post_msg_to_channel(self, text: str, blocks: list|None = None, thread_ts: str|None = None, unfurl: bool = False, channel: str = None, entry_id: str|None = None) -> tuple[str, str]:
+        """Posts the message and records it in the message store, under entry_id when given. Thread replies are not recorded."""
+
         if channel is None:
             channel = self._MAP_CHANNEL_ID
 
-        response = self._client.chat_postMessage(channel=channel, text=text, blocks=blocks, thread_ts=thread_ts, unfurl_links=unfurl, unfurl_media=unfurl)
+        response = self._call_rate_limited(self._client.chat_postMessage, channel=channel, text=text, blocks=blocks, thread_ts=thread_ts, unfurl_links=unfurl, unfurl_media=unfurl)
+        JobStore.record_write('posted to Slack')
+        if thread_ts is None:
+            self._record_message(response, text, blocks, entry_id)
+
         logging.info('Posted request to Slack. Done handling.')
         return (response['channel'], response["ts"])
 
+    def post_thread_replies(self, texts: list, thread_ts: str, channel: str|None = None) -> None:
+        """Posts each text as a reply in the thread. With SLACK_COALESCE_THREAD_REPLIES on (the default) the texts are
+        folded into as few messages as possible, each under Slack's recommended length, instead of one message per text.
+        """
+
+        if not self._COALESCE_THREAD_REPLIES:
+            for text in texts:
+                self.post_msg_to_channel(text, thread_ts=thread_ts, channel=channel)
+            return
+
+        message = ''
+        for text in texts:
+            if len(message) > 0 and len(message) + len(text) + 2 > self._MAX_REPLY_LENGTH:
+                self.post_msg_to_channel(message, thread_ts=thread_ts, channel=channel)
+                message = ''
+
+            message = text if len(message) == 0 else message + '\n\n' + text
+
+        if len(message) > 0:
+            self.post_msg_to_channel(message, thread_ts=thread_ts, channel=channel)
+
     def replace_msg(self, original_message: dict, ts: str, channel: str|None = None, text: str|None = None, blocks: dict|None = None) -> None:
         channel = channel or self._MAP_CHANNEL_ID
         text = text or original_message['text']
         blocks = blocks or original_message['blocks']
 
-        self._client.chat_update(channel=channel, ts=ts, blocks=blocks, text=text)
+        response = self._call_rate_limited(self._client.chat_update, channel=channel, ts=ts, blocks=blocks, text=text)
+        JobStore.record_write('updated a Slack message')
+        self._record_message(response, text, blocks)
+
+    def _record_message(self, response, text: str, blocks: list|None, entry_id: str|None = None) -> None:
+        # Prefer the message Slack sends back, since it includes the block_ids Slack assigned.
+        message = response.get('message') or {}
+        self._messages.save(response['channel'], response['ts'], message.get('text', text), message.get('blocks', blocks), entry_id)
+
+    def _get_post_bucket(self, channel: str) -> _Token_Bucket:
+        with self._post_buckets_lock:
+            if channel not in self._post_buckets:
+                self._post_buckets[channel] = _Token_Bucket(self._POST_RATE_PER_SECOND, self._POST_BURST)
+            return self._post_buckets[channel]
+
+    def _call(self, method, **kwargs):
+        """Calls a Slack Web API method, recording it in Metrics under the method's name."""
+
+        with Metrics.get_shared().timed('slack', method.__name__):
+            return method(**kwargs)
+
+    def _call_rate_limited(self, method, **kwargs):
+        """Calls a Slack Web API method that writes to a channel, spacing calls per channel with a token bucket.
+        On a 429 the whole channel waits for Retry-After, then the call is retried up to SLACK_RATE_LIMIT_RETRIES times.
+        """
+
+        from slack_sdk.errors import SlackApiError
+
+        channel = kwargs['channel']
+        bucket = self._get_post_bucket(channel)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return self._call(method, **kwargs)
+            except SlackApiError as error:
+                if error.response.status_code != 429 or attempt >= self._RATE_LIMIT_RETRIES:
+                    raise
+
+                attempt += 1
+                retry_after = float(error.response.headers.get('Retry-After', 1))
+                logging.warning('Slack rate limited channel ' + channel + '. Retrying in ' + str(retry_after) + ' seconds.')
+                bucket.pause(retry_after)
     
     def _create_view(title: str, blocks: list, callback_id: str|None = None, cancel_text: str|None = None, submit_text: str|None = None, notify_on_close: bool = False) -> dict:
         """title, submit_text, and cancel_text are limited to 24 characters. callback_id is limited to 255. Anything longer will be truncated."""
@@ -85,11 +316,11 @@ class Slack:
     
     def open_modal(self, interactivePayload: dict, title: str, blocks: list, cancel_text: str|None = None, submit_text: str|None = None, notify_on_close: bool = False, callback_id: str|None = None) -> None:
         view = Slack._create_view(callback_id=callback_id, title=title, blocks=blocks, cancel_text=cancel_text, submit_text=submit_text, notify_on_close=notify_on_close)
-        return self._client.views_open(trigger_id=interactivePayload['trigger_id'], view=view)
+        return self._call(self._client.views_open, trigger_id=interactivePayload['trigger_id'], view=view)
     
     def update_modal(self, view_id: str, title: str, blocks: list, cancel_text: str|None = None, submit_text: str|None = None, notify_on_close: bool = False, callback_id: str|None = None) -> None:
         view = Slack._create_view(callback_id=callback_id, title=title, blocks=blocks, cancel_text=cancel_text, submit_text=submit_text, notify_on_close=notify_on_close)
-        self._client.views_update(view_id=view_id, view=view)
+        self._call(self._client.views_update, view_id=view_id, view=view)
     
     def convert_ts_to_et(ts: str) -> str:
         """Takes the Slack timestamp, which is in UTC Epoch, and converts it to a string based in Eastern Time."""
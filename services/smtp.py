@@ -1,22 +1,53 @@
 import os
+import logging
 import smtplib
 import ssl
+import threading
+import time
+import atexit
 from email.message import EmailMessage
+from services.metrics import Metrics
+from services.job_store import JobStore
+from services.dispatcher import Job_Type
 
 class SMTP:
+    """Sends email over a pool of up to SMTP_CONNECTIONS authenticated connections, kept open between messages and
+    replaced once idle for SMTP_IDLE_SECONDS. Handlers call queue_email, which records the email as a job of its own
+    in the dispatcher's JobStore, so it is sent off the Slack action path and a failed send is retried with backoff.
+    """
     _EMAIL_ACCOUNT = os.getenv('EMAIL_ACCOUNT')
     _EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
     _EMAIL_FROM_ADDRESS = os.getenv('EMAIL_FROM_ADDRESS')
+    _HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+    _PORT = int(os.getenv('SMTP_PORT', '587'))
+    _STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')
+    _CONNECTIONS = int(os.getenv('SMTP_CONNECTIONS', '4'))
+    _IDLE_SECONDS = float(os.getenv('SMTP_IDLE_SECONDS', '60'))
 
-    
-    def send_email(self, subject: str, toEmails: list, body: str) -> None:
+    def __init__(self) -> None:
+        self._outbox = None
+        self._idle = [] # (server, last used) for connections not sending right now
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, self._CONNECTIONS))
+        atexit.register(self.close)
 
-        context = ssl.create_default_context()
+    def set_outbox(self, dispatcher) -> None:
+        """Sends queued emails as Job_Type.Email jobs on the dispatcher, which must have send_email registered for them."""
+
+        self._outbox = dispatcher
 
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.ehlo()
-        server.starttls(context=context)
-        server.login(self._EMAIL_ACCOUNT, self._EMAIL_PASSWORD)
+    def queue_email(self, subject: str, toEmails: list, body: str) -> None:
+        """Records the email to be sent by a job of its own and returns. Sends it now when no outbox is set."""
+
+        if self._outbox is None:
+            self.send_email(subject, toEmails, body)
+            return
+
+        self._outbox.enqueue(Job_Type.Email, {'subject': subject, 'toEmails': toEmails, 'body': body})
+        JobStore.record_write('queued an email')
+
+    def send_email(self, subject: str, toEmails: list, body: str) -> None:
+        """Sends the email now. Raises if it could not be sent, so the Email job is retried by the dispatcher."""
 
         message = EmailMessage()
         message['Subject'] = subject
@@ -25,6 +56,86 @@ class SMTP:
         message['Reply-To'] = "map-admins@f3nation.com"
         message.set_content(body, subtype='html')
 
-        server.send_message(message)
+        with self._slots:
+            self._send_with_retry(message, self._take_idle())
+
+        JobStore.record_write('sent an email')
+
+    def close(self) -> None:
+        with self._lock:
+            (idle, self._idle) = (self._idle, [])
+
+        for (server, _) in idle:
+            SMTP._disconnect(server)
+
+    def _take_idle(self):
+        """An open connection from the pool, or None. Connections idle for too long are closed, since the server has likely dropped them."""
+
+        stale = []
+        server = None
+        with self._lock:
+            while len(self._idle) > 0 and server is None:
+                (candidate, last_used) = self._idle.pop()
+                if time.monotonic() - last_used > self._IDLE_SECONDS:
+                    stale.append(candidate)
+                else:
+                    server = candidate
+
+        for candidate in stale:
+            SMTP._disconnect(candidate)
+
+        return server
+
+    def _put_idle(self, server) -> None:
+        with self._lock:
+            self._idle.append((server, time.monotonic()))
+
+    def _send_with_retry(self, message: EmailMessage, server) -> None:
+        """Sends over the pooled connection, or a new one. A pooled connection the server has dropped is replaced once."""
+
+        reconnected = server is None
+        while True:
+            try:
+                server = server or self._connect()
+                with Metrics.get_shared().timed('smtp', 'send_message'):
+                    server.send_message(message)
+                self._put_idle(server)
+                logging.info('Sent email "' + message['Subject'] + '" to ' + message['To'] + '.')
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as error:
+                self._put_idle(server) # The connection is still good
+                logging.error('Email "' + message['Subject'] + '" to ' + message['To'] + ' was refused. Error: ' + str(error))
+                raise
+            except (smtplib.SMTPException, OSError) as error:
+                SMTP._disconnect(server)
+                server = None
+                if reconnected:
+                    logging.error('Could not send email "' + message['Subject'] + '" to ' + message['To'] + '. Error: ' + str(error))
+                    raise
+                logging.warning('Pooled SMTP connection failed sending "' + message['Subject'] + '". Reconnecting. Error: ' + str(error))
+                reconnected = True
+
+    def _connect(self) -> smtplib.SMTP:
+        context = ssl.create_default_context()
+
+        with Metrics.get_shared().timed('smtp', 'connect'):
+            server = smtplib.SMTP(self._HOST, self._PORT)
+            try:
+                server.ehlo()
+                if self._STARTTLS:
+                    server.starttls(context=context)
+                server.login(self._EMAIL_ACCOUNT, self._EMAIL_PASSWORD)
+            except:
+                server.close()
+                raise
+
+        return server
+
+    def _disconnect(server) -> None:
+        if server is None:
+            return
 
-        server.close()
\ No newline at end of file
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
@@ -0,0 +1,86 @@
+import os
+import math
+import numpy
+from services.distance import Distance, Distance_Mode
+from services.gazetteer import Gazetteer
+
+class SpatialIndex:
+    """Grid index over points given in decimal degrees. Points are bucketed into square cells of SPATIAL_INDEX_CELL_DEGREES,
+    so a radius query only measures the points in the cells the radius overlaps, in one vectorized Haversine pass.
+    Not thread safe. The owner (WorkoutHistory) holds its own lock around it.
+    """
+    _CELL_DEGREES = float(os.getenv('SPATIAL_INDEX_CELL_DEGREES', '0.02')) # About 7,000 ft of latitude
+    _FEET_PER_DEGREE_LATITUDE = 364000
+
+    def __init__(self, cell_degrees: float|None = None) -> None:
+        self._cell_degrees = cell_degrees or self._CELL_DEGREES
+        self._cells = {}
+        self._latitudes = []
+        self._longitudes = []
+        self._keys = []
+        self._items = []
+        self._positions = {}
+
+    def _get_cell(self, latitude: float, longitude: float) -> tuple:
+        return (math.floor(latitude / self._cell_degrees), math.floor(longitude / self._cell_degrees))
+
+    def add(self, key: str, latitude, longitude, item) -> bool:
+        """Adds the point, replacing any earlier point with the same key. Returns False if the coordinates are not a valid lat/long."""
+
+        point = Gazetteer.parse_latlong(latitude, longitude)
+        if point is None:
+            return False
+
+        (latitude, longitude) = point
+
+        position = self._positions.get(key)
+        if position is None:
+            position = len(self._keys)
+            self._positions[key] = position
+            self._latitudes.append(latitude)
+            self._longitudes.append(longitude)
+            self._keys.append(key)
+            self._items.append(item)
+        else:
+            self._cells[self._get_cell(self._latitudes[position], self._longitudes[position])].remove(position)
+            self._latitudes[position] = latitude
+            self._longitudes[position] = longitude
+            self._items[position] = item
+
+        self._cells.setdefault(self._get_cell(latitude, longitude), []).append(position)
+        return True
+
+    def get_size(self) -> int:
+        return len(self._keys)
+
+    def query(self, latitude, longitude, radius_feet: float, limit: int|None = None, exclude_key: str|None = None) -> list:
+        """Returns (feet, item) tuples for the points within radius_feet, nearest first. Returns [] if the coordinates are not a valid lat/long."""
+
+        point = Gazetteer.parse_latlong(latitude, longitude)
+        if point is None:
+            return []
+
+        (latitude, longitude) = point
+
+        radiusLatitude = radius_feet / self._FEET_PER_DEGREE_LATITUDE
+        radiusLongitude = radiusLatitude / max(math.cos(math.radians(latitude)), 0.01)
+        (firstRow, firstColumn) = self._get_cell(latitude - radiusLatitude, longitude - radiusLongitude)
+        (lastRow, lastColumn) = self._get_cell(latitude + radiusLatitude, longitude + radiusLongitude)
+
+        positions = []
+        for row in range(firstRow, lastRow + 1):
+            for column in range(firstColumn, lastColumn + 1):
+                positions.extend(self._cells.get((row, column), []))
+
+        if exclude_key is not None and exclude_key in self._positions:
+            positions = [position for position in positions if position != self._positions[exclude_key]]
+
+        if len(positions) == 0:
+            return []
+
+        feet = Distance.get_feet_batch(latitude, longitude, [self._latitudes[position] for position in positions], [self._longitudes[position] for position in positions], Distance_Mode.Haversine)
+        order = [index for index in numpy.argsort(feet, kind='stable') if feet[index] <= radius_feet]
+        if limit is not None:
+            order = order[:limit]
+
+        return [(float(feet[index]), self._items[positions[index]]) for index in order]
@@ -0,0 +1,178 @@
+import os
+import sys
+import logging
+import threading
+import contextvars
+import json
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+class _Trace:
+    def __init__(self, trace_id: str, name: str) -> None:
+        self.trace_id = trace_id
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self.threads = Counter() # Open spans by thread ident, so only threads working on the trace are sampled
+        self.samples = Counter()
+        self.lock = threading.Lock()
+
+
+class Tracing:
+    """Per-job timing spans. A trace is opened around each dispatcher job and every span recorded while it is
+    the current trace (including on lookup threads started with wrap) is logged as one JSON breakdown when it ends.
+    Setting TRACE_PROFILE_THRESHOLD_SECONDS turns on a sampling profiler that reads the stacks of threads working
+    on a trace with sys._current_frames, and dumps them in collapsed stack format for jobs slower than the threshold.
+    """
+    _PROFILE_THRESHOLD_SECONDS = float(os.getenv('TRACE_PROFILE_THRESHOLD_SECONDS', '0')) # 0 turns profiling off
+    _PROFILE_INTERVAL_SECONDS = float(os.getenv('TRACE_PROFILE_INTERVAL_SECONDS', '0.01'))
+    _PROFILE_DIRECTORY = os.getenv('TRACE_PROFILE_DIRECTORY') # Profiles are logged when not set
+    _PROFILE_MAX_DEPTH = 64
+    _current = contextvars.ContextVar('trace', default=None)
+    _depth = contextvars.ContextVar('trace_depth', default=0)
+    _active = {}
+    _active_lock = threading.Lock()
+    _sampler = None
+
+    @contextmanager
+    def trace(name: str, trace_id: str|None = None):
+        """Opens a trace for the block, usually a whole job. Yields the trace ID."""
+
+        trace = _Trace(trace_id or uuid.uuid4().hex[:12], name)
+        token = Tracing._current.set(trace)
+        Tracing._start_profiling(trace)
+        try:
+            with Tracing.span(name):
+                yield trace.trace_id
+        finally:
+            Tracing._stop_profiling(trace)
+            Tracing._current.reset(token)
+            Tracing._emit(trace)
+
+    @contextmanager
+    def span(name: str):
+        """Times the block as a span of the current trace. Does nothing when there is no current trace."""
+
+        trace = Tracing._current.get()
+        if trace is None:
+            yield
+            return
+
+        depth = Tracing._depth.get()
+        token = Tracing._depth.set(depth + 1)
+        ident = threading.get_ident()
+        with trace.lock:
+            trace.threads[ident] += 1
+
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            Tracing._depth.reset(token)
+            with trace.lock:
+                trace.threads[ident] -= 1
+            Tracing._add_span(trace, name, start, time.perf_counter() - start, depth, error)
+
+    def record(name: str, seconds: float, error: bool = False) -> None:
+        """Adds a span that has already finished, for calls that are timed elsewhere."""
+
+        trace = Tracing._current.get()
+        if trace is not None:
+            Tracing._add_span(trace, name, time.perf_counter() - seconds, seconds, Tracing._depth.get(), error)
+
+    def get_trace_id() -> str|None:
+        trace = Tracing._current.get()
+        return None if trace is None else trace.trace_id
+
+    def wrap(function):
+        """Returns function bound to the caller's trace, for handing to another thread or executor. Each run is a span named after the function."""
+
+        context = contextvars.copy_context()
+        return lambda *args, **kwargs: context.run(Tracing._run_in_span, function, args, kwargs)
+
+    def _run_in_span(function, args: tuple, kwargs: dict):
+        with Tracing.span(getattr(function, '__name__', 'task')):
+            return function(*args, **kwargs)
+
+    def _add_span(trace: _Trace, name: str, start: float, seconds: float, depth: int, error: bool) -> None:
+        span = {'name': name,
+                'start_ms': round((start - trace.started_at) * 1000, 1),
+                'duration_ms': round(seconds * 1000, 1),
+                'depth': depth,
+                'thread': threading.current_thread().name}
+        if error:
+            span['error'] = True
+
+        with trace.lock:
+            trace.spans.append(span)
+
+    def _emit(trace: _Trace) -> None:
+        seconds = time.perf_counter() - trace.started_at
+        with trace.lock:
+            spans = sorted(trace.spans, key=lambda span: span['start_ms'])
+            samples = Counter(trace.samples)
+
+        logging.info('Trace ' + trace.trace_id + ' ' + json.dumps({'trace_id': trace.trace_id, 'name': trace.name, 'duration_ms': round(seconds * 1000, 1), 'spans': spans}))
+
+        if Tracing._PROFILE_THRESHOLD_SECONDS > 0 and seconds >= Tracing._PROFILE_THRESHOLD_SECONDS and len(samples) > 0:
+            Tracing._dump_profile(trace, seconds, samples)
+
+    def _dump_profile(trace: _Trace, seconds: float, samples: Counter) -> None:
+        collapsed = '\n'.join(stack + ' ' + str(count) for (stack, count) in samples.most_common())
+        if Tracing._PROFILE_DIRECTORY:
+            path = os.path.join(Tracing._PROFILE_DIRECTORY, trace.name + '-' + trace.trace_id + '.folded')
+            try:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(collapsed + '\n')
+                logging.warning('Trace ' + trace.trace_id + ' (' + trace.name + ') took ' + str(round(seconds, 1)) + ' seconds. Profile written to ' + path + '.')
+                return
+            except OSError as error:
+                logging.error('Could not write profile to ' + path + '. Error: ' + str(error))
+
+        logging.warning('Trace ' + trace.trace_id + ' (' + trace.name + ') took ' + str(round(seconds, 1)) + ' seconds. Profile:\n' + collapsed)
+
+    def _start_profiling(trace: _Trace) -> None:
+        if Tracing._PROFILE_THRESHOLD_SECONDS <= 0:
+            return
+
+        with Tracing._active_lock:
+            Tracing._active[trace.trace_id] = trace
+            if Tracing._sampler is None:
+                Tracing._sampler = threading.Thread(target=Tracing._sample, name='trace-sampler', daemon=True)
+                Tracing._sampler.start()
+
+    def _stop_profiling(trace: _Trace) -> None:
+        with Tracing._active_lock:
+            Tracing._active.pop(trace.trace_id, None)
+
+    def _sample() -> None:
+        while True:
+            time.sleep(Tracing._PROFILE_INTERVAL_SECONDS)
+            with Tracing._active_lock:
+                traces = list(Tracing._active.values())
+            if len(traces) == 0:
+                continue
+
+            frames = sys._current_frames()
+            for trace in traces:
+                with trace.lock:
+                    threads = [threadId for (threadId, count) in trace.threads.items() if count > 0]
+
+                for threadId in threads:
+                    frame = frames.get(threadId)
+                    if frame is None:
+                        continue
+
+                    stack = []
+                    while frame is not None and len(stack) < Tracing._PROFILE_MAX_DEPTH:
+                        stack.append(frame.f_code.co_name + ' (' + os.path.basename(frame.f_code.co_filename) + ':' + str(frame.f_lineno) + ')')
+                        frame = frame.f_back
+
+                    with trace.lock:
+                        trace.samples[';'.join(reversed(stack))] += 1
@@ -0,0 +1,144 @@
+import os
+import logging
+import threading
+from services.google_sheets import GoogleSheets
+from services.spatial_index import SpatialIndex
+
+class WorkoutHistory:
+    """In-memory snapshot of the workouts dataset from the workout history spreadsheet.
+    Rows are stored by column with an Entry ID index, so a lookup is a dict hit instead of an Apps Script round trip.
+    The snapshot is reloaded in one request every WORKOUT_HISTORY_REFRESH_SECONDS. Entries missing from it
+    are fetched one at a time with GoogleSheets.get_single_entity and added.
+    Every workout's coordinates are also kept in a SpatialIndex for get_nearby.
+    """
+    _REFRESH_SECONDS = float(os.getenv('WORKOUT_HISTORY_REFRESH_SECONDS', '900'))
+    _DATASET = 'workouts'
+    _ENTRY_ID_COLUMN = 'Entry ID'
+    _NEARBY_FIELDS = ('Entry ID', 'Workout Name', 'Region', 'Weekday', 'Time')
+
+    def __init__(self, google_sheets: GoogleSheets) -> None:
+        self._google_sheets = google_sheets
+        self._lock = threading.Lock()
+        self._fields = []
+        self._columns = {}
+        self._index = {}
+        self._spatial_index = SpatialIndex()
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Loads the snapshot and keeps it refreshed on a background thread."""
+
+        threading.Thread(target=self._refresh_periodically, name='workout-history', daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def load(self) -> bool:
+        """Replaces the snapshot with a fresh copy of the whole dataset. Returns False if the dataset could not be pulled."""
+
+        data = self._google_sheets.get_dataset(self._DATASET)
+        if len(data) == 0:
+            return False
+
+        # Same as get_single_entity, the last column of the sheet is not part of the entity.
+        fields = [str(field) for field in data[0][:len(data[0])-1]]
+        if self._ENTRY_ID_COLUMN not in fields:
+            logging.error('Workout history dataset has no "' + self._ENTRY_ID_COLUMN + '" column. Snapshot not loaded.')
+            return False
+
+        columns = {field: [] for field in fields}
+        index = {}
+        spatialIndex = SpatialIndex()
+        entryIdPosition = fields.index(self._ENTRY_ID_COLUMN)
+        for row in data[1:]:
+            index[str(row[entryIdPosition])] = len(index)
+            for position in range(len(fields)):
+                columns[fields[position]].append(row[position])
+            WorkoutHistory._add_to_spatial_index(spatialIndex, {fields[position]: row[position] for position in range(len(fields))})
+
+        with self._lock:
+            self._fields = fields
+            self._columns = columns
+            self._index = index
+            self._spatial_index = spatialIndex
+
+        logging.info('Loaded ' + str(len(index)) + ' workouts into the workout history snapshot.')
+        return True
+
+    def get_entity(self, entryId: str) -> dict:
+        """Returns the workout's previous values keyed by column name, or {} if it can not be found."""
+
+        entity = self.get_snapshot_entity(entryId)
+        if entity is not None:
+            return entity
+
+        entity = self._google_sheets.get_single_entity(entryId)
+        if len(entity) > 0:
+            self.add_entity(entity)
+
+        return entity
+
+    def get_snapshot_entity(self, entryId: str) -> dict|None:
+        """Like get_entity, but only reads the snapshot. Returns None when the entry is not in it."""
+
+        with self._lock:
+            row = self._index.get(str(entryId))
+            if row is None:
+                return None
+
+            return {field: self._columns[field][row] for field in self._fields}
+
+    def get_column(self, field: str) -> list:
+        """A copy of one column across every workout in the snapshot, in row order."""
+
+        with self._lock:
+            return list(self._columns.get(field, []))
+
+    def get_nearby(self, latitude, longitude, radius_feet: float, limit: int|None = None, exclude_entry_id: str|None = None) -> list:
+        """Workouts within radius_feet of the point, nearest first, as dicts of Entry ID, Workout Name, Region, Weekday,
+        Time and Feet. Returns [] if the coordinates are not numbers.
+        """
+
+        with self._lock:
+            nearby = self._spatial_index.query(latitude, longitude, radius_feet, limit, None if exclude_entry_id is None else str(exclude_entry_id))
+
+        return [dict(item, Feet=round(feet)) for (feet, item) in nearby]
+
+    def _add_to_spatial_index(spatialIndex: SpatialIndex, entity: dict) -> None:
+        item = {field: entity.get(field, '') for field in WorkoutHistory._NEARBY_FIELDS}
+        spatialIndex.add(str(entity.get(WorkoutHistory._ENTRY_ID_COLUMN)), entity.get('Latitude'), entity.get('Longitude'), item)
+
+    def get_size(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def add_entity(self, entity: dict) -> None:
+        """Adds or replaces one workout in the snapshot, e.g. after fetching it with get_single_entity."""
+
+        with self._lock:
+            if len(self._fields) == 0 or self._ENTRY_ID_COLUMN not in entity:
+                return
+
+            entryId = str(entity[self._ENTRY_ID_COLUMN])
+            row = self._index.get(entryId)
+            for field in self._fields:
+                value = entity.get(field, '')
+                if row is None:
+                    self._columns[field].append(value)
+                else:
+                    self._columns[field][row] = value
+
+            if row is None:
+                self._index[entryId] = len(self._index)
+
+            WorkoutHistory._add_to_spatial_index(self._spatial_index, entity)
+
+    def _refresh_periodically(self) -> None:
+        while True:
+            try:
+                self.load()
+            except Exception:
+                logging.exception('Failed to refresh the workout history snapshot.')
+
+            if self._stopped.wait(self._REFRESH_SECONDS):
+                return